@@ -1,5 +1,5 @@
 from collections import namedtuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 
 @dataclass
@@ -12,8 +12,8 @@ class int_1d_data:
 
 @dataclass
 class int_2d_data:
-    raw: np.ndarray = np.arange(1)
-    pcount: np.ndarray = np.arange(1)
-    norm: np.ndarray = np.arange(1)
-    ttheta: np.ndarray = np.arange(1)
-    q: np.ndarray = np.arange(1)
+    raw: np.ndarray = field(default_factory=lambda: np.arange(1))
+    pcount: np.ndarray = field(default_factory=lambda: np.arange(1))
+    norm: np.ndarray = field(default_factory=lambda: np.arange(1))
+    ttheta: np.ndarray = field(default_factory=lambda: np.arange(1))
+    q: np.ndarray = field(default_factory=lambda: np.arange(1))
@@ -0,0 +1,396 @@
+"""
+Persistent indexes of directory contents.
+
+A DirectoryIndex records the path, size and modification time
+of every file in one directory, in an SQLite database.
+Each refresh() stats the directory once and stamps new or changed files
+with a new generation number, so that pollers can ask for
+only the files that appeared or changed since their last call
+(new_since()), instead of re-globbing and re-processing the whole directory.
+The database lives in the paws scratch directory by default,
+so the index survives restarts.
+
+A HeaderCatalogue records the contents of sample header files
+(YAML headers, or text headers written by SPEC)
+in typed columns of an SQLite database, keyed by path, size and mtime.
+Headers are parsed once when they are ingested,
+after which queries by time, temperature or reaction_id
+return file lists without reading the headers again.
+"""
+from collections import OrderedDict
+import fnmatch
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from threading import Condition
+
+from . import pawstools
+
+index_dir = os.path.join(pawstools.paws_scratch_dir,'file_index')
+
+@functools.lru_cache(maxsize=256)
+def compile_glob(pattern):
+    """Return a compiled regex matching file names against a unix-like `pattern`"""
+    return re.compile(fnmatch.translate(pattern))
+
+@functools.lru_cache(maxsize=256)
+def compile_regex(regex):
+    """Return the compiled `regex`, cached across calls"""
+    return re.compile(regex)
+
+class DirectoryIndex(object):
+    """Persistent index of the files in one directory.
+
+    Files are recorded as (name, size, mtime, gen) rows,
+    where gen is the generation of the refresh that last saw the file change.
+    Generation numbers serve as cursors for new_since().
+    """
+
+    def __init__(self,dir_path,db_path=None):
+        self.dir_path = dir_path
+        if db_path is None:
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            db_name = hashlib.sha1(os.path.abspath(dir_path).encode()).hexdigest()+'.db'
+            db_path = os.path.join(index_dir,db_name)
+        self.db_path = db_path
+        self.lock = Condition()
+        # in-memory copy of the files table, valid at generation self._known_gen
+        self._known = None
+        self._known_gen = None
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('CREATE TABLE IF NOT EXISTS files '
+                        '(name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, gen INTEGER)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS files_gen ON files (gen)')
+                    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+                    conn.execute("INSERT OR IGNORE INTO meta VALUES ('gen',0)")
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path,timeout=30.)
+
+    @property
+    def generation(self):
+        """Generation number of the latest refresh that found changes"""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT value FROM meta WHERE key='gen'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def refresh(self):
+        """Stat the directory and record new, changed and removed files.
+
+        Returns the current generation number.
+        """
+        found = OrderedDict()
+        with os.scandir(self.dir_path) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    # removed while scanning
+                    continue
+                found[entry.name] = (st.st_size,st.st_mtime_ns)
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    gen = conn.execute("SELECT value FROM meta WHERE key='gen'").fetchone()[0]
+                    if self._known is None or gen != self._known_gen:
+                        # first refresh, or another process updated the index
+                        self._known = dict([(nm,(sz,mt)) for nm,sz,mt in
+                            conn.execute('SELECT name, size, mtime FROM files')])
+                    known = self._known
+                    changed = [(nm,sz,mt) for nm,(sz,mt) in found.items() if known.get(nm) != (sz,mt)]
+                    removed = [(nm,) for nm in known if not nm in found]
+                    if changed or removed:
+                        gen += 1
+                        conn.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+                            [(nm,sz,mt,gen) for nm,sz,mt in changed])
+                        conn.executemany('DELETE FROM files WHERE name=?',removed)
+                        conn.execute("UPDATE meta SET value=? WHERE key='gen'",(gen,))
+                        for nm,sz,mt in changed:
+                            known[nm] = (sz,mt)
+                        for (nm,) in removed:
+                            del known[nm]
+                    self._known_gen = gen
+            finally:
+                conn.close()
+        return gen
+
+    def files(self,pattern='*',filter_regex=None,refresh=True):
+        """Return the sorted paths of indexed files matching `pattern` and `filter_regex`.
+
+        `pattern` is a unix-like pattern matched against file names,
+        `filter_regex` is a regex matched against full paths.
+        """
+        return self.new_since(0,pattern,filter_regex,refresh)[0]
+
+    def new_since(self,cursor=None,pattern='*',filter_regex=None,refresh=True):
+        """Return the files added or changed since `cursor`, and a new cursor.
+
+        Pass the returned cursor to the next call to get only files
+        that appear or change after this one.
+        A `cursor` of None or 0 returns all files.
+        See files() for `pattern` and `filter_regex`.
+        """
+        if refresh:
+            self.refresh()
+        conn = self._connect()
+        try:
+            gen = conn.execute("SELECT value FROM meta WHERE key='gen'").fetchone()[0]
+            names = [nm for (nm,) in conn.execute(
+                'SELECT name FROM files WHERE gen > ? AND gen <= ? ORDER BY name',(cursor or 0,gen))]
+        finally:
+            conn.close()
+        rx = compile_glob(pattern)
+        # like glob, hidden files only match patterns that start with a dot
+        hidden_ok = pattern.startswith('.')
+        paths = [os.path.join(self.dir_path,nm) for nm in names
+            if rx.match(nm) and (hidden_ok or not nm.startswith('.'))]
+        if filter_regex is not None:
+            paths = list(filter(compile_regex(filter_regex).match,paths))
+        return paths, gen
+
+    def clear(self):
+        """Remove all files from the index"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM files')
+                self._known = None
+            finally:
+                conn.close()
+
+_indexes = {}
+_indexes_lock = Condition()
+
+def get_index(dir_path,db_path=None):
+    """Return the DirectoryIndex for `dir_path`, shared within the process"""
+    key = (dir_path,db_path)
+    with _indexes_lock:
+        if not key in _indexes:
+            _indexes[key] = DirectoryIndex(dir_path,db_path)
+        return _indexes[key]
+
+catalogue_path = os.path.join(pawstools.paws_scratch_dir,'header_catalogue.db')
+
+# header fields stored in their own typed columns
+header_columns = OrderedDict(
+    time='REAL',
+    temperature='REAL',
+    reaction_id='TEXT',
+    sample_id='TEXT')
+
+# sqlite limits the number of parameters in one statement
+_max_params = 500
+
+def _column_value(value,col_type):
+    if value is None:
+        return None
+    if col_type == 'REAL':
+        try:
+            return float(value)
+        except (TypeError,ValueError):
+            return None
+    return str(value)
+
+class HeaderCatalogue(object):
+    """Persistent catalogue of sample header contents.
+
+    Headers are recorded as (path, size, mtime, ..., header) rows,
+    with one typed column for each of the header_columns,
+    and the whole header stored as JSON.
+    ingest() parses only headers that are new or changed since they were last ingested.
+    """
+
+    def __init__(self,db_path=None):
+        if db_path is None:
+            db_path = catalogue_path
+        self.db_path = db_path
+        self.lock = Condition()
+        cols = ''.join([', {} {}'.format(nm,tp) for nm,tp in header_columns.items()])
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('CREATE TABLE IF NOT EXISTS headers '
+                        '(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER'+cols+', header TEXT)')
+                    for nm in header_columns:
+                        conn.execute('CREATE INDEX IF NOT EXISTS headers_{0} ON headers ({0})'.format(nm))
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path,timeout=30.)
+
+    def _stamps(self,conn,paths):
+        stamps = {}
+        for i0 in range(0,len(paths),_max_params):
+            chunk = paths[i0:i0+_max_params]
+            stamps.update([(pth,(sz,mt)) for pth,sz,mt in conn.execute(
+                'SELECT path, size, mtime FROM headers WHERE path IN ({})'.format(
+                ','.join('?'*len(chunk))),chunk)])
+        return stamps
+
+    def ingest(self,paths,read_header,n_workers=1):
+        """Record the headers at `paths` that are not yet catalogued or have changed.
+
+        `read_header` is a function that takes a header path and returns the header as a dict,
+        e.g. the read_header() method of a Read workflow.
+        With `n_workers` > 1, headers are parsed by a thread pool.
+        Paths that do not exist are removed from the catalogue.
+        Headers that cannot be read (`read_header` raises or does not return a dict)
+        are recorded without contents, so that they read back as None
+        and are parsed again only once they change.
+        Returns the list of paths that were (re)parsed.
+        """
+        paths = [os.path.abspath(pth) for pth in paths]
+        found = OrderedDict()
+        missing = []
+        for pth in paths:
+            try:
+                st = os.stat(pth)
+            except OSError:
+                missing.append((pth,))
+                continue
+            found[pth] = (st.st_size,st.st_mtime_ns)
+        conn = self._connect()
+        try:
+            known = self._stamps(conn,list(found.keys()))
+        finally:
+            conn.close()
+        changed = [pth for pth,stamp in found.items() if known.get(pth) != stamp]
+        def safe_read_header(pth):
+            try:
+                return read_header(pth)
+            except Exception:
+                return None
+        if n_workers > 1:
+            hdrs = pawstools.prefetch(safe_read_header,changed,n_workers)
+        else:
+            hdrs = map(safe_read_header,changed)
+        rows = []
+        for pth,hdr in zip(changed,hdrs):
+            sz,mt = found[pth]
+            if not isinstance(hdr,dict):
+                rows.append((pth,sz,mt)+(None,)*len(header_columns)+(None,))
+                continue
+            hdr = pawstools.primitives(hdr)
+            rows.append((pth,sz,mt)
+                +tuple([_column_value(hdr.get(nm),tp) for nm,tp in header_columns.items()])
+                +(json.dumps(hdr,default=str),))
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO headers VALUES ({})'.format(
+                        ','.join('?'*(len(header_columns)+4))),rows)
+                    conn.executemany('DELETE FROM headers WHERE path=?',missing)
+            finally:
+                conn.close()
+        return changed
+
+    def query(self,dir_path=None,time_range=None,temperature_range=None,
+        reaction_id=None,sample_id=None,order_by='time'):
+        """Return the paths of catalogued headers that match all given criteria.
+
+        `dir_path` selects headers in one directory,
+        `time_range` and `temperature_range` are (lower, upper) bounds,
+        inclusive, either of which can be None,
+        `reaction_id` and `sample_id` are a value or a list of values.
+        Paths are sorted by `order_by`, a header column or 'path'.
+        """
+        if not order_by in list(header_columns.keys())+['path']:
+            raise ValueError('cannot order headers by {}'.format(order_by))
+        where = []
+        params = []
+        if dir_path is not None:
+            where.append('path >= ? AND path < ?')
+            prefix = os.path.join(os.path.abspath(dir_path),'')
+            # every path starting with prefix sorts between prefix and prefix+U+10FFFF
+            params.extend([prefix,prefix+chr(0x10ffff)])
+        for col,rng in [('time',time_range),('temperature',temperature_range)]:
+            if rng is None:
+                continue
+            if rng[0] is not None:
+                where.append('{} >= ?'.format(col))
+                params.append(float(rng[0]))
+            if rng[1] is not None:
+                where.append('{} <= ?'.format(col))
+                params.append(float(rng[1]))
+        for col,vals in [('reaction_id',reaction_id),('sample_id',sample_id)]:
+            if vals is None:
+                continue
+            if isinstance(vals,str):
+                vals = [vals]
+            where.append('{} IN ({})'.format(col,','.join('?'*len(vals))))
+            params.extend([str(v) for v in vals])
+        sql = 'SELECT path FROM headers'
+        if where:
+            sql += ' WHERE '+' AND '.join(where)
+        sql += ' ORDER BY {}, path'.format(order_by)
+        conn = self._connect()
+        try:
+            paths = [pth for (pth,) in conn.execute(sql,params)]
+        finally:
+            conn.close()
+        if dir_path is not None:
+            # only files directly in dir_path
+            paths = [pth for pth in paths if os.path.dirname(pth) == os.path.abspath(dir_path)]
+        return paths
+
+    def values(self,paths,column='time'):
+        """Return the `column` values of the headers at `paths`, in order (None if not catalogued)"""
+        return [row.get(column) if row else None for row in self._rows(paths,column)]
+
+    def headers(self,paths):
+        """Return the header dicts at `paths`, in order (None if not catalogued or unreadable)"""
+        return [json.loads(row['header']) if row and row['header'] is not None else None
+            for row in self._rows(paths,'header')]
+
+    def _rows(self,paths,column):
+        if not column in list(header_columns.keys())+['header']:
+            raise ValueError('no header column {}'.format(column))
+        paths = [os.path.abspath(pth) for pth in paths]
+        found = {}
+        conn = self._connect()
+        try:
+            for i0 in range(0,len(paths),_max_params):
+                chunk = paths[i0:i0+_max_params]
+                found.update([(pth,{column:val}) for pth,val in conn.execute(
+                    'SELECT path, {} FROM headers WHERE path IN ({})'.format(
+                    column,','.join('?'*len(chunk))),chunk)])
+        finally:
+            conn.close()
+        return [found.get(pth) for pth in paths]
+
+    def clear(self):
+        """Remove all headers from the catalogue"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM headers')
+            finally:
+                conn.close()
+
+_catalogues = {}
+
+def get_catalogue(db_path=None):
+    """Return the HeaderCatalogue stored at `db_path`, shared within the process"""
+    with _indexes_lock:
+        if not db_path in _catalogues:
+            _catalogues[db_path] = HeaderCatalogue(db_path)
+        return _catalogues[db_path]
@@ -0,0 +1,214 @@
+"""
+Tools for mapping 1d patterns onto a common q grid.
+
+Patterns from different sources (detectors, calibrations, integrations)
+rarely share one q grid, but stacking, averaging and subtracting them
+needs one. Regridding is linear, so each mapping from a source grid
+to a target grid is a sparse matrix of interpolation weights.
+These matrices are built once per pair of grids, cached by a hash of
+the grid values, and applied to all patterns on the same source grid
+with one sparse-dense product.
+
+Two methods are offered:
+'linear' interpolates linearly between the source points,
+'rebin' is flux-conserving: each target bin receives the average
+of the source bins it overlaps, weighted by the overlap length,
+so the integral of I over q is preserved.
+Bin edges are taken halfway between grid points.
+Target points outside the source grid get NaN.
+Errors are propagated assuming independent source points:
+dI_target**2 = sum(weight**2 * dI_source**2).
+"""
+from collections import OrderedDict
+import hashlib
+from threading import Condition
+
+import numpy as np
+from scipy import sparse
+
+regrid_methods = ['linear','rebin']
+
+def grid_key(q):
+    """Return a hex digest identifying the grid values of `q`"""
+    q = np.ascontiguousarray(q,dtype=float)
+    return hashlib.sha1(q.tobytes()).hexdigest()
+
+def bin_edges(q):
+    """Return the n+1 bin edges around the n grid points of `q`, halfway between points.
+
+    The width of a bin is set by its neighbours,
+    so `q` needs at least two points.
+    """
+    q = np.asarray(q,dtype=float)
+    if len(q) < 2:
+        raise ValueError('bin edges need a grid of at least two points, got {}'.format(len(q)))
+    mid = 0.5*(q[1:]+q[:-1])
+    return np.concatenate(([q[0]-(mid[0]-q[0])],mid,[q[-1]+(q[-1]-mid[-1])]))
+
+def linear_weights(q_src,q_tgt):
+    """Return the weights of linear interpolation from `q_src` onto `q_tgt`.
+
+    Both grids must be increasing.
+    Returns a (n_tgt, n_src) scipy.sparse.csr_matrix,
+    and a boolean array flagging the target points inside the source grid.
+    """
+    q_src = np.asarray(q_src,dtype=float)
+    q_tgt = np.asarray(q_tgt,dtype=float)
+    n_src = len(q_src)
+    if n_src == 0:
+        raise ValueError('can not interpolate from an empty grid')
+    valid = (q_tgt >= q_src[0]) & (q_tgt <= q_src[-1])
+    rows = np.flatnonzero(valid)
+    if n_src == 1:
+        return sparse.csr_matrix((np.ones(len(rows)),(rows,np.zeros(len(rows),dtype=int))),
+            shape=(len(q_tgt),n_src)), valid
+    j = np.clip(np.searchsorted(q_src,q_tgt[rows],side='right')-1,0,n_src-2)
+    t = (q_tgt[rows]-q_src[j])/(q_src[j+1]-q_src[j])
+    mat = sparse.csr_matrix(
+        (np.concatenate((1.-t,t)),(np.concatenate((rows,rows)),np.concatenate((j,j+1)))),
+        shape=(len(q_tgt),n_src))
+    mat.eliminate_zeros()
+    return mat, valid
+
+def rebin_weights(q_src,q_tgt):
+    """Return the weights of flux-conserving rebinning from `q_src` onto `q_tgt`.
+
+    Each target bin gets the average of the source bins it overlaps,
+    weighted by the overlap length.
+    Target bins partly outside the source grid average over the covered part.
+    Both grids must be increasing, with at least two points:
+    a single point has no bin width (see bin_edges), and raises ValueError.
+    Returns a (n_tgt, n_src) scipy.sparse.csr_matrix,
+    and a boolean array flagging the target bins that overlap the source grid.
+    """
+    e_src = bin_edges(q_src)
+    e_tgt = bin_edges(q_tgt)
+    n_src = len(e_src)-1
+    n_tgt = len(e_tgt)-1
+    # range of source bins overlapping each target bin
+    lo = np.clip(np.searchsorted(e_src,e_tgt[:-1],side='right')-1,0,n_src-1)
+    hi = np.clip(np.searchsorted(e_src,e_tgt[1:],side='left')-1,0,n_src-1)
+    counts = np.maximum(hi-lo+1,0)
+    rows = np.repeat(np.arange(n_tgt),counts)
+    cols = np.repeat(lo,counts)+(np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts))
+    overlap = np.minimum(e_tgt[1:][rows],e_src[1:][cols])-np.maximum(e_tgt[:-1][rows],e_src[:-1][cols])
+    overlap = np.maximum(overlap,0.)
+    covered = np.bincount(rows,weights=overlap,minlength=n_tgt)
+    valid = covered > 0
+    wts = overlap/np.where(valid,covered,1.)[rows]
+    mat = sparse.csr_matrix((wts,(rows,cols)),shape=(n_tgt,n_src))
+    mat.eliminate_zeros()
+    return mat, valid
+
+class WeightsCache(object):
+    """In-memory cache of regridding weight matrices.
+
+    Entries are keyed by the grid_key() of the source and target grids and the method.
+    When more than `max_items` are held, the least recently used entries are dropped.
+    """
+
+    def __init__(self,max_items=256):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.lock = Condition()
+
+    def get(self,q_src,q_tgt,method='linear',tgt_key=None):
+        """Return the weight matrix and valid flags for regridding `q_src` onto `q_tgt`"""
+        if not method in regrid_methods:
+            raise ValueError('unknown regrid method {}, use one of {}'.format(method,regrid_methods))
+        if tgt_key is None:
+            tgt_key = grid_key(q_tgt)
+        key = (grid_key(q_src),tgt_key,method)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if method == 'linear':
+            entry = linear_weights(q_src,q_tgt)
+        else:
+            entry = rebin_weights(q_src,q_tgt)
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            self.entries.clear()
+
+# cache shared by regrid() calls
+weights_cache = WeightsCache()
+
+def regrid(q_I_arrays,q_target,method='linear',dI_arrays=None,cache=None):
+    """Map a list of patterns onto the grid `q_target`.
+
+    Patterns are grouped by source grid,
+    and each group is regridded by one sparse-dense product
+    with the cached weights for its grid.
+
+    Parameters
+    ----------
+    q_I_arrays : list of arrays
+        n-by-2 arrays of (q, I), or n-by-3 arrays of (q, I, dI);
+        n may differ between patterns
+    q_target : array
+        the target grid, increasing
+    method : str
+        'linear' or 'rebin', see regrid_methods
+    dI_arrays : list of arrays
+        error estimates of I, one per pattern (optional),
+        overriding a third column of q_I_arrays
+    cache : WeightsCache
+        cache of weight matrices, defaults to the shared weights_cache
+
+    Returns
+    -------
+    I : array
+        (n_patterns, n_target) regridded intensities, NaN outside each source grid
+    dI : array
+        (n_patterns, n_target) regridded errors,
+        or None if no errors were given for some pattern
+    """
+    if cache is None:
+        cache = weights_cache
+    q_target = np.asarray(q_target,dtype=float)
+    tgt_key = grid_key(q_target)
+    n_pat = len(q_I_arrays)
+    I_out = np.full((n_pat,len(q_target)),np.nan)
+    dI_list = [None]*n_pat
+    groups = OrderedDict()
+    for ipat,q_I in enumerate(q_I_arrays):
+        q_I = np.asarray(q_I,dtype=float)
+        dI = None
+        if dI_arrays is not None and dI_arrays[ipat] is not None:
+            dI = np.asarray(dI_arrays[ipat],dtype=float)
+        elif q_I.shape[1] > 2:
+            dI = q_I[:,2]
+        q = q_I[:,0]
+        I = q_I[:,1]
+        if np.any(np.diff(q) < 0):
+            order = np.argsort(q,kind='stable')
+            q = q[order]
+            I = I[order]
+            if dI is not None:
+                dI = dI[order]
+        groups.setdefault(grid_key(q),(q,[]))[1].append((ipat,I,dI))
+    have_dI = all([dI is not None for q,members in groups.values() for ipat,I,dI in members])
+    dI_out = None
+    if have_dI:
+        dI_out = np.full((n_pat,len(q_target)),np.nan)
+    for q,members in groups.values():
+        mat,valid = cache.get(q,q_target,method,tgt_key)
+        ipats = [m[0] for m in members]
+        I_stack = np.array([m[1] for m in members])
+        I_grp = mat.dot(I_stack.T).T
+        I_grp[:,~valid] = np.nan
+        I_out[ipats] = I_grp
+        if have_dI:
+            dI_stack = np.array([m[2] for m in members])
+            dI_grp = np.sqrt(mat.multiply(mat).tocsr().dot((dI_stack**2).T).T)
+            dI_grp[:,~valid] = np.nan
+            dI_out[ipats] = dI_grp
+    return I_out, dI_out
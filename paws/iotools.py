@@ -0,0 +1,543 @@
+"""
+Tools for fast reading and writing of data files.
+
+1d patterns are stored as whitespace-delimited text (.dat) files,
+which are slow to parse. load_dat() keeps a binary .npy sidecar
+for each .dat file it reads, and memory-maps the sidecar
+on later reads. Sidecar names embed the size and mtime of the .dat file,
+so a rewritten .dat file never matches a stale sidecar.
+Sidecars live in a cache directory, dat_cache_dir by default,
+so reading never writes into data directories;
+hidden sidecars next to the .dat files are opt-in (local_sidecar).
+
+Detector images are loaded with load_image(), which memory-maps
+the pixels of uncompressed TIFF (including MarCCD) and EDF files
+instead of decoding them, and falls back on fabio for other formats.
+probe_image() reads only the header, for the shape and dtype.
+An ImageCache keeps recently loaded frames, for repeated passes.
+
+Batches of 1d patterns are written by a PatternWriter,
+which appends them to one chunked HDF5 file from a background thread,
+so that processing does not wait on the disk.
+export_dat() converts such a file to per-pattern .dat files afterwards.
+
+spec_scan_index() records the byte range of each scan and file header
+of a SPEC file, so that single scans can be read without parsing
+the lines before them. The index is kept in a JSON sidecar,
+keyed by the size and mtime of the SPEC file, like the .dat sidecars.
+"""
+from collections import OrderedDict
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import struct
+import tempfile
+from threading import Condition, Thread
+
+import h5py
+import numpy as np
+import pandas as pd
+import fabio
+
+from . import pawstools
+
+dat_cache_dir = os.path.join(pawstools.paws_scratch_dir,'dat_cache')
+sidecar_suffix_rx = re.compile(r'\.\d+-\d+\.npy$')
+c_loadtxt = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+def sidecar_prefix(dat_path,cache_dir=None):
+    """Return the path prefix shared by all sidecars of `dat_path`"""
+    if cache_dir is None:
+        dir_path,fn = os.path.split(dat_path)
+        return os.path.join(dir_path,'.'+fn)
+    return os.path.join(cache_dir,hashlib.sha1(os.path.abspath(dat_path).encode()).hexdigest())
+
+def sidecar_path(dat_path,cache_dir=None,st=None):
+    """Return the path of the .npy sidecar for the current version of `dat_path`.
+
+    The sidecar is a hidden file next to `dat_path`,
+    or a file in `cache_dir` if provided.
+    `st` is the os.stat() result of `dat_path`, if already available.
+    """
+    if st is None:
+        st = os.stat(dat_path)
+    return sidecar_prefix(dat_path,cache_dir)+'.{}-{}.npy'.format(st.st_size,st.st_mtime_ns)
+
+def parse_dat(dat_path):
+    """Parse a whitespace-delimited text file with '#' comments.
+
+    numpy>=1.23 parses text in C: np.loadtxt is used directly.
+    Older numpy parses in pure python: the vectorized pandas parser is used,
+    falling back on np.loadtxt for files it cannot handle.
+    Returns an array shaped like the output of np.loadtxt.
+    """
+    if c_loadtxt:
+        return np.loadtxt(dat_path,dtype=float)
+    try:
+        data = pd.read_csv(dat_path,sep=r'\s+',comment='#',header=None,
+            dtype=float,engine='c',float_precision='round_trip').to_numpy()
+    except (ValueError,pd.errors.ParserError,pd.errors.EmptyDataError):
+        return np.loadtxt(dat_path,dtype=float)
+    return np.squeeze(data)
+
+def load_dat(dat_path,use_cache=True,cache_dir=None,mmap=True,local_sidecar=False):
+    """Load a .dat file, through its binary sidecar if possible.
+
+    If the sidecar for the current version of `dat_path` exists,
+    it is loaded, memory-mapped if `mmap`.
+    Otherwise the text is parsed with parse_dat()
+    and, if `use_cache`, the sidecar is written for next time.
+    The sidecar is kept in `cache_dir`, dat_cache_dir if None,
+    or hidden next to `dat_path` if `local_sidecar`.
+    The returned array is writable either way:
+    a memory-mapped sidecar is mapped copy-on-write,
+    so changes to the array never reach the sidecar.
+    """
+    if not use_cache:
+        return parse_dat(dat_path)
+    cache_dir = _dat_cache_dir(cache_dir,local_sidecar)
+    st = os.stat(dat_path)
+    sc_path = sidecar_path(dat_path,cache_dir,st)
+    if os.path.exists(sc_path):
+        try:
+            return np.load(sc_path,mmap_mode='c' if mmap else None)
+        except (IOError,OSError,ValueError):
+            # sidecar truncated or unreadable: parse the text again
+            pass
+    data = parse_dat(dat_path)
+    write_sidecar(dat_path,data,cache_dir,st)
+    return data
+
+def _dat_cache_dir(cache_dir,local_sidecar):
+    # None is the sidecar_path() convention for a sidecar next to the file
+    if local_sidecar:
+        return None
+    return dat_cache_dir if cache_dir is None else cache_dir
+
+def write_sidecar(dat_path,data,cache_dir=None,st=None):
+    """Write the .npy sidecar of `dat_path`, and remove its stale sidecars.
+
+    The sidecar is written to a temporary file and renamed into place,
+    so readers never see a partial sidecar.
+    Failures (e.g. a read-only directory) are ignored:
+    the sidecar is an optimization only.
+    """
+    try:
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        sc_path = sidecar_path(dat_path,cache_dir,st)
+        prefix = sidecar_prefix(dat_path,cache_dir)
+        for old_path in glob.glob(glob.escape(prefix)+'.*-*.npy'):
+            if old_path != sc_path and sidecar_suffix_rx.match(old_path[len(prefix):]):
+                os.remove(old_path)
+        fd,tmp_path = tempfile.mkstemp(dir=os.path.dirname(sc_path) or '.',prefix='.',suffix='.tmp')
+        with os.fdopen(fd,'wb') as f:
+            np.save(f,np.asarray(data))
+        os.replace(tmp_path,sc_path)
+    except (IOError,OSError):
+        pass
+
+def save_dat(dat_path,data,header='',write_npy=True,cache_dir=None,local_sidecar=False):
+    """Save `data` as a whitespace-delimited .dat file.
+
+    If `write_npy`, also write its binary sidecar,
+    where load_dat() with the same `cache_dir` and `local_sidecar` looks for it,
+    so that the first load_dat() of the file needs no text parsing.
+    """
+    np.savetxt(dat_path,data,delimiter=' ',header=header)
+    if write_npy:
+        # store what load_dat() would parse from the text
+        write_sidecar(dat_path,np.squeeze(np.asarray(data,dtype=float)),
+            _dat_cache_dir(cache_dir,local_sidecar))
+
+# TIFF tags used by probe_image()
+tiff_tags = dict(width=256,length=257,bits=258,compression=259,
+    strip_offsets=273,samples=277,rows_per_strip=278,strip_bytes=279,
+    planar=284,sample_format=339)
+tiff_field_types = {1:'B',3:'H',4:'I',8:'h',9:'i',16:'Q'}
+# numpy dtype kind for each TIFF SampleFormat
+tiff_sample_kinds = {1:'u',2:'i',3:'f'}
+edf_dtypes = dict(
+    UnsignedByte='u1',SignedByte='i1',UnsignedChar='u1',SignedChar='i1',
+    UnsignedShort='u2',SignedShort='i2',UnsignedInteger='u4',SignedInteger='i4',
+    UnsignedLong='u4',SignedLong='i4',UnsignedLong64='u8',SignedLong64='i8',
+    FloatValue='f4',Float='f4',FloatIEEE32='f4',DoubleValue='f8',Double='f8',FloatIEEE64='f8')
+
+def probe_image(img_path):
+    """Read the header of an image file.
+
+    Returns a dict with the 'shape' and 'dtype' of the image,
+    and the byte 'offset' of its pixels if they are stored
+    uncompressed and contiguously, so that they can be memory-mapped.
+    Returns None for formats other than TIFF and EDF,
+    and 'offset' is None for images that must be decoded.
+    """
+    with open(img_path,'rb') as f:
+        magic = f.read(4)
+        if magic in (b'II*\x00',b'MM\x00*'):
+            return _probe_tiff(f,'<' if magic[:2] == b'II' else '>')
+        if magic.lstrip()[:1] == b'{':
+            f.seek(0)
+            return _probe_edf(f)
+    return None
+
+def _probe_tiff(f,bo):
+    # first image file directory
+    f.seek(4)
+    f.seek(struct.unpack(bo+'I',f.read(4))[0])
+    n_entries = struct.unpack(bo+'H',f.read(2))[0]
+    entries = f.read(12*n_entries)
+    fields = {}
+    for i in range(n_entries):
+        tag,ftype,count = struct.unpack(bo+'HHI',entries[12*i:12*i+8])
+        if not ftype in tiff_field_types:
+            continue
+        fmt = bo+str(count)+tiff_field_types[ftype]
+        nbytes = struct.calcsize(fmt)
+        if nbytes <= 4:
+            raw = entries[12*i+8:12*i+8+nbytes]
+        else:
+            pos = f.tell()
+            f.seek(struct.unpack(bo+'I',entries[12*i+8:12*i+12])[0])
+            raw = f.read(nbytes)
+            f.seek(pos)
+        fields[tag] = struct.unpack(fmt,raw)
+    get = lambda nm,default=None: fields.get(tiff_tags[nm],(default,))
+    shape = (get('length')[0],get('width')[0])
+    bits = get('bits',1)[0]
+    kind = tiff_sample_kinds.get(get('sample_format',1)[0])
+    info = dict(shape=shape,dtype=None,offset=None)
+    if kind is None or bits % 8:
+        return info
+    info['dtype'] = np.dtype(bo+kind+str(bits//8))
+    offsets = get('strip_offsets')
+    counts = get('strip_bytes')
+    if get('compression',1)[0] != 1 or get('samples',1)[0] != 1 \
+    or offsets[0] is None or counts[0] is None:
+        return info
+    # strips must follow each other, holding exactly the image
+    contiguous = all([o1 == o0+c0 for o0,o1,c0 in zip(offsets[:-1],offsets[1:],counts[:-1])])
+    if contiguous and sum(counts) >= shape[0]*shape[1]*info['dtype'].itemsize:
+        info['offset'] = offsets[0]
+    return info
+
+def _probe_edf(f):
+    # the header is a {...} block, padded to a multiple of 512 bytes
+    header = b''
+    while not b'}' in header:
+        block = f.read(512)
+        if not block:
+            return None
+        header += block
+    end = header.index(b'}')+1
+    if header[end:end+1] == b'\n':
+        end += 1
+    elif header[end:end+2] == b'\r\n':
+        end += 2
+    keys = {}
+    for item in header[header.index(b'{')+1:header.index(b'}')].decode('ascii','ignore').split(';'):
+        if '=' in item:
+            k,v = item.split('=',1)
+            keys[k.strip()] = v.strip()
+    if not 'Dim_1' in keys or not 'Dim_2' in keys:
+        return None
+    shape = (int(keys['Dim_2']),int(keys['Dim_1']))
+    info = dict(shape=shape,dtype=None,offset=None)
+    if not keys.get('DataType') in edf_dtypes:
+        return info
+    bo = '>' if keys.get('ByteOrder') == 'HighByteFirst' else '<'
+    info['dtype'] = np.dtype(bo+edf_dtypes[keys['DataType']])
+    compressed = keys.get('Compression','None').lower() not in ('none','')
+    if not compressed and int(keys.get('Size',0)) == shape[0]*shape[1]*info['dtype'].itemsize:
+        info['offset'] = end
+    return info
+
+def load_image(img_path,mmap=True):
+    """Load the pixels of an image file as a numpy array.
+
+    If `mmap` and probe_image() finds uncompressed, contiguous pixels,
+    the array is memory-mapped (read-only) instead of decoded.
+    Otherwise the image is decoded by fabio.
+    """
+    if mmap:
+        info = probe_image(img_path)
+        if info is not None and info['offset'] is not None:
+            return np.memmap(img_path,dtype=info['dtype'],mode='r',
+                offset=info['offset'],shape=info['shape'])
+    return fabio.open(img_path).data
+
+class ImageCache(object):
+    """Least-recently-used cache of loaded images.
+
+    Images are keyed by path, size and mtime,
+    so a rewritten file is loaded again.
+    When the decoded images exceed `max_bytes`,
+    the least recently used ones are dropped.
+    Memory-mapped images are not counted against `max_bytes`,
+    since their pages belong to the OS file cache,
+    but each one holds an open file descriptor:
+    at most `max_mmaps` of them are kept,
+    well below the usual limit of 1024 open files per process.
+    """
+
+    def __init__(self,max_bytes=512*1024**2,max_items=1024,mmap=True,max_mmaps=64):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.mmap = mmap
+        self.max_mmaps = max_mmaps
+        self.lock = Condition()
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.n_mmaps = 0
+
+    def get(self,img_path):
+        """Return the image at `img_path`, from the cache if possible"""
+        st = os.stat(img_path)
+        key = (os.path.abspath(img_path),st.st_size,st.st_mtime_ns)
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return self.images[key]
+        img = load_image(img_path,self.mmap)
+        with self.lock:
+            if not key in self.images:
+                self.images[key] = img
+                self.nbytes += self._size(img)
+                self.n_mmaps += isinstance(img,np.memmap)
+            self._evict()
+        return img
+
+    def clear(self):
+        with self.lock:
+            self.images = OrderedDict()
+            self.nbytes = 0
+            self.n_mmaps = 0
+
+    @staticmethod
+    def _size(img):
+        return 0 if isinstance(img,np.memmap) else img.nbytes
+
+    def _drop(self,key):
+        img = self.images.pop(key)
+        self.nbytes -= self._size(img)
+        self.n_mmaps -= isinstance(img,np.memmap)
+
+    def _evict(self):
+        while self.images and (self.nbytes > self.max_bytes or len(self.images) > self.max_items):
+            self._drop(next(iter(self.images)))
+        if self.n_mmaps > self.max_mmaps:
+            # dropping a memory map closes its file once no caller holds it
+            mmap_keys = [k for k,img in self.images.items() if isinstance(img,np.memmap)]
+            for key in mmap_keys[:self.n_mmaps-self.max_mmaps]:
+                self._drop(key)
+
+image_cache = ImageCache()
+
+class PatternWriter(object):
+    """Appends 1d patterns to a chunked HDF5 file from a background thread.
+
+    Patterns are stacked in the dataset `group`/data,
+    of shape (n_patterns, n_points, n_columns),
+    and their names in `group`/names.
+    All patterns in one group must have the same shape.
+    put() only queues a pattern: the writer thread takes up to
+    `batch_size` queued patterns at a time, appends them in one write,
+    and flushes the file.
+    An existing group is appended to, so runs can resume a file.
+    Errors in the writer thread, including failure to open the file,
+    are raised by the next put(), flush() or close(), and by every call after that.
+    """
+
+    def __init__(self,file_path,group='patterns',batch_size=64,max_queued=1024):
+        self.file_path = file_path
+        self.group = group
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.error = None
+        self.thread = Thread(target=self._write_loop,daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # do not mask the exception that ended the with block
+            try:
+                self.close()
+            except Exception:
+                pass
+
+    def put(self,name,data):
+        """Queue the pattern `data` (an array) under `name` for writing"""
+        self._raise_error()
+        self.queue.put((name,np.array(data,dtype=float)))
+
+    def flush(self):
+        """Wait until all queued patterns are written"""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write all queued patterns, then stop the writer thread and close the file"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        # errors are kept: once a write has failed, later patterns can not be written either
+        if self.error is not None:
+            raise self.error
+
+    def _write_loop(self):
+        f = None
+        try:
+            f = h5py.File(self.file_path,'a')
+        except Exception as ex:
+            self.error = ex
+        try:
+            done = False
+            while not done:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                done = batch[-1] is None
+                items = [it for it in batch if it is not None]
+                try:
+                    if items and self.error is None:
+                        self._append(f,items)
+                        f.flush()
+                except Exception as ex:
+                    self.error = ex
+                finally:
+                    # keep draining the queue after an error,
+                    # so put(), flush() and close() raise it instead of blocking
+                    for it in batch:
+                        self.queue.task_done()
+        finally:
+            if f is not None:
+                f.close()
+
+    def _append(self,f,items):
+        data = np.stack([d for nm,d in items])
+        if data.ndim == 2:
+            data = data[:,:,None]
+        names = [str(nm) for nm,d in items]
+        if not self.group in f:
+            grp = f.create_group(self.group)
+            grp.create_dataset('data',shape=(0,)+data.shape[1:],
+                maxshape=(None,)+data.shape[1:],chunks=(self.batch_size,)+data.shape[1:],
+                dtype='float64')
+            grp.create_dataset('names',shape=(0,),maxshape=(None,),
+                chunks=(self.batch_size,),dtype=h5py.string_dtype())
+        grp = f[self.group]
+        if grp['data'].shape[1:] != data.shape[1:]:
+            raise ValueError('pattern shape {} does not match {} in {}'.format(
+                data.shape[1:],grp['data'].shape[1:],self.file_path))
+        n0 = grp['data'].shape[0]
+        grp['data'].resize(n0+len(items),axis=0)
+        grp['data'][n0:] = data
+        grp['names'].resize(n0+len(items),axis=0)
+        grp['names'][n0:] = names
+
+def load_patterns(file_path,group='patterns'):
+    """Return the names and the stacked patterns written by a PatternWriter"""
+    with h5py.File(file_path,'r') as f:
+        names = [nm.decode() if isinstance(nm,bytes) else nm for nm in f[group]['names'][()]]
+        return names, f[group]['data'][()]
+
+def export_dat(file_path,output_dir,group='patterns',header='',suffix='',write_npy=False):
+    """Export the patterns written by a PatternWriter to one .dat file each.
+
+    Each file is named after its pattern, plus `suffix`.
+    Returns the list of written paths.
+    """
+    names,data = load_patterns(file_path,group)
+    dat_paths = []
+    for nm,d in zip(names,data):
+        dat_path = os.path.join(output_dir,nm+suffix+'.dat')
+        save_dat(dat_path,np.squeeze(d,axis=-1) if d.shape[-1] == 1 else d,header,write_npy)
+        dat_paths.append(dat_path)
+    return dat_paths
+
+spec_index_suffix_rx = re.compile(r'\.\d+-\d+\.scanidx\.json$')
+spec_marker_rx = re.compile(rb'^#([SF])[ \t]*([^\r\n]*)',re.M)
+
+def build_spec_index(spec_path,chunk_size=16*1024**2):
+    """Find the file headers (#F) and scans (#S) of a SPEC file.
+
+    Reads the file sequentially in large binary chunks,
+    searching each chunk with one regex.
+    Returns a dict with 'headers', a list of [offset, length] of header blocks,
+    and 'scans', a dict of [offset, length, header number] for each scan number
+    (the last scan wins if a scan number repeats, as in sequential parsing).
+    Each block runs up to the next header or scan.
+    """
+    markers = []
+    with open(spec_path,'rb') as f:
+        base = 0
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buf = rest+chunk
+            # only search complete lines, the rest is searched with the next chunk
+            end = buf.rfind(b'\n')+1 if chunk else len(buf)
+            for m in spec_marker_rx.finditer(buf,0,end):
+                markers.append((base+m.start(),m.group(1),m.group(2)))
+            base += end
+            rest = buf[end:]
+            if not chunk:
+                break
+        size = base
+    index = dict(headers=[],scans={})
+    for i,(offset,kind,text) in enumerate(markers):
+        block_end = markers[i+1][0] if i+1 < len(markers) else size
+        if kind == b'F':
+            index['headers'].append([offset,block_end-offset])
+        else:
+            try:
+                scan_num = int(text.split()[0])
+            except (IndexError,ValueError):
+                continue
+            index['scans'][str(scan_num)] = [offset,block_end-offset,len(index['headers'])-1]
+    return index
+
+def spec_scan_index(spec_path,cache_dir=None):
+    """Return the scan index of a SPEC file (see build_spec_index()).
+
+    The index is loaded from its JSON sidecar if the sidecar matches
+    the current size and mtime of the file, else it is built and saved.
+    The sidecar is hidden next to the file, or in `cache_dir` if provided.
+    """
+    st = os.stat(spec_path)
+    prefix = sidecar_prefix(spec_path,cache_dir)
+    idx_path = prefix+'.{}-{}.scanidx.json'.format(st.st_size,st.st_mtime_ns)
+    if os.path.exists(idx_path):
+        try:
+            with open(idx_path,'r') as f:
+                return json.load(f)
+        except (IOError,OSError,ValueError):
+            pass
+    index = build_spec_index(spec_path)
+    try:
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        for old_path in glob.glob(glob.escape(prefix)+'.*-*.scanidx.json'):
+            if old_path != idx_path and spec_index_suffix_rx.match(old_path[len(prefix):]):
+                os.remove(old_path)
+        fd,tmp_path = tempfile.mkstemp(dir=os.path.dirname(idx_path) or '.',prefix='.',suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump(index,f)
+        os.replace(tmp_path,idx_path)
+    except (IOError,OSError):
+        pass
+    return index
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import copy
+import itertools
+
+import numpy as np
+
+from ..Operation import Operation
+from ...stattools import RunningStats, check_x
+
+inputs = OrderedDict(
+    x_y_arrays=[],
+    chunk_size=64,
+    stats=None,
+    ddof=0)
+outputs = OrderedDict(
+    x_ymean=None,
+    y_std=None,
+    y_sum=None,
+    y_min=None,
+    y_max=None,
+    count=None,
+    stats=None)
+
+class ArrayYStats(Operation):
+    """
+    Streaming statistics of the second column of one or more n-by-2 arrays.
+
+    Arrays are consumed in chunks, so x_y_arrays can be a generator,
+    and only the running statistics (see paws.stattools.RunningStats)
+    are held in memory.
+    Passing the output stats back in as the stats input
+    continues the statistics over more arrays,
+    or merges statistics computed separately, e.g. by parallel workers.
+    All arrays must have the x values of the first array
+    (and of the stats input, if any), or a ValueError is raised.
+    """
+
+    def __init__(self):
+        super(ArrayYStats, self).__init__(inputs,outputs)
+        self.input_doc['x_y_arrays'] = 'list, generator, or (n_arrays, n, 2) array of n-by-2 arrays'
+        self.input_doc['chunk_size'] = 'number of arrays added to the statistics at a time'
+        self.input_doc['stats'] = 'RunningStats to continue from or merge with (optional, default None)'
+        self.input_doc['ddof'] = 'delta degrees of freedom for the standard deviation (default 0)'
+        self.output_doc['x_ymean'] = 'n-by-2 array of x and mean(y)'
+        self.output_doc['y_std'] = 'standard deviation of y at each x'
+        self.output_doc['y_sum'] = 'sum of y at each x'
+        self.output_doc['y_min'] = 'minimum of y at each x'
+        self.output_doc['y_max'] = 'maximum of y at each x'
+        self.output_doc['count'] = 'number of (non-NaN) y values at each x'
+        self.output_doc['stats'] = 'the RunningStats, for continuing or merging'
+
+    def run(self):
+        stats = self.inputs['stats']
+        if stats is None:
+            stats = RunningStats()
+        else:
+            stats = copy.deepcopy(stats)
+        x = getattr(stats,'x',None)
+        arrays = iter(self.inputs['x_y_arrays'])
+        chunk_size = max(int(self.inputs['chunk_size']),1)
+        while True:
+            chunk = list(itertools.islice(arrays,chunk_size))
+            if not chunk:
+                break
+            chunk = np.asarray(chunk,dtype=float)
+            if x is None:
+                x = chunk[0,:,0].copy()
+            for xy in chunk:
+                check_x(x,xy[:,0])
+            stats.update_chunk(chunk[:,:,1])
+        # keep x with the statistics, for continued runs
+        stats.x = x
+        for k in outputs.keys():
+            self.outputs[k] = None
+        self.outputs['stats'] = stats
+        if stats.shape is not None:
+            x_ymean = np.zeros(stats.shape+(2,))
+            x_ymean[:,0] = x
+            x_ymean[:,1] = stats.mean_or_nan()
+            self.outputs['x_ymean'] = x_ymean
+            self.outputs['y_std'] = stats.std(self.inputs['ddof'])
+            self.outputs['y_sum'] = stats.sum
+            self.outputs['y_min'] = stats.min
+            self.outputs['y_max'] = stats.max
+            self.outputs['count'] = stats.count
+        return self.outputs
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from ..Operation import Operation
+from ... import gridtools
+
+inputs = OrderedDict(
+    q_I_arrays=[],
+    dI_arrays=None,
+    q_target=None,
+    method='linear')
+outputs = OrderedDict(
+    q_I_regrid=None,
+    dI_regrid=None)
+
+class Regrid(Operation):
+    """
+    Map one or more 1d patterns onto a common q grid.
+
+    Interpolation weights are computed once per source grid
+    and cached (see paws.gridtools),
+    so patterns on the same grid are regridded in one pass.
+    """
+
+    def __init__(self):
+        super(Regrid, self).__init__(inputs,outputs)
+        self.input_doc['q_I_arrays'] = 'list of n-by-2 arrays of q and I, '\
+            'or n-by-3 arrays of q, I and dI; n may differ between arrays'
+        self.input_doc['dI_arrays'] = 'list of 1d arrays, error estimates of I (optional, default None)'
+        self.input_doc['q_target'] = '1d array, the common q grid (default: q of the first array)'
+        self.input_doc['method'] = 'linear (interpolation) or rebin (flux-conserving)'
+        self.output_doc['q_I_regrid'] = 'array of shape (n_arrays, n_target, 2) '\
+            'of q_target and the regridded intensities, NaN outside each source grid'
+        self.output_doc['dI_regrid'] = 'array of shape (n_arrays, n_target) of propagated errors, '\
+            'or None if errors are not available for all arrays'
+
+    def run(self):
+        q_I_arrays = self.inputs['q_I_arrays']
+        q_target = self.inputs['q_target']
+        if len(q_I_arrays) == 0:
+            self.outputs['q_I_regrid'] = None
+            self.outputs['dI_regrid'] = None
+            return self.outputs
+        if q_target is None:
+            q_target = np.sort(np.asarray(q_I_arrays[0])[:,0])
+        I, dI = gridtools.regrid(q_I_arrays,q_target,
+            self.inputs['method'],self.inputs['dI_arrays'])
+        q_I_regrid = np.zeros(I.shape+(2,))
+        q_I_regrid[:,:,0] = q_target
+        q_I_regrid[:,:,1] = I
+        self.outputs['q_I_regrid'] = q_I_regrid
+        self.outputs['dI_regrid'] = dI
+        return self.outputs
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import copy
+
+import numpy as np
+
+from ..Operation import Operation
+from ...stattools import RollingWindow, check_x
+
+inputs = OrderedDict(
+    x_y_arrays=[],
+    window=10,
+    window_state=None,
+    ddof=0)
+outputs = OrderedDict(
+    x_ymean=None,
+    y_means=None,
+    y_stds=None,
+    window_state=None)
+
+class RollingYMean(Operation):
+    """
+    Moving average of the second column of a series of n-by-2 arrays,
+    over the last `window` arrays.
+
+    The arrays are pushed one at a time through a ring buffer
+    (see paws.stattools.RollingWindow),
+    so each new array costs one pass over its points.
+    x_y_arrays can be a list, a generator, or a stack,
+    e.g. the q_I output of ReadTimeSeries.
+    For a live stream, pass the output window_state back in
+    as the window_state input, with only the new arrays.
+    All arrays must have the x values of the first array
+    (and of the window_state input, if any), or a ValueError is raised.
+    """
+
+    def __init__(self):
+        super(RollingYMean, self).__init__(inputs,outputs)
+        self.input_doc['x_y_arrays'] = 'list, generator, or (n_arrays, n, 2) array of n-by-2 arrays, in time order'
+        self.input_doc['window'] = 'number of most recent arrays to average over'
+        self.input_doc['window_state'] = 'RollingWindow to continue from (optional, default None)'
+        self.input_doc['ddof'] = 'delta degrees of freedom for the standard deviation (default 0)'
+        self.output_doc['x_ymean'] = 'n-by-2 array of x and the mean of y over the last window'
+        self.output_doc['y_means'] = 'array of the windowed mean of y after each new array, '\
+            'shape (n_arrays, n)'
+        self.output_doc['y_stds'] = 'array of the windowed standard deviation of y after each new array, '\
+            'shape (n_arrays, n)'
+        self.output_doc['window_state'] = 'the RollingWindow, for continuing the series'
+
+    def run(self):
+        state = self.inputs['window_state']
+        if state is None:
+            state = RollingWindow(self.inputs['window'])
+        else:
+            state = copy.deepcopy(state)
+        x = getattr(state,'x',None)
+        y_means = []
+        y_stds = []
+        for xy in self.inputs['x_y_arrays']:
+            xy = np.asarray(xy,dtype=float)
+            if x is None:
+                x = xy[:,0].copy()
+            check_x(x,xy[:,0])
+            state.update(xy[:,1])
+            y_means.append(state.mean())
+            y_stds.append(state.std(self.inputs['ddof']))
+        # keep x with the window, for continued runs
+        state.x = x
+        for k in outputs.keys():
+            self.outputs[k] = None
+        self.outputs['window_state'] = state
+        if state.shape is not None:
+            x_ymean = np.zeros(state.shape+(2,))
+            x_ymean[:,0] = x
+            x_ymean[:,1] = state.mean()
+            self.outputs['x_ymean'] = x_ymean
+            self.outputs['y_means'] = np.array(y_means).reshape((len(y_means),)+state.shape)
+            self.outputs['y_stds'] = np.array(y_stds).reshape((len(y_stds),)+state.shape)
+        return self.outputs
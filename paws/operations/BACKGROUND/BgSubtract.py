@@ -2,6 +2,7 @@ import numpy as np
 from collections import OrderedDict
 
 from ..Operation import Operation
+from ... import gridtools
 
 inputs = OrderedDict(
     q_I = None,
@@ -20,13 +21,21 @@ class BgSubtract(Operation):
     after scaling the background to prevent over-subtraction.
     Given error estimates for the image and background, 
     estimates the error for the background-subtracted intensity. 
+
+    A batch of patterns can be given, as a list or a stack.
+    The background is interpolated once onto each distinct q grid in the batch,
+    and the patterns on each grid are processed together,
+    with one bg_factor per pattern.
     """
 
     def __init__(self):
         super(BgSubtract, self).__init__(inputs, outputs)
-        self.input_doc['q_I'] = 'n-by-2 array of q values and corresponding intensity values'
-        self.input_doc['q_I_bg'] = 'n-by-2 array, background corresponding to q_I'
-        self.input_doc['dI'] = '1d array, error estimate of I (optional, default None)' 
+        self.input_doc['q_I'] = 'n-by-2 array of q values and corresponding intensity values, '\
+            'or a batch of such arrays, as a list or an (n_patterns, n, 2) array'
+        self.input_doc['q_I_bg'] = 'n-by-2 array, background corresponding to q_I, '\
+            'interpolated onto the q values of q_I if they differ'
+        self.input_doc['dI'] = '1d array, error estimate of I (optional, default None), '\
+            'or one such array per pattern in a batch' 
         self.input_doc['dI_bg'] = '1d array, error estimate of I_bg (optional, default None)'
         self.output_doc['q_I_bgsub'] = 'n-by-2 array of q values and background-subtracted intensity: I-(bg_factor*I_bg)'
         self.output_doc['dI'] = 'error estimate of background-subtracted intensity'
@@ -35,24 +44,85 @@ class BgSubtract(Operation):
 
     def run(self):
         q_I = self.inputs['q_I']
-        q_I_bg = self.inputs['q_I_bg']
-        I = q_I[:,1]
-        I_bg = q_I_bg[:,1]
-        bad_data = (I < 0) | (I_bg <= 0) | np.isnan(I) | np.isnan(I_bg)
-        bg_factor = np.min(I[~bad_data] / I_bg[~bad_data])
-        #if bg_factor > 1.: bg_factor = 1.
-        self.message_callback('subtracting background (bg multiplier: {})'.format(bg_factor))
-        I_out = I-(bg_factor*I_bg)
         dI = self.inputs['dI']
-        dI_bg = self.inputs['dI_bg']
-        dI_out = None
-        if dI_bg is not None and dI is not None:
-            dI_out = (dI**2+(bg_factor*dI_bg)**2)**0.5
-        q_I_bgsub = np.zeros(q_I.shape)
-        q_I_bgsub[:,0] = q_I[:,0]
-        q_I_bgsub[:,1] = I_out
-        self.outputs['q_I_bgsub'] = q_I_bgsub 
+        batch = isinstance(q_I,list) or np.ndim(q_I) == 3
+        if not batch:
+            q_I = [q_I]
+            dI = [dI]
+        elif dI is None:
+            dI = [None]*len(q_I)
+        n_pat = len(q_I)
+        q_I_bgsub = [None]*n_pat
+        dI_out = [None]*n_pat
+        bg_factor = np.zeros(n_pat)
+        # the background is interpolated once per unique q grid,
+        # and each group of patterns on one grid is processed as a stack
+        for q, ipats in self.grid_groups(q_I).items():
+            I_bg, dI_bg = self.background_on(q)
+            I = np.array([q_I[i][:,1] for i in ipats],dtype=float)
+            bad_data = (I < 0) | (I_bg <= 0) | np.isnan(I) | np.isnan(I_bg)
+            with np.errstate(divide='ignore',invalid='ignore'):
+                ratios = np.where(bad_data,np.inf,I/I_bg)
+            fac = np.min(ratios,axis=1)
+            # no usable points: no factor
+            fac[np.isinf(fac)] = np.nan
+            #fac[fac > 1.] = 1.
+            I_out = I-(fac[:,None]*I_bg)
+            dI_grp = None
+            if dI_bg is not None and all([dI[i] is not None for i in ipats]):
+                dI_grp = np.array([dI[i] for i in ipats],dtype=float)
+                dI_grp = (dI_grp**2+(fac[:,None]*dI_bg)**2)**0.5
+            for j,i in enumerate(ipats):
+                q_I_bgsub[i] = np.zeros(np.shape(q_I[i]))
+                q_I_bgsub[i][:,0] = q_I[i][:,0]
+                q_I_bgsub[i][:,1] = I_out[j]
+                if dI_grp is not None:
+                    dI_out[i] = dI_grp[j]
+                bg_factor[i] = fac[j]
+        if not batch:
+            self.message_callback('subtracting background (bg multiplier: {})'.format(bg_factor[0]))
+            self.outputs['q_I_bgsub'] = q_I_bgsub[0]
+            self.outputs['dI'] = dI_out[0]
+            self.outputs['bg_factor'] = bg_factor[0]
+            return self.outputs
+        if n_pat:
+            self.message_callback('subtracted background from {} patterns '\
+                '(bg multipliers: {} to {})'.format(n_pat,np.min(bg_factor),np.max(bg_factor)))
+        if isinstance(self.inputs['q_I'],np.ndarray):
+            q_I_bgsub = np.array(q_I_bgsub)
+            if not any([d is None for d in dI_out]):
+                dI_out = np.array(dI_out)
+        if any([d is None for d in dI_out]):
+            dI_out = None
+        self.outputs['q_I_bgsub'] = q_I_bgsub
         self.outputs['dI'] = dI_out
         self.outputs['bg_factor'] = bg_factor
         return self.outputs
 
+    @staticmethod
+    def grid_groups(q_I):
+        """Return an OrderedDict mapping each unique q grid (as a tuple) to the indices of its patterns"""
+        if isinstance(q_I,np.ndarray) and q_I.ndim == 3 \
+            and np.all(q_I[:,:,0] == q_I[:1,:,0]):
+            return OrderedDict([(tuple(q_I[0,:,0]),list(range(len(q_I))))])
+        groups = OrderedDict()
+        for i,qi in enumerate(q_I):
+            groups.setdefault(tuple(np.asarray(qi)[:,0]),[]).append(i)
+        return groups
+
+    def background_on(self,q):
+        """Return the background intensity and error on the grid `q`.
+
+        The background is interpolated linearly onto `q` if its own grid differs,
+        with the cached weights of paws.gridtools,
+        and its error is propagated through the same weights;
+        points outside the background grid get NaN and are treated as bad data.
+        """
+        q = np.array(q,dtype=float)
+        q_I_bg = np.asarray(self.inputs['q_I_bg'])
+        dI_bg = self.inputs['dI_bg']
+        if q_I_bg.shape[0] == len(q) and np.array_equal(q_I_bg[:,0],q):
+            return q_I_bg[:,1], dI_bg
+        I_bg, dI_bg = gridtools.regrid([q_I_bg],q,'linear',
+            None if dI_bg is None else [dI_bg])
+        return I_bg[0], None if dI_bg is None else dI_bg[0]
@@ -1,22 +1,30 @@
 from collections import OrderedDict
 import glob
 import os
-import re
 
 from ..Operation import Operation
+from ... import fileindex
 
 inputs=OrderedDict(
     dir_path=None,
     regex='*',
-    filter_regex=None)
+    filter_regex=None,
+    use_index=False,
+    cursor=None)
 outputs=OrderedDict(
     file_list=None,
-    filename_list=None)
+    filename_list=None,
+    cursor=None)
 
 class BuildFileList(Operation):
     """
     Read a directory and filter its contents with a regular expression
     to form a list of file paths.
+
+    With `use_index`, the directory is read through a persistent
+    fileindex.DirectoryIndex instead of globbing it,
+    and if a `cursor` is given, only the files added or changed
+    since the call that returned that `cursor` are listed.
     """
 
     def __init__(self):
@@ -24,6 +32,10 @@ class BuildFileList(Operation):
         self.input_doc['dir_path'] = 'path to directory containing files'
         self.input_doc['regex'] = 'unix-like regex to select files'
         self.input_doc['filter_regex'] = 'regex used to filter output'
+        self.input_doc['use_index'] = 'if True, list files from a persistent directory index'
+        self.input_doc['cursor'] = 'cursor from a previous run: '\
+            'if provided, only files added or changed since that run are listed'
+        self.output_doc['cursor'] = 'cursor for listing only newer files on the next run'
         
     def run(self):
         dirpath = self.inputs['dir_path']
@@ -31,9 +43,13 @@ class BuildFileList(Operation):
         frx = self.inputs['filter_regex']
         globex = os.path.join(dirpath,rx)
         self.message_callback('seeking files matching {}'.format(globex))
-        fl = glob.glob(globex)
-        if frx is not None:
-            fl = list(filter(re.compile(frx).match,fl))
+        if self.inputs['use_index'] and not os.path.dirname(rx):
+            idx = fileindex.get_index(dirpath)
+            fl,self.outputs['cursor'] = idx.new_since(self.inputs['cursor'],rx,frx)
+        else:
+            fl = glob.glob(globex)
+            if frx is not None:
+                fl = list(filter(fileindex.compile_regex(frx).match,fl))
         fnamel = [os.path.split(p)[-1] for p in fl] 
         self.outputs['file_list'] = fl
         self.outputs['filename_list'] = fnamel
@@ -1,46 +1,53 @@
 from collections import OrderedDict
 
 import numpy as np
+from scipy.ndimage import convolve1d
 
 from ..Operation import Operation
+from ... import pawstools
 
 inputs = OrderedDict(
     data=None,
     window=3,
     shape='square',
-    error=None)
+    error=None,
+    axis=-1)
 outputs = OrderedDict(smoothed_data=None)
 
 class MovingAverage(Operation):
-    """Applies moving average filter to 1d array."""
+    """Applies moving average filter to 1d array, or along one axis of an nd array.
+
+    Each point is replaced by the average of the points within `window` on either side,
+    weighted by the window shape and, if `error` is given, by error**-2.
+    Near the edges, the average is normalized by the weights of the points inside the array.
+    The weighted sums are computed as convolutions, in one call for all patterns of a stack.
+    """
 
     def __init__(self):
         super(MovingAverage, self).__init__(inputs, outputs)
-        self.input_doc['data'] = '1d array'
+        self.input_doc['data'] = '1d array, or nd array of patterns to be smoothed along `axis`'
         self.input_doc['window'] = 'integer number of data points to average on either side'
         self.input_doc['shape'] = 'window shape for weighting- triangular or square (default)'
-        self.input_doc['error'] = '1d array, same shape as data, optional (default None)'
-        self.output_doc['smoothed_data'] = 'smoothed 1d array'
+        self.input_doc['error'] = 'array, same shape as data, optional (default None)'
+        self.input_doc['axis'] = 'axis of data along which to smooth (default -1)'
+        self.output_doc['smoothed_data'] = 'smoothed array, same shape as data'
 
     def run(self):
-        x = self.inputs['data']
+        x = np.asarray(self.inputs['data'],dtype=float)
         w = self.inputs['window']
         err = self.inputs['error']
-        nx = len(x)
+        axis = self.inputs['axis']
         if self.inputs['shape'] == 'triangle': 
             shape_weights = (w+1-np.arange(w+1, dtype=float))/float(w+1)
         else:
             shape_weights = np.ones(w+1, dtype=float)
         shape_weights = np.concatenate( (shape_weights[::-1],shape_weights[1:]))
         if err is not None:
-            err_weights = err**-2
+            err_weights = np.asarray(err,dtype=float)**-2
         else:
             err_weights = np.ones(x.shape, dtype=float)
-        x_out = np.array([np.sum( 
-                            np.array(x[max(0,i-w):min(i+w,nx)],dtype=float) 
-                             * np.array(err_weights[max(0,i-w):min(i+w,nx)]) 
-                             * np.array(shape_weights[max(0,w-i):min(2*(nx-i)+1,2*w+1)]) )/
-                            float(min(i+w,nx-1)-max(0,i-w)) 
-                            for i in range(nx) ])
-        self.outputs['smoothed_data'] = x_out
-
+        # points beyond the edges carry zero weight
+        wsum_x = convolve1d(x*err_weights, shape_weights, axis=axis, mode='constant', cval=0.)
+        wsum = convolve1d(err_weights, shape_weights, axis=axis, mode='constant', cval=0.)
+        self.outputs['smoothed_data'] = pawstools.div0(wsum_x, wsum)
+        return self.outputs
@@ -1,6 +1,8 @@
 from collections import OrderedDict
+import hashlib
 
 import numpy as np
+from scipy.signal import savgol_filter
 
 from ..Operation import Operation
 
@@ -9,72 +11,119 @@ inputs = OrderedDict(
     y=None,
     dy=None,
     order=None,
-    base=None)
+    base=None,
+    axis=-1)
 outputs = OrderedDict(smoothed_data=None)
 
 class SavitzkyGolay(Operation):
-    """Applies a Savitzky-Golay polynomial smoothing filter to a 1d array."""
+    """Applies a Savitzky-Golay polynomial smoothing filter to a 1d array,
+    or along one axis of an nd array of patterns.
+
+    Each point is replaced by the value at that point
+    of a polynomial of degree `order`, fit by least squares
+    to a window of points centered on it.
+    Near the edges, the window is shifted to stay inside the array.
+    If `dy` is given, the fit is weighted by dy**-2.
+
+    On a uniform x grid without `dy`, the fits reduce to a convolution
+    with fixed coefficients (scipy.signal.savgol_filter).
+    Otherwise the fits for all windows are set up as stacked
+    normal equations and solved in one batched call.
+    """
 
     def __init__(self):
         super(SavitzkyGolay, self).__init__(inputs, outputs)
-        self.input_doc['x'] = '1d array- independent variable'
-        self.input_doc['y'] = '1d array- dependent variable, same shape as x'
-        self.input_doc['dy'] = '1d array, error estimate in y, same shape as y (default None)'
+        self.input_doc['x'] = '1d array- independent variable, shared by all patterns, '\
+            'or an array of the same shape as y'
+        self.input_doc['y'] = '1d array- dependent variable, same shape as x, '\
+            'or nd array of patterns to be smoothed along `axis`'
+        self.input_doc['dy'] = 'array, error estimate in y, same shape as y (default None)'
         self.input_doc['order'] = 'integer order of polynomial approximation (zero to five)'
         self.input_doc['base'] = '-1, 0, or positive integer'
-        self.output_doc['smoothed_data'] = 'smoothed 1d array for y'
+        self.input_doc['axis'] = 'axis of y along which to smooth (default -1)'
+        self.output_doc['smoothed_data'] = 'smoothed array for y, same shape as y'
+        # smoothing coefficients for the last unweighted non-uniform grid
+        self.coefs = None
+        self.coefs_key = None
 
     def run(self):
-        # TODO: this needs to be reviewed for correctness,
-        # and thoroughly commented to explain what it does
-        x = self.inputs['x']
-        y = self.inputs['y']
         o = self.inputs['order']
         b = self.inputs['base']
+        axis = self.inputs['axis']
+        y = np.moveaxis(np.asarray(self.inputs['y'],dtype=float),axis,-1)
+        x = np.asarray(self.inputs['x'],dtype=float)
+        if x.ndim > 1:
+            x = np.moveaxis(x,axis,-1)
         err = self.inputs['dy']
-        nx = x.size
-        if err is None:
-            err = np.ones(y.shape,dtype=float)        
-        # "Minimal" point base case. 
+        if err is not None:
+            err = np.moveaxis(np.asarray(err,dtype=float),axis,-1)
+        nx = y.shape[-1]
+        # "Minimal" point base case: smallest odd window for the order
         if b == -1:
-            o_odd_flag = ((o/2)*2 != o)
-            npts = o+1+int(o_odd_flag)
-        # "Balanced" point base case.
-        elif b == 0:
-            npts = 2*o+1
+            npts = o+1+int(o%2)
         # "Additional" point base case.
-        elif b > 0:
+        elif b is not None and b > 0:
             npts = 2*(o+b)+1
-        y_out = np.zeros(nx, dtype=float)
-        for i in range(nx):
-            # choose start and end indices
-            npts_half = int(npts)/2 + 1
-            start = max([i-npts_half+1,0])
-            end = min([i+npts_half-1,nx-1])
-            if b == -1:
-                if (i-npts_half+1 < 0):
-                    start = 0
-                    end = npts 
-                elif (i+npts_half-1 > nx-1):
-                    start = size-1-m
-                    end = size-1
-            # Formulate the equation to be solved for polynomial coefficients
-            xvals = x[start:end]
-            yvals = y[start:end]
-            errvals = err[start:end]
-            nxvals = xvals.size
-            idxs = np.arange(o+1)
-            # reshape vectors for matrix mult
-            y_vec = np.reshape(yvals,(nxvals,1,1))
-            x_vec = np.reshape(xvals,(nxvals,1,1))
-            err_vec = np.reshape(errvals,(nxvals,1,1))
-            idx_column = np.reshape(idxs,(nxvals,1)) 
-            idx_row = np.reshape(idxs,(1,nxvals)) 
-            idx_block = idx_row + idx_column
-            v = (y_vec * x_vec ** idx_column * err_vec).sum(axis=0)
-            m = (x_vec ** idx_block * err_vec).sum(axis=0)
-            # CALL LINALG.SOLVE...
-            coefs = (np.linalg.solve(m, v)).flatten()
-            y_out[i] = np.sum(x[i]**np.arange(o+1)*coefs)
-        self.outputs['smoothed_data'] = y_out
+        # "Balanced" point base case.
+        else:
+            npts = 2*o+1
+        npts = min(npts,nx)
+        if npts < o+1:
+            raise ValueError('{} points can not be fit by a polynomial of order {}'.format(nx,o))
+
+        if err is None and x.ndim == 1 and npts%2 and self.uniform(x):
+            y_out = savgol_filter(y,npts,o,axis=-1,mode='interp')
+        elif err is None and x.ndim == 1:
+            key = (hashlib.sha1(x.tobytes()).hexdigest(),npts,o)
+            if key != self.coefs_key:
+                self.coefs = self.window_coefs(x,None,npts,o)
+                self.coefs_key = key
+            y_out = np.sum(self.coefs*y[...,self.window_index(nx,npts)],axis=-1)
+        else:
+            wts = None
+            if err is not None:
+                wts = err**-2
+            coefs = self.window_coefs(x,wts,npts,o)
+            y_out = np.sum(coefs*y[...,self.window_index(nx,npts)],axis=-1)
+        self.outputs['smoothed_data'] = np.moveaxis(y_out,-1,axis)
+        return self.outputs
+
+    @staticmethod
+    def uniform(x):
+        """Return True if `x` is evenly spaced"""
+        dx = np.diff(x)
+        return len(dx) > 0 and np.allclose(dx,dx[0],rtol=1e-9,atol=0)
+
+    @staticmethod
+    def window_index(nx,npts):
+        """Return an (nx, npts) array of the indices in the window of each point"""
+        start = np.clip(np.arange(nx)-npts//2,0,nx-npts)
+        return start[:,None]+np.arange(npts)
+
+    @staticmethod
+    def window_coefs(x,wts,npts,o):
+        """Return the smoothing coefficients of all windows.
 
+        `x` has shape (nx,) or (..., nx), `wts` is None or has shape (..., nx).
+        For each point i, the local polynomial is fit to (x[j]-x[i]) for j in the window,
+        so its value at x[i] is the constant coefficient.
+        The result c has shape (..., nx, npts),
+        such that the smoothed value at i is sum(c[i]*y[window of i]).
+        """
+        nx = x.shape[-1]
+        idx = SavitzkyGolay.window_index(nx,npts)
+        dx = x[...,idx]-x[...,:,None]
+        # scale each window to [-1, 1] to keep the normal equations well conditioned
+        scale = np.max(np.abs(dx),axis=-1,keepdims=True)
+        scale[scale == 0] = 1.
+        vander = (dx/scale)[...,None]**np.arange(o+1)
+        vander_w = vander
+        if wts is not None:
+            vander_w = vander*wts[...,idx][...,None]
+        # normal equations, one (o+1, o+1) system per window
+        a = np.matmul(np.swapaxes(vander_w,-1,-2),vander)
+        e0 = np.zeros(o+1)
+        e0[0] = 1.
+        # a is symmetric: the constant term is e0.a^-1.V^T.W.y
+        z = np.linalg.solve(a,np.broadcast_to(e0,a.shape[:-1])[...,None])
+        return np.matmul(vander_w,z)[...,0]
@@ -1,8 +1,10 @@
 from collections import OrderedDict
-import copy
 
 import numpy as np
+import pandas as pd
+
 from ..Operation import Operation
+from ... import pawstools
 
 inputs = OrderedDict(
     batch_outputs={},
@@ -11,7 +13,8 @@ inputs = OrderedDict(
     x_shift_flag=False, 
     lower_index=None,
     upper_index=None,
-    index_step=1) 
+    index_step=1,
+    lazy=False) 
 outputs = OrderedDict(
     x_sorted = None,
     x_sorted_array = None,
@@ -21,6 +24,10 @@ class SortBatch(Operation):
     """
     Harvest sorted lists from a batch output (a dict of unsorted lists). 
     Takes a batch output, and a key for the values on which to sort.
+
+    Batch outputs may also be columnar: arrays are permuted along their
+    first axis with a single np.take, DataFrames are permuted by row.
+    Entries that are not one-per-sample (e.g. scalars) are passed through.
     """
 
     def __init__(self):
@@ -32,6 +39,8 @@ class SortBatch(Operation):
         self.input_doc['lower_index'] = 'optional list slice lower limit, inclusive'
         self.input_doc['upper_index'] = 'optional list slice upper limit, exclusive'
         self.input_doc['index_step'] = 'optional number of indices to skip between sorted outputs'
+        self.input_doc['lazy'] = 'if True, lists are returned as permuted views of the batch_outputs, '\
+            'instead of new lists'
         self.output_doc['x_sorted'] = 'list of sorted x_values'
         self.output_doc['x_array_sorted'] = 'array of sorted x_values'
         self.output_doc['batch_outputs_sorted'] = 'list of sorted batch_outputs'
@@ -39,14 +48,15 @@ class SortBatch(Operation):
     def run(self):
         b_out = self.inputs['batch_outputs']
         xvals = self.inputs['x_values']
-        sortflag = self.inputs['x_shift_flag']
+        sortflag = self.inputs['x_sort_flag']
         shiftflag = self.inputs['x_shift_flag']
         skipidx = self.inputs['index_step']
         lidx = self.inputs['lower_index']
         uidx = self.inputs['upper_index']
 
         n_batch_outputs = len(xvals) 
-        if shiftflag or sortflag or uidx is not None or lidx is not None:
+        permute = shiftflag or sortflag or uidx is not None or lidx is not None or skipidx > 1
+        if permute:
             xa = np.array(xvals)
             if shiftflag:
                 xmin = min(xvals)
@@ -71,11 +81,25 @@ class SortBatch(Operation):
 
         s_out = self.outputs['sorted_outputs']
         for y_key in b_out.keys():
-            y_list = copy.deepcopy(b_out[y_key])
-            if shiftflag or sortflag or uidx is not None or lidx is not None:
-                # only sort y_list if it contains a full batch of outputs
-                #if len(y_list) == n_batch_outputs:
-                y_list = [y_list[int(ii)] for ii in ix]
-            s_out[y_key] = y_list
+            y_data = b_out[y_key]
+            if permute:
+                y_data = self.take(y_data,ix,n_batch_outputs,self.inputs['lazy'])
+            s_out[y_key] = y_data
 
         return self.outputs
+
+    @staticmethod
+    def take(y_data,ix,n_batch_outputs,lazy=False):
+        # only permute y_data if it contains a full batch of outputs
+        if isinstance(y_data,(pd.DataFrame,pd.Series)):
+            if len(y_data) == n_batch_outputs:
+                return y_data.iloc[ix].reset_index(drop=True)
+        elif isinstance(y_data,np.ndarray):
+            if y_data.ndim > 0 and len(y_data) == n_batch_outputs:
+                return np.take(y_data,ix,axis=0)
+        elif isinstance(y_data,(list,tuple,pawstools.PermutedList)):
+            if len(y_data) == n_batch_outputs:
+                if lazy:
+                    return pawstools.PermutedList(y_data,ix)
+                return [y_data[int(ii)] for ii in ix]
+        return y_data
@@ -4,19 +4,28 @@ Created on Wed Aug 28 16:39:57 2019
 
 @author: walroth
 """
+import hashlib
 import os
 from collections import OrderedDict
+import h5py
+import numpy as np
 import pandas as pd
+import yaml
 from copy import deepcopy
 
 from ..Operation import Operation
-from ...pawstools import soft_list_eval
+from ... import iotools
+from ...pawstools import soft_list_num, str_to_num
 
 
 
 inputs = OrderedDict(
         spec_file_path=None,
-        spec_file_name=None
+        spec_file_name=None,
+        incremental=False,
+        scans=None,
+        cache_scans=False,
+        cache_dir=None
         )
 
 outputs = OrderedDict(
@@ -31,7 +40,8 @@ outputs = OrderedDict(
         scans_meta={},
         last_line_read=dict(
                 number=0,
-                text=''
+                text='',
+                offset=0
                 ),
         current_scan={
             'num': 0,
@@ -42,58 +52,261 @@ outputs = OrderedDict(
 
 class LoadSpecFile(Operation):
     """Operation for loading in data from a spec file.
+
+    In incremental mode, repeated calls to run() or run_with() follow
+    a growing spec file: only the bytes appended since the last call
+    are parsed, and scans and scans_meta are updated in place. The
+    byte offset of the last complete line read, the parser state (e.g.
+    a header block or scan still being written) and the outputs read
+    so far are kept in spec_state between calls, since run_with()
+    resets the outputs. The offset is also reported in
+    last_line_read['offset']. If the file is replaced or truncated, it
+    is read again from the start.
+
+    Data rows of a scan are collected as tokens, and converted to a
+    numeric array in one step when the scan ends (or the read ends),
+    so each scan DataFrame is built once per run instead of row by row.
+
+    If scans is given, only the file header and the requested scans are
+    read, through the scan index of iotools.spec_scan_index, so a scan
+    costs O(scan size) however far into the file it is. With
+    cache_scans, parsed scans are also kept in an hdf5 sidecar, keyed
+    by their byte range and checked against a digest of their bytes, so
+    completed scans are never parsed twice, and a rewritten file is
+    never answered from the cache.
     """
     date_format = '%a %b %d %H:%M:%S %Y'
 
     def __init__(self):
         super(LoadSpecFile, self).__init__(inputs, outputs)
+        self.input_doc['incremental'] = 'if True, only parse lines '\
+            'appended since the last run'
+        self.input_doc['scans'] = 'scan number or list of scan numbers '\
+            'to read, if None the whole file is read'
+        self.input_doc['cache_scans'] = 'if True, keep parsed scans in '\
+            'an hdf5 sidecar of the spec file'
+        self.input_doc['cache_dir'] = 'directory for the scan index and '\
+            'parsed scan sidecars, if None they are hidden files next '\
+            'to the spec file'
+        self.spec_state = self._new_state()
     
     def run(self):
-        last_line = self.outputs['last_line_read']['number']
         full_path = os.path.join(self.inputs['spec_file_path'],
                                  self.inputs['spec_file_name'])
-        with open(full_path, 'r') as file:
-            self._read_spec(file)
+        if self.inputs['scans'] is not None:
+            self._read_indexed(full_path, self.inputs['scans'])
+        elif self.inputs['incremental']:
+            self._read_appended(full_path)
+        else:
+            self.spec_state = self._new_state()
+            with open(full_path, 'r') as file:
+                self._read_spec(file)
         
         return self.outputs
+
+    @staticmethod
+    def _new_state():
+        return {
+            'state': 'beginning',
+            'head': [],
+            'scan_num': None,
+            'rows': [],
+            'file_id': None,
+            'last_line': b'',
+            'offset': 0,
+            'outputs': None
+        }
+
+    def _read_indexed(self, full_path, scans):
+        """Reads the requested scans, and the headers they belong to,
+        using the scan index of the spec file.
+        """
+        if np.ndim(scans) == 0:
+            scans = [scans]
+        index = iotools.spec_scan_index(full_path, self.inputs['cache_dir'])
+        missing = [n for n in scans if str(n) not in index['scans']]
+        if missing:
+            raise KeyError('scans {} not found in {}'.format(
+                missing, full_path))
+        # read in file order, each header before its scans
+        entries = sorted(set(tuple(index['scans'][str(n)]) for n in scans))
+        cache = None
+        if self.inputs['cache_scans']:
+            cache = iotools.sidecar_prefix(
+                full_path, self.inputs['cache_dir']) + '.scans.h5'
+        header_read = None
+        with open(full_path, 'rb') as file:
+            for offset, length, header_num in entries:
+                if header_num != header_read and header_num >= 0:
+                    self._read_block(file, *index['headers'][header_num])
+                    header_read = header_num
+                if cache is None:
+                    self._read_block(file, offset, length)
+                    continue
+                # reading the bytes is cheap next to parsing them
+                file.seek(offset)
+                block = file.read(length)
+                digest = hashlib.sha1(block).hexdigest()
+                if self._load_cached_scan(cache, offset, length, digest):
+                    continue
+                scan_num = self._parse_block(block)
+                self._cache_scan(cache, offset, length, digest, scan_num)
+
+    def _read_block(self, file, offset, length):
+        """Parses one header or scan block of the spec file, returns
+        the scan number of a scan block.
+        """
+        file.seek(offset)
+        return self._parse_block(file.read(length))
+
+    def _parse_block(self, block):
+        """Parses the bytes of one header or scan block, returns the
+        scan number of a scan block.
+        """
+        self.spec_state = self._new_state()
+        lines = block.splitlines(True)
+        self._read_spec(lin.decode(errors='replace') for lin in lines)
+        # a header block is parsed at the blank line that ends it
+        self._read_spec([''])
+        return self.spec_state['scan_num']
+
+    def _load_cached_scan(self, cache, offset, length, digest):
+        """Loads a parsed scan from the hdf5 cache, returns False if it
+        is not cached, or was cached from different bytes, e.g. before
+        the file was rewritten.
+        """
+        if not os.path.exists(cache):
+            return False
+        try:
+            with h5py.File(cache, 'r') as f:
+                key = str(offset)
+                if key not in f or f[key].attrs['length'] != length \
+                        or f[key].attrs['digest'] != digest:
+                    return False
+                grp = f[key]
+                scan_num = int(grp.attrs['scan_num'])
+                columns = yaml.safe_load(grp.attrs['columns'])
+                self.outputs['scans_meta'][scan_num] = yaml.safe_load(
+                    grp.attrs['meta'])
+                if 'data' in grp:
+                    self.outputs['scans'][scan_num] = pd.DataFrame(
+                        grp['data'][()], columns=columns)
+        except (IOError, OSError, KeyError):
+            return False
+        return True
+
+    def _cache_scan(self, cache, offset, length, digest, scan_num):
+        """Stores a parsed scan in the hdf5 cache, if its data is
+        numeric. Failures are ignored, the cache is an optimization only.
+        """
+        scan = self.outputs['scans'].get(scan_num)
+        meta = self.outputs['scans_meta'].get(scan_num)
+        if meta is None:
+            return
+        if scan is not None and not all(
+                dt == np.float64 for dt in scan.dtypes):
+            return
+        try:
+            with h5py.File(cache, 'a') as f:
+                key = str(offset)
+                if key in f:
+                    # the scan was still being written when cached,
+                    # or the file was rewritten
+                    del f[key]
+                grp = f.create_group(key)
+                grp.attrs['length'] = length
+                grp.attrs['digest'] = digest
+                grp.attrs['scan_num'] = scan_num
+                grp.attrs['meta'] = yaml.safe_dump(meta)
+                if scan is not None:
+                    grp.attrs['columns'] = yaml.safe_dump(list(scan.columns))
+                    grp.create_dataset('data', data=scan.to_numpy())
+                else:
+                    grp.attrs['columns'] = yaml.safe_dump([])
+        except (IOError, OSError, yaml.YAMLError):
+            pass
+
+    def _read_appended(self, full_path):
+        """Reads the lines appended to the spec file since the last run.
+        """
+        st = os.stat(full_path)
+        file_id = (os.path.abspath(full_path), st.st_dev, st.st_ino)
+        with open(full_path, 'rb') as file:
+            if self._can_resume(file, file_id, st.st_size):
+                self.outputs = self.spec_state['outputs']
+            else:
+                # first run, or the file was replaced or truncated
+                self.outputs = deepcopy(self.default_outputs)
+                self.spec_state = self._new_state()
+                self.spec_state['outputs'] = self.outputs
+            offset = self.spec_state['offset']
+            file.seek(offset)
+            data = file.read()
+        # a partial last line is left to be read once it is complete
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].splitlines(True)
+        if not lines:
+            return
+        start = self.outputs['last_line_read']['number'] + 1 if offset else 0
+        self._read_spec(
+            (lin.decode(errors='replace') for lin in lines), start
+        )
+        self.spec_state['offset'] = offset + end
+        self.outputs['last_line_read']['offset'] = offset + end
+        self.spec_state['file_id'] = file_id
+        self.spec_state['last_line'] = lines[-1]
+
+    def _can_resume(self, file, file_id, size):
+        """Checks that the file is the one read so far, and that the last
+        line read is still in place.
+        """
+        offset = self.spec_state['offset']
+        last_line = self.spec_state['last_line']
+        if not offset or self.spec_state['file_id'] != file_id:
+            return False
+        if size < offset:
+            return False
+        file.seek(offset - len(last_line))
+        return file.read(len(last_line)) == last_line
     
-    
-    def _read_spec(self, file):
-        # iterate lines and assign to either head or scan lists
-        state = 'beginning'
-        head = []
+    def _read_spec(self, file, start=0):
+        # iterate lines and assign to either head or scan lists;
+        # parser state is kept in spec_state, so reading can resume
+        ps = self.spec_state
 
-        for lin_num, lin in enumerate(file):
+        for lin_num, lin in enumerate(file, start):
             line = lin.split()
             self.outputs['last_line_read']['number'] = lin_num
             self.outputs['last_line_read']['text'] = lin
             # blank lines are used as breaks separating scans
             if line == []:
                 # state flag used to control how lines are parsed
-                if state == 'beginning':
+                if ps['state'] == 'beginning':
                     continue
 
-                elif state == 'head':
-                    self._parse_header(head)
-                    head = []
+                elif ps['state'] == 'head':
+                    self._parse_header(ps['head'])
+                    ps['head'] = []
 
-                elif state == 'scan':
+                elif ps['state'] == 'scan':
                     continue
 
             else:
                 # first item defines what type of info it is
                 key = line[0]
                 if '#F' in key:
-                    state = 'head'
+                    ps['state'] = 'head'
                 elif '#S' in key:
-                    state = 'scan'
-                    scan_num = int(line[1])
+                    self._flush_rows()
+                    ps['state'] = 'scan'
+                    ps['scan_num'] = int(line[1])
 
-                if state == 'head':
-                    head.append(line)
+                if ps['state'] == 'head':
+                    ps['head'].append(line)
 
-                elif state == 'scan':
-                    self._parse_scan(line, scan_num)
+                elif ps['state'] == 'scan':
+                    self._parse_scan(line, ps['scan_num'])
+        self._flush_rows()
     
     
     def _parse_header(self, head):
@@ -112,7 +325,7 @@ class LoadSpecFile(Operation):
                     meta['File'] = line[1:]
 
                 elif key == 'E':
-                    meta['Epoch'] = eval(line[1])
+                    meta['Epoch'] = str_to_num(line[1])
 
                 elif key == 'D':
                     meta['Date'] = ' '.join(line[1:])
@@ -164,21 +377,21 @@ class LoadSpecFile(Operation):
 
             elif 'T' in flag or 'M' in flag:
                 self.outputs['scans_meta'][scan_num]['Counter'] = \
-                    {'Amount': eval(line[1]), 'Type': line[2]}
+                    {'Amount': str_to_num(line[1]), 'Type': line[2]}
 
             elif 'G' in flag:
                 key = int(flag[2:])
                 self.outputs['scans_meta'][scan_num]['Goniometer'][key] = \
-                    soft_list_eval(line[1:])
+                    soft_list_num(line[1:])
 
             elif 'Q' in flag:
                 self.outputs['scans_meta'][scan_num]['HKL'] = \
-                    soft_list_eval(line[1:])
+                    soft_list_num(line[1:])
 
             elif 'P' in flag:
                 motor_num = int(flag[2:])
                 names = self.outputs['header']['motors'][motor_num]
-                positions = [eval(x) for x in line[1:]]
+                positions = soft_list_num(line[1:])
                 self.outputs['scans_meta'][scan_num]['Motors'].update(
                     {name: position for name, position in 
                     zip(names, positions)}
@@ -186,13 +399,45 @@ class LoadSpecFile(Operation):
             # TODO: decide what to do with N;
 
             elif 'L' in flag:
+                self._flush_rows()
                 self.outputs['scans'][scan_num] = pd.DataFrame(columns=line[1:])
 
         else:
-            vals = soft_list_eval(line)
+            # data rows are converted in bulk by _flush_rows
+            self.spec_state['rows'].append(line)
+
+    def _flush_rows(self):
+        """Converts the data rows collected for the current scan and
+        appends them to its DataFrame.
+        """
+        ps = self.spec_state
+        rows = ps['rows']
+        if not rows:
+            return
+        ps['rows'] = []
+        scan_num = ps['scan_num']
+        scan = self.outputs['scans'].get(scan_num)
+        columns = None if scan is None else scan.columns
+        start = 0 if scan is None else len(scan)
+        index = pd.RangeIndex(start, start + len(rows))
+
+        data = None
+        if columns is not None and all(len(r) == len(columns) for r in rows):
             try:
-                idx = self.outputs['scans'][scan_num].index[-1] + 1
-                self.outputs['scans'][scan_num].loc[idx] = vals
-            except IndexError:
-                self.outputs['scans'][scan_num].loc[0] = vals
+                data = np.array(
+                    [tok for r in rows for tok in r], dtype=float
+                ).reshape(len(rows), len(columns))
+            except ValueError:
+                # non-numeric tokens: convert them one by one
+                data = None
+        if data is not None:
+            new = pd.DataFrame(data, columns=columns, index=index)
+        else:
+            new = pd.DataFrame([soft_list_num(r) for r in rows], index=index)
+            if columns is not None and len(new.columns) == len(columns):
+                new.columns = columns
+        if scan is None or len(scan) == 0:
+            self.outputs['scans'][scan_num] = new
+        else:
+            self.outputs['scans'][scan_num] = pd.concat([scan, new])
     
\ No newline at end of file
@@ -1,4 +1,8 @@
 from collections import OrderedDict
+import copy
+import os
+from threading import Condition
+
 from pyFAI.detectors import Detector
 import numpy as np
 
@@ -17,7 +21,8 @@ inputs = OrderedDict(
         "rot3": 0
     },
     poni_file = None,
-    spec_dict = {}
+    spec_dict = {},
+    scan_data = None
 )
 
 outputs = {
@@ -33,32 +38,122 @@ outputs = {
         'pixel1': 100e-6,
         'pixel2': 100e-6,
         'max_shape': None
-    }
+    },
+    'ponis': None
 }
 
+# parsed .poni files, keyed by (path, size, mtime)
+_poni_files = {}
+_poni_files_lock = Condition()
+
+
+def load_poni(poni_file):
+    """Returns the PONI parsed from poni_file, cached by path, size and
+    mtime so that the file is parsed again only when it changes. The
+    returned PONI is shared, do not modify it.
+    """
+    st = os.stat(poni_file)
+    path = os.path.abspath(poni_file)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _poni_files_lock:
+        if key not in _poni_files:
+            for old_key in [k for k in _poni_files if k[0] == path]:
+                del _poni_files[old_key]
+            _poni_files[key] = PONI.from_ponifile(poni_file)
+        return _poni_files[key]
+
+
 class MakePONI(Operation):
+    """Builds PONI geometries for frames taken at different goniometer
+    rotations, from a calibrated .poni file and motor positions.
+
+    Motor positions are taken from scan_data if it is given, else from
+    spec_dict. Scalar positions give a single geometry, in the PONI dict
+    outputs. Arrays of positions (e.g. the columns of a scan DataFrame)
+    give all geometries in one vectorized step: the PONI dict outputs
+    then hold one value per frame, and ponis holds one PONI object per
+    frame, all sharing one detector, ready for poni_key and
+    make_integrator of EwaldArch.
+    """
     def __init__(self):
         super(MakePONI, self).__init__(inputs, outputs)
+        self.input_doc['rotations'] = 'dict mapping rot1, rot2, rot3 to '\
+            'the motor names that drive them, or None for fixed rotations'
+        self.input_doc['calib_rotations'] = 'dict of motor positions, in '\
+            'radians, at which the poni file was calibrated'
+        self.input_doc['poni_file'] = 'path to a pyFAI .poni file'
+        self.input_doc['spec_dict'] = 'dict of motor positions'
+        self.input_doc['scan_data'] = 'DataFrame or dict of arrays of '\
+            'motor positions, one per frame; overrides spec_dict'
+        self.output_doc['ponis'] = 'list of PONI objects, one per frame, '\
+            'or None for a single set of motor positions'
         self.base = None
-    
+        self.base_key = None
+
     def run(self):
-        if self.base is None:
-            self._set_base()
-        poni = PONI.from_ponifile(self.inputs['poni_file'])
-        
+        base = self._get_base()
+        poni_file = load_poni(self.inputs['poni_file'])
+        positions = self.inputs['scan_data']
+        if positions is None:
+            positions = self.inputs['spec_dict']
+        rotations = {}
         for key, val in self.inputs['rotations'].items():
             if val is not None:
-                r = np.radians(-self.inputs['spec_dict'][val]) + getattr(self.base, key)
-                setattr(poni, key, r)
-        
-        self.outputs.update(poni.to_dict())
+                rotations[key] = (
+                    np.radians(-np.asarray(positions[val], dtype=float)) +
+                    getattr(base, key)
+                )
 
+        if all(np.ndim(r) == 0 for r in rotations.values()):
+            poni = copy.copy(poni_file)
+            for key, r in rotations.items():
+                setattr(poni, key, float(r))
+            self.outputs.update(poni.to_dict())
+            self.outputs['ponis'] = None
+            return self.outputs
+
+        n_frames = max(np.size(r) for r in rotations.values())
+        table = {}
+        for key, name in PONI._poni_keys.items():
+            if name in rotations:
+                table[key] = np.broadcast_to(
+                    rotations[name], (n_frames,)
+                ).copy()
+            else:
+                table[key] = np.full(n_frames, getattr(poni_file, name))
+        ponis = [
+            PONI(
+                dist=table['Distance'][i], poni1=table['Poni1'][i],
+                poni2=table['Poni2'][i], rot1=table['Rot1'][i],
+                rot2=table['Rot2'][i], rot3=table['Rot3'][i],
+                wavelength=table['Wavelength'][i],
+                detector=poni_file.detector
+            )
+            for i in range(n_frames)
+        ]
+        self.outputs.update(poni_file.to_dict())
+        self.outputs.update(table)
+        self.outputs['ponis'] = ponis
         return self.outputs
-    
+
+    def _get_base(self):
+        """Helper function to return the PONI at zero motor positions,
+        rebuilt when the poni file or calib_rotations change.
+        """
+        st = os.stat(self.inputs['poni_file'])
+        key = (
+            os.path.abspath(self.inputs['poni_file']), st.st_size,
+            st.st_mtime_ns,
+            tuple(sorted(self.inputs['calib_rotations'].items()))
+        )
+        if self.base is None or key != self.base_key:
+            self._set_base()
+            self.base_key = key
+        return self.base
+
     def _set_base(self):
-        base = PONI.from_ponifile(self.inputs['poni_file'])
+        base = copy.copy(load_poni(self.inputs['poni_file']))
         for key, val in self.inputs['calib_rotations'].items():
             r = getattr(base, key) - val
             setattr(base, key, r)
         self.base = base
-
@@ -27,6 +27,8 @@ class ReadSpecHeader(Operation):
         self.output_doc['data'] = 'the header data, packaged as a python dictionary'
         self.output_doc['dir_path'] = 'directory path'
         self.output_doc['filename'] = 'filename with path and extension stripped'
+        # the local timezone is looked up once, not once per header
+        self.tz = tzlocal.get_localzone()
 
     def run(self):
         p = self.inputs['file_path']
@@ -45,11 +47,10 @@ class ReadSpecHeader(Operation):
                     t_str = kvs[1].split('time:')[1].strip()
                     d['User'] = u_str
                     d['date_time'] = t_str
-                    tz = tzlocal.get_localzone()
                     # use strptime to create a naive datetime
                     dt = datetime.datetime.strptime(t_str.strip(),"%a %b %d %H:%M:%S %Y")
                     # add timezone information to datetime
-                    dt_aware = datetime.datetime(dt.year,dt.month,dt.day,dt.hour,dt.minute,dt.second,dt.microsecond,tz)
+                    dt_aware = datetime.datetime(dt.year,dt.month,dt.day,dt.hour,dt.minute,dt.second,dt.microsecond,self.tz)
                     # interpret the time in UTC 
                     t = time.mktime(dt_aware.timetuple())
                     d['time'] = float(t)
@@ -1,6 +1,7 @@
 from collections import OrderedDict
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 from ..Operation import Operation
 
@@ -52,7 +53,8 @@ class EasyZingers1d(Operation):
 
     def __init__(self):
         super(EasyZingers1d, self).__init__(inputs, outputs)
-        self.input_doc['q_I'] = 'n-by-2 array of q values and corresponding intensities'
+        self.input_doc['q_I'] = 'n-by-2 array of q values and corresponding intensities, '\
+            'or a stack of such arrays, with shape (n_patterns, n, 2)'
         self.input_doc['sharpness_limit'] = 'sharpness limit '\
             'for flagging zingers- turn this down to catch more zingers, '\
             'turn it up to catch fewer zingers'
@@ -60,60 +62,122 @@ class EasyZingers1d(Operation):
             'on either side of a given pixel '\
             'used to evaluate sharpness of the pixel'
         self.output_doc['q_I_dz'] = 'same as input q_I but with zingers removed'
-        self.output_doc['zmask'] = 'array of booleans, same shape as q, true if there is a zinger at q, else false'
+        self.output_doc['zmask'] = 'array of booleans, same shape as q, true if there is a zinger at q, else false; '\
+            'for a stack, one row per pattern'
 
     def run(self):
-        q_I = self.inputs['q_I']
+        q_I = np.asarray(self.inputs['q_I'],dtype=float)
         I_ratio_limit = self.inputs['sharpness_limit'] 
         w = self.inputs['window_width'] 
-        q = q_I[:,0]
-        I = q_I[:,1]
-        I_dz = np.array(I)
-        zmask = np.array(np.zeros(len(q)),dtype=bool)
-        idx_z = []
-        I_z = []
-        stop_idx = len(q)-w-1
-        test_range = iter(range(w,stop_idx))
-        idx = next(test_range)
-        while idx < stop_idx-1:
-            idx_l = np.array([i for i in np.arange(idx-w,idx+1,1) if not i in idx_z])
-            idx_r = np.array([i for i in np.arange(idx,idx+w+1,1) if not i in idx_z])
-            Ii_l = np.array(I[idx_l])
-            Ii_r = np.array(I[idx_r])
-            # subtract a linear background from either side
-            #Ii_l = Ii_l - np.polyval(np.polyfit(idx_l[:-1],Ii_l[:-1],1),idx_l)
-            #Ii_r = Ii_r - np.polyval(np.polyfit(idx_r[1:],Ii_r[1:],1),idx_r)
-            # Subtract an approximate linear background from either side
-            q_ratio_l = (q[idx_l[-1]] - q[idx_l[:-1]]) / (q[idx_l[-1]]-q[idx_l[0]])  
-            q_ratio_r = (q[idx_r[1:]] - q[idx_r[0]])   / (q[idx_r[-1]]-q[idx_r[0]])  
-            Ii_l[:-1] = Ii_l[:-1] - q_ratio_l * (Ii_l[0]-Ii_l[-2]) 
-            Ii_r[1:] = Ii_r[1:] - q_ratio_r * (Ii_r[-1]-Ii_r[1]) 
-            Istd_l = np.std(Ii_l[:-1]) 
-            Istd_r = np.std(Ii_r[1:]) 
-            
-            #I_ratio_l = Ii_l[-1]/Istd_l
-            #I_ratio_r = Ii_r[0]/Istd_r
-            #I_ratio_l = (Ii_l[-1]-Ii_l[-2])/Imean_diff_l
-            #I_ratio_r = (Ii_r[0]-Ii_r[1])/Imean_diff_r
-            if Istd_l and Istd_r:
-                I_ratio_l = (Ii_l[-1]-Ii_l[-2])/Istd_l
-                I_ratio_r = (Ii_r[0]-Ii_r[1])/Istd_r
-                if I_ratio_l > I_ratio_limit or I_ratio_r > I_ratio_limit:
-                    self.message_callback('found a zinger: q = {}, I = {}'.format(q[idx],I[idx]))
-                    idx_z.append(idx)
-                    zmask[idx] = True
-                    I_dz[idx] = np.nan
-            idx = next(test_range) 
-        q_z = [q[i] for i in idx_z]
-        I_z = [I[i] for i in idx_z]
-        newIvals = np.zeros(len(q_z)) 
-        for qi,zi in zip(idx_z,range(len(idx_z))):
-            Idzi = I_dz[qi-w:qi+w+1]
-            Idzi = Idzi[~np.isnan(Idzi)]
-            newIvals[zi] = np.mean(Idzi)
-        for i,iq in zip(range(len(idx_z)),idx_z):
-            I_dz[iq] = newIvals[i]
-        self.outputs['q_I_dz'] = np.array([q,I_dz]).T
+        # a single pattern is treated as a stack of one
+        stack = q_I if q_I.ndim == 3 else q_I[None,:,:]
+        flags = self.window_flags(stack[:,:,0],stack[:,:,1],w,I_ratio_limit)
+        q_I_dz = np.array(stack)
+        zmask = np.zeros(stack.shape[:2],dtype=bool)
+        for ipat in range(stack.shape[0]):
+            q = stack[ipat,:,0]
+            I = stack[ipat,:,1]
+            idx_z = self.correct_flags(q,I,flags[ipat],w,I_ratio_limit)
+            for idx in idx_z:
+                self.message_callback('found a zinger: q = {}, I = {}'.format(q[idx],I[idx]))
+            I_dz = q_I_dz[ipat,:,1]
+            I_dz[idx_z] = np.nan
+            zmask[ipat,idx_z] = True
+            newIvals = np.zeros(len(idx_z)) 
+            for zi,qi in enumerate(idx_z):
+                Idzi = I_dz[qi-w:qi+w+1]
+                Idzi = Idzi[~np.isnan(Idzi)]
+                newIvals[zi] = np.mean(Idzi)
+            I_dz[idx_z] = newIvals
+        if q_I.ndim != 3:
+            q_I_dz = q_I_dz[0]
+            zmask = zmask[0]
+        self.outputs['q_I_dz'] = q_I_dz
         self.outputs['zmask'] = zmask
         return self.outputs
 
+    @staticmethod
+    def window_flags(q,I,w,I_ratio_limit):
+        """Flag sharp points, assuming no other point is a zinger.
+
+        `q` and `I` are (n_patterns, n_points) arrays.
+        The left and right windows of all points are evaluated at once,
+        as sliding window views.
+        Returns an (n_patterns, n_points) boolean array.
+        Points are tested from index w to n_points-w-3.
+        """
+        n_pat,n_pts = q.shape
+        flags = np.zeros((n_pat,n_pts),dtype=bool)
+        n_test = n_pts-2*w-2
+        if n_test <= 0:
+            return flags
+        win_q = sliding_window_view(q,w+1,axis=1)
+        win_I = sliding_window_view(I,w+1,axis=1)
+        # the left window of point idx starts at idx-w, the right window at idx
+        q_l = win_q[:,:n_test]
+        I_l = win_I[:,:n_test]
+        q_r = win_q[:,w:w+n_test]
+        I_r = win_I[:,w:w+n_test]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            # subtract an approximate linear background from either side
+            q_ratio_l = (q_l[:,:,-1:] - q_l[:,:,:-1]) / (q_l[:,:,-1:]-q_l[:,:,:1])
+            q_ratio_r = (q_r[:,:,1:] - q_r[:,:,:1])   / (q_r[:,:,-1:]-q_r[:,:,:1])
+            # contiguous copies, so that std() sums in the same order as for one window
+            Ii_l = np.ascontiguousarray(I_l[:,:,:-1] - q_ratio_l * (I_l[:,:,:1]-I_l[:,:,-2:-1]))
+            Ii_r = np.ascontiguousarray(I_r[:,:,1:] - q_ratio_r * (I_r[:,:,-1:]-I_r[:,:,1:2]))
+            Istd_l = np.std(Ii_l,axis=2)
+            Istd_r = np.std(Ii_r,axis=2)
+            I_ratio_l = (I_l[:,:,-1]-Ii_l[:,:,-1])/Istd_l
+            I_ratio_r = (I_r[:,:,0]-Ii_r[:,:,0])/Istd_r
+            flags[:,w:w+n_test] = (Istd_l != 0) & (Istd_r != 0) \
+                & ((I_ratio_l > I_ratio_limit) | (I_ratio_r > I_ratio_limit))
+        return flags
+
+    @staticmethod
+    def correct_flags(q,I,flags,w,I_ratio_limit):
+        """Return the indices of zingers in one pattern, in order.
+
+        Zingers are excluded from the left windows of the points after them,
+        so the window_flags() of the w points following a zinger
+        are re-evaluated one by one, with the zingers excluded.
+        Elsewhere the window_flags() are exact.
+        """
+        n_pts = len(q)
+        last_idx = n_pts-w-3
+        candidates = np.flatnonzero(flags)
+        idx_z = []
+        idx = w
+        while True:
+            icand = np.searchsorted(candidates,idx)
+            if icand == len(candidates):
+                break
+            idx_z.append(int(candidates[icand]))
+            idx = idx_z[-1]+1
+            while idx <= last_idx and idx <= idx_z[-1]+w:
+                idx_l = np.array([i for i in range(idx-w,idx+1) if not i in idx_z[-w:]])
+                idx_r = np.arange(idx,idx+w+1,1)
+                if EasyZingers1d.is_zinger(q,I,idx_l,idx_r,I_ratio_limit):
+                    idx_z.append(idx)
+                idx += 1
+        return idx_z
+
+    @staticmethod
+    def is_zinger(q,I,idx_l,idx_r,I_ratio_limit):
+        """Test one point against its left and right windows, given as index arrays"""
+        if len(idx_l) < 2:
+            return False
+        Ii_l = np.array(I[idx_l])
+        Ii_r = np.array(I[idx_r])
+        # Subtract an approximate linear background from either side
+        q_ratio_l = (q[idx_l[-1]] - q[idx_l[:-1]]) / (q[idx_l[-1]]-q[idx_l[0]])  
+        q_ratio_r = (q[idx_r[1:]] - q[idx_r[0]])   / (q[idx_r[-1]]-q[idx_r[0]])  
+        Ii_l[:-1] = Ii_l[:-1] - q_ratio_l * (Ii_l[0]-Ii_l[-2]) 
+        Ii_r[1:] = Ii_r[1:] - q_ratio_r * (Ii_r[-1]-Ii_r[1]) 
+        Istd_l = np.std(Ii_l[:-1]) 
+        Istd_r = np.std(Ii_r[1:]) 
+        if Istd_l and Istd_r:
+            I_ratio_l = (Ii_l[-1]-Ii_l[-2])/Istd_l
+            I_ratio_r = (Ii_r[0]-Ii_r[1])/Istd_r
+            return bool(I_ratio_l > I_ratio_limit or I_ratio_r > I_ratio_limit)
+        return False
+
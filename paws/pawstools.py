@@ -4,7 +4,10 @@ import os
 import re
 import time
 import string 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import h5py
 import numpy as np
 import pandas as pd
@@ -519,6 +522,36 @@ def soft_list_eval(data):
     return out
 
 
+def str_to_num(x):
+    """Converts a string to an int or float if possible, without eval.
+
+    args:
+        x: str, token to convert
+
+    returns:
+        out: int, float, or x if it is not a number
+    """
+    try:
+        return int(x)
+    except ValueError:
+        try:
+            return float(x)
+        except ValueError:
+            return x
+
+
+def soft_list_num(data):
+    """Creates list of items in data converted with str_to_num.
+
+    args:
+        data: list of str
+
+    returns:
+        out: list of values in data, numbers where possible
+    """
+    return [str_to_num(x) for x in data]
+
+
 def catch_h5py_file(filename, *args, **kwargs):
     while True:
         try:
@@ -528,3 +561,114 @@ def catch_h5py_file(filename, *args, **kwargs):
             pass
     return hdf5_file
 
+
+
+def prefetch(func, items, n_workers=4, depth=None):
+    """Generator that yields func(item) for each item, in order,
+    while a thread pool works ahead on upcoming items.
+
+    args:
+        func: callable, applied to each item
+        items: iterable, items are only drawn as the pool needs them
+        n_workers: int, number of threads in the pool
+        depth: int, maximum number of results computed ahead of the
+            consumer, defaults to 2*n_workers
+
+    returns:
+        generator of func(item) for each item
+    """
+    if depth is None:
+        depth = 2*n_workers
+    depth = max(int(depth), 1)
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        try:
+            for item in itertools.islice(items, depth):
+                pending.append(pool.submit(func, item))
+            while pending:
+                result = pending.popleft().result()
+                for item in itertools.islice(items, 1):
+                    pending.append(pool.submit(func, item))
+                yield result
+        finally:
+            # consumer stopped early: drop the work queued ahead
+            for fut in pending:
+                fut.cancel()
+
+
+def stack_column(values):
+    """Stacks a list of per-sample values into one array, if possible.
+
+    Arrays of equal shape are stacked along a new first axis, numbers and
+    None (as nan) become a 1D float array. Anything else is returned as is.
+
+    args:
+        values: list of per-sample values
+
+    returns:
+        column: numpy array, or values if they cannot be stacked
+    """
+    if not values:
+        return values
+    if all(isinstance(v, np.ndarray) for v in values):
+        if all(v.shape == values[0].shape for v in values):
+            return np.stack(values)
+        return values
+    if all(v is None or (isinstance(v, (int, float, np.number))
+           and not isinstance(v, bool)) for v in values):
+        if all(v is None for v in values):
+            return values
+        return np.array(
+            [np.nan if v is None else v for v in values], dtype=float
+        )
+    return values
+
+
+def table_column(values):
+    """Builds a table from a list of per-sample dicts. Missing samples
+    (None) become rows of nan.
+
+    args:
+        values: list of dicts or None
+
+    returns:
+        table: DataFrame with one row per sample, or values if they are not
+            all dicts or None
+    """
+    if not all(v is None or isinstance(v, dict) for v in values):
+        return values
+    return pd.DataFrame([v if v is not None else {} for v in values],
+                        index=range(len(values)))
+
+
+class PermutedList(Sequence):
+    """Read-only view of a sequence in permuted order. Items are looked up
+    in the underlying sequence on access, nothing is copied.
+
+    Attributes:
+        data: underlying sequence
+        index: array of int, positions in data of the items of the view
+    """
+
+    def __init__(self, data, index):
+        self.data = data
+        self.index = np.asarray(index, dtype=int)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PermutedList(self.data, self.index[i])
+        return self.data[int(self.index[i])]
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.data[int(i)]
+
+    def __repr__(self):
+        return 'PermutedList({})'.format(list(self))
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
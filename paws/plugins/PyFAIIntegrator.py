@@ -1,57 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import os
+import queue
 from threading import Condition
 
+import numpy as np
 import pyFAI.azimuthalIntegrator as pfaz
 
 from .PawsPlugin import PawsPlugin
+from .. import pyfaitools
 
 class PyFAIIntegrator(PawsPlugin):
     """Plugin for applying a PyFAI.AzimuthalIntegrator.
 
     Input calibration file should be in one of the formats
     outlined in the package documentation. 
+
+    The plugin keeps a pool of n_integrators clones of the calibrated integrator,
+    so that integrate_to_1d() and integrate_to_2d() can run concurrently
+    from several threads, each call checking out one clone from the pool.
+    The calibrated integrator itself, self.integrator, is not in the pool:
+    it is only cloned, and reading its geometry never races with a pooled integration.
+    Integrate through the plugin methods rather than with self.integrator directly.
+
+    If a pyfaitools.CSRCache is provided as `csr_cache`,
+    integrate_to_1d() takes its integration matrix from the cache,
+    so that the matrix is built only once across processes and restarts.
+
+    integrate_stack_to_1d() integrates many images of one shape at once,
+    as a single sparse matrix product with the integration matrix.
     """
 
-    def __init__(self,calib_file,q_min=0.,q_max=1.,verbose=False,log_file=None):
+    def __init__(self,calib_file,q_min=0.,q_max=1.,verbose=False,log_file=None,n_integrators=1,csr_cache=None):
         super(PyFAIIntegrator,self).__init__(verbose=verbose,log_file=log_file)
         self.calib_file = calib_file
         self.q_min = q_min
         self.q_max = q_max
+        self.n_integrators = n_integrators
+        self.csr_cache = csr_cache
+        # integrator_lock guards self.integrator and self.pool;
+        # integrations only hold a clone checked out from the pool
         self.integrator_lock = Condition()
         self.integrator = None
+        self.pool = None
+        # in-memory integration matrices, used if there is no csr_cache
+        self.csr_matrices = {}
 
     def start(self):
         super(PyFAIIntegrator,self).start()
-        with self.integrator_lock:
-            self.integrator = pfaz.AzimuthalIntegrator()
         self.set_calib()
 
     def set_calib(self):
+        """Calibrate a new integrator from calib_file and rebuild the pool from it.
+
+        The current integrator is never modified:
+        its clones may be integrating in other threads.
+        """
         self.message_callback('calibrating on {}'.format(self.calib_file))
+        integrator = pfaz.AzimuthalIntegrator()
         fp,xt = os.path.splitext(self.calib_file)
         if xt in ['.poni','.PONI']:
             #g = pyFAI.geometry.Geometry()
             #g.read(calib)
             #p.setPyFAI(g.getPyFAI())
-            with self.integrator_lock:
-                self.integrator.read(self.calib_file)
+            integrator.read(self.calib_file)
         elif xt in ['.nika','.NIKA']:
-            with self.integrator_lock:
-                self.set_nika(self.calib_file)
+            self.set_nika(self.calib_file,integrator)
+        with self.integrator_lock:
+            self.integrator = integrator
+        self.build_pool()
+
+    def build_pool(self):
+        """Fill the integrator pool with clones of the calibrated integrator.
+
+        Integrations that are running while the pool is rebuilt
+        return their integrator to the pool they took it from,
+        so they never leak into the new pool.
+        """
+        with self.integrator_lock:
+            self.pool = self._new_pool([copy.deepcopy(self.integrator) for i in range(self.n_integrators)])
+            self.csr_matrices = {}
+
+    def _new_pool(self,ais):
+        pool = queue.Queue()
+        for ai in ais:
+            pool.put(ai)
+        return pool
+
+    def warm_up(self,img_shape,npt=1000,polz_factor=0.,unit='q_A^-1'):
+        """Integrate a blank image with every integrator in the pool.
+
+        pyFAI builds its pixel-to-bin lookup tables on the first integration
+        for a given image shape and binning: 
+        warming up moves this cost out of the first real integrations.
+
+        Fresh clones are warmed up outside the pool and then replace it,
+        so warming up never waits for integrations running in other threads.
+        If the plugin is recalibrated meanwhile, the warmed clones are dropped.
+        """
+        with self.integrator_lock:
+            integrator = self.integrator
+        ais = [copy.deepcopy(integrator) for i in range(self.n_integrators)]
+        with ThreadPoolExecutor(max_workers=self.n_integrators) as ex:
+            list(ex.map(lambda ai: ai.integrate1d(np.zeros(img_shape),npt,
+                polarization_factor=polz_factor,unit=unit,radial_range=(self.q_min,self.q_max)), ais))
+        with self.integrator_lock:
+            if self.integrator is integrator:
+                self.pool = self._new_pool(ais)
 
     def integrate_to_1d(self,img_data,npt=1000,polz_factor=0.,unit='q_A^-1'):
         with self.integrator_lock:
-            q,I = self.integrator.integrate1d(img_data,npt,
-                polarization_factor=polz_factor,unit=unit,radial_range=(self.q_min,self.q_max))
+            pool = self.pool
+        ai = pool.get()
+        try:
+            if self.csr_cache is not None:
+                q,I = self._integrate_csr(ai,img_data,npt,polz_factor,unit)
+            else:
+                q,I = ai.integrate1d(img_data,npt,
+                    polarization_factor=polz_factor,unit=unit,radial_range=(self.q_min,self.q_max))
+        finally:
+            pool.put(ai)
         return q,I
 
+    def integrate_stack_to_1d(self,imgs,npt=1000,polz_factor=0.,unit='q_A^-1',mask=None):
+        """Integrate a stack of images of one shape with one sparse matrix product.
+
+        Pixels masked by the detector (e.g. module gaps) are masked out,
+        together with the nonzero pixels of `mask`, as in integrate_to_1d().
+        Returns q and an array of I, with one row for each of `imgs`.
+        """
+        with self.integrator_lock:
+            pool = self.pool
+        ai = pool.get()
+        try:
+            shape = np.shape(imgs[0])
+            csr,q = self._get_csr(ai,shape,npt,unit)
+            corr = ai.solidAngleArray(shape)*ai.polarization(shape,polz_factor)
+            mask = pyfaitools.detector_mask(ai,shape,mask)
+        finally:
+            pool.put(ai)
+        res = pyfaitools.integrate_stack_1d(csr,imgs,masks=mask,corrections=corr)
+        return np.array(q),res['intensity']
+
+    def _integrate_csr(self,ai,img_data,npt,polz_factor,unit):
+        # same result as integrate1d(): binned signal over binned corrections,
+        # both without the pixels masked by the detector
+        shape = np.shape(img_data)
+        csr,q = self._get_csr(ai,shape,npt,unit)
+        corr = ai.solidAngleArray(shape)*ai.polarization(shape,polz_factor)
+        mask = pyfaitools.detector_mask(ai,shape)
+        res = pyfaitools.integrate_stack_1d(csr,[img_data],masks=mask,corrections=corr)
+        return np.array(q),res['intensity'][0]
+
+    def _get_csr(self,ai,shape,npt,unit):
+        if self.csr_cache is not None:
+            return self.csr_cache.get(ai,shape,npt,unit,(self.q_min,self.q_max))
+        key = pyfaitools.csr_key(ai,shape,npt,unit,(self.q_min,self.q_max))
+        with self.integrator_lock:
+            if key not in self.csr_matrices:
+                self.csr_matrices[key] = pyfaitools.get_csr(ai,shape,npt,unit,(self.q_min,self.q_max))
+            return self.csr_matrices[key]
+
     def integrate_to_2d(self,img_data,npt_rad=1000,npt_azim=1000,polz_factor=0.,unit='q_A^-1'):
         with self.integrator_lock:
-            I_at_q_chi,q,chi = self.integrator.integrate2d(img_data,
+            pool = self.pool
+        ai = pool.get()
+        try:
+            I_at_q_chi,q,chi = ai.integrate2d(img_data,
                 npt_rad,npt_azim,polarization_factor=polz_factor,unit=unit)
+        finally:
+            pool.put(ai)
         return q,chi,I_at_q_chi
 
-    def set_nika(self,nika_file):
+    def map_to_1d(self,imgs,npt=1000,polz_factor=0.,unit='q_A^-1'):
+        """Integrate a list of images concurrently across the integrator pool.
+
+        Returns a list of (q,I) tuples, in the same order as `imgs`.
+        """
+        with ThreadPoolExecutor(max_workers=self.n_integrators) as ex:
+            return list(ex.map(lambda img: self.integrate_to_1d(img,
+                npt=npt,polz_factor=polz_factor,unit=unit), imgs))
+
+    def set_nika(self,nika_file,integrator):
         # TODO: make nika format yaml-able
         for line in open(nika_file,'r'):
             kv = line.strip().split('=')
@@ -85,5 +215,5 @@ class PyFAIIntegrator(PawsPlugin):
         #tmpint.setFit2D(d_mm,bcx_px,bcy_px,tilt_deg,rot_fit2d,pxsz_x_um,pxsz_y_um)
         #pd = tmpint.getPyFAI()
         #self.integrator.setPyFAI(**pd)
-        self.integrator.set_wavelength(wl_m)
-        self.integrator.setFit2D(d_mm,bcx_px,bcy_px,tilt_deg,rot_fit2d,pxsz_x_um,pxsz_y_um)
+        integrator.set_wavelength(wl_m)
+        integrator.setFit2D(d_mm,bcx_px,bcy_px,tilt_deg,rot_fit2d,pxsz_x_um,pxsz_y_um)
@@ -25,21 +25,37 @@ def parse_unit(result, wavelength):
         result: result from 1dintegrator
         wavelength: wavelength for conversion in Angstroms
 
+    returns:
+        int_1d_2theta: two theta array
+        int_1d_q: q array
+    """
+    return convert_radial(result.radial, result.unit, wavelength)
+
+
+def convert_radial(radial, unit, wavelength):
+    """Helper function to take a radial array in unit and return a two
+    theta and q array regardless of the unit.
+
+    args:
+        radial: array, radial bin centers
+        unit: pyFAI unit or str, units.TTH_DEG or units.Q_A
+        wavelength: wavelength for conversion in Angstroms
+
     returns:
         int_1d_2theta: two theta array
         int_1d_q: q array
     """
     if wavelength is None:
-        return result.radial, None
+        return radial, None
 
-    if result.unit == units.TTH_DEG or str(result.unit) == '2th_deg':
-        int_1d_2theta = result.radial
+    if unit == units.TTH_DEG or str(unit) == '2th_deg':
+        int_1d_2theta = radial
         int_1d_q = (
             (4 * np.pi / wavelength*1e10) *
             np.sin(np.radians(int_1d_2theta / 2))
         )
-    elif result.unit == units.Q_A or str(result.unit) == 'q_A^-1':
-        int_1d_q = result.radial
+    elif unit == units.Q_A or str(unit) == 'q_A^-1':
+        int_1d_q = radial
         int_1d_2theta = (
             2*np.degrees(
                 np.arcsin(
@@ -54,6 +70,76 @@ def parse_unit(result, wavelength):
     return int_1d_2theta, int_1d_q
 
 
+def poni_key(poni, ai_args={}):
+    """Helper function to build a hashable key describing the geometry
+    of a PONI object, used to share integrators between arches.
+
+    args:
+        poni: PONI object
+        ai_args: dict, extra arguments passed to AzimuthalIntegrator
+
+    returns:
+        key: tuple, equal for PONI objects with the same geometry
+    """
+    det = poni.detector
+    max_shape = det.max_shape
+    if max_shape is not None:
+        max_shape = tuple(int(x) for x in max_shape)
+    return (
+        float(poni.dist), float(poni.poni1), float(poni.poni2),
+        float(poni.rot1), float(poni.rot2), float(poni.rot3),
+        float(poni.wavelength), det.name, float(det.pixel1),
+        float(det.pixel2), max_shape,
+        tuple(sorted((str(k), repr(v)) for k, v in ai_args.items()))
+    )
+
+
+def make_integrator(poni, ai_args={}):
+    """Helper function to build an AzimuthalIntegrator from a PONI.
+
+    args:
+        poni: PONI object
+        ai_args: dict, extra arguments passed to AzimuthalIntegrator
+
+    returns:
+        integrator: AzimuthalIntegrator object from pyFAI
+    """
+    return AzimuthalIntegrator(
+        dist=poni.dist,
+        poni1=poni.poni1,
+        poni2=poni.poni2,
+        rot1=poni.rot1,
+        rot2=poni.rot2,
+        rot3=poni.rot3,
+        wavelength=poni.wavelength,
+        detector=poni.detector,
+        **ai_args
+    )
+
+
+def shared_integrators(ponis, ai_args={}):
+    """Helper function to build integrators for many PONI objects, e.g.
+    the per-frame geometries from MakePONI, with one integrator per
+    distinct geometry.
+
+    args:
+        ponis: list of PONI objects
+        ai_args: dict, extra arguments passed to AzimuthalIntegrator
+
+    returns:
+        integrators: list of AzimuthalIntegrator objects, one per PONI,
+            shared between PONI objects with the same poni_key
+    """
+    integrators = {}
+    out = []
+    for poni in ponis:
+        key = poni_key(poni, ai_args)
+        if key not in integrators:
+            integrators[key] = make_integrator(poni, ai_args)
+        out.append(integrators[key])
+    return out
+
+
 class EwaldArch(PawsPlugin):
     """Class for storing area detector data collected in
     X-ray diffraction experiments.
@@ -85,12 +171,14 @@ class EwaldArch(PawsPlugin):
         set_scan_info: replace scan_info
         save_to_h5: save data to hdf5 file
         load_from_h5: load data from hdf5 file
+        load_data_from_h5: load data, but not poni, from hdf5 group
         copy: create copy of arch
     """
     # pylint: disable=too-many-instance-attributes
 
     def __init__(self, idx=None, map_raw=None, poni=PONI(), mask=None,
-                 scan_info={}, ai_args={}, file_lock=Condition()):
+                 scan_info={}, ai_args={}, file_lock=Condition(),
+                 integrator=None):
         # pylint: disable=too-many-arguments
         super(EwaldArch, self).__init__()
         self.idx = idx
@@ -103,17 +191,9 @@ class EwaldArch(PawsPlugin):
         self.scan_info = scan_info
         self.ai_args = ai_args
         self.file_lock = file_lock
-        self.integrator = AzimuthalIntegrator(
-            dist=self.poni.dist,
-            poni1=self.poni.poni1,
-            poni2=self.poni.poni2,
-            rot1=self.poni.rot1,
-            rot2=self.poni.rot2,
-            rot3=self.poni.rot3,
-            wavelength=self.poni.wavelength,
-            detector=self.poni.detector,
-            **ai_args
-        )
+        if integrator is None:
+            integrator = make_integrator(self.poni, ai_args)
+        self.integrator = integrator
         self.arch_lock = Condition()
         self.map_norm = 0
         self.map_q = 0
@@ -181,17 +261,7 @@ class EwaldArch(PawsPlugin):
 
         with self.arch_lock:
             self.ai_args = args
-            self.integrator = AzimuthalIntegrator(
-                dist=self.poni.dist,
-                poni1=self.poni.poni1,
-                poni2=self.poni.poni2,
-                rot1=self.poni.rot1,
-                rot2=self.poni.rot2,
-                rot3=self.poni.rot3,
-                wavelength=self.poni.wavelength,
-                detector=self.poni.detector,
-                **args
-            )
+            self.integrator = make_integrator(self.poni, args)
 
     def set_map_raw(self, new_data):
         with self.arch_lock:
@@ -250,27 +320,30 @@ class EwaldArch(PawsPlugin):
                 if str(self.idx) not in file:
                     print("No data can be found")
                 grp = file[str(self.idx)]
-                lst_attr = [
-                    "map_raw", "mask", "map_norm", "map_q", "xyz", "tcr",
-                    "qchi", "scan_info", "ai_args"
-                ]
-                pawstools.h5_to_attributes(self, grp, lst_attr)
-                pawstools.h5_to_attributes(self.int_1d, grp['int_1d'])
-                pawstools.h5_to_attributes(self.int_2d, grp['int_2d'])
+                self.load_data_from_h5(grp)
                 self.poni = PONI.from_yamdict(
                     pawstools.h5_to_dict(grp['poni'])
                 )
-                self.integrator = AzimuthalIntegrator(
-                    dist=self.poni.dist,
-                    poni1=self.poni.poni1,
-                    poni2=self.poni.poni2,
-                    rot1=self.poni.rot1,
-                    rot2=self.poni.rot2,
-                    rot3=self.poni.rot3,
-                    wavelength=self.poni.wavelength,
-                    detector=self.poni.detector,
-                    **self.ai_args
-                )
+                self.integrator = make_integrator(self.poni, self.ai_args)
+
+    def load_data_from_h5(self, grp):
+        """Loads data from an arch group without acquiring locks or
+        touching poni and integrator. Used by EwaldSphere for bulk
+        loading, where poni and integrator are shared between arches.
+
+        args:
+            grp: h5py group object holding the arch data
+
+        returns:
+            None
+        """
+        lst_attr = [
+            "map_raw", "mask", "map_norm", "map_q", "xyz", "tcr",
+            "qchi", "scan_info", "ai_args"
+        ]
+        pawstools.h5_to_attributes(self, grp, lst_attr)
+        pawstools.h5_to_attributes(self.int_1d, grp['int_1d'])
+        pawstools.h5_to_attributes(self.int_2d, grp['int_2d'])
 
     def copy(self):
         arch_copy = EwaldArch(
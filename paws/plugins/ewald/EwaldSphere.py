@@ -1,12 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
 from threading import Condition
 import time
+import h5py
+import numpy as np
 import pandas as pd
+import yaml
 from pyFAI.multi_geometry import MultiGeometry
+from pyFAI import units
 
 from ..PawsPlugin import PawsPlugin
-from .EwaldArch import EwaldArch, parse_unit
-from ...containers import int_1d_data, int_2d_data
-from ... import pawstools
+from .EwaldArch import (
+    EwaldArch, parse_unit, convert_radial, poni_key, make_integrator
+)
+from ...containers import PONI, int_1d_data, int_2d_data
+from ... import pawstools, pyfaitools
+
+# per-arch geometry columns of the stacked layout, see save_stack_to_h5
+_poni_dtype = np.dtype([
+    (name, 'float64') for name in
+    ('dist', 'poni1', 'poni2', 'rot1', 'rot2', 'rot3', 'wavelength')
+])
+
+# per-arch data saved by both hdf5 layouts, see EwaldArch.save_to_h5
+_stack_fields = (
+    ['map_raw', 'mask', 'map_norm', 'map_q', 'xyz', 'tcr', 'qchi']
+    + ['int_1d/' + key for key in int_1d_data.__dataclass_fields__]
+    + ['int_2d/' + key for key in int_2d_data.__dataclass_fields__]
+)
+
+# kinds of rows in a stacked dataset
+_ROW_ARRAY, _ROW_SCALAR, _ROW_NONE = 0, 1, 2
+_row_kind_names = ('array', 'scalar', 'none')
+
+# EwaldArch.integrate_1d keywords handled by the batched 1d integration
+_batch_1d_args = {'numpoints', 'radial_range', 'monitor', 'unit'}
+
+
+def _get_field(arch, path):
+    """Helper function to get an arch attribute such as 'int_1d/q'.
+    """
+    obj = arch
+    for name in path.split('/'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _set_field(arch, path, value):
+    """Helper function to set an arch attribute such as 'int_1d/q'.
+    """
+    names = path.split('/')
+    obj = arch
+    for name in names[:-1]:
+        obj = getattr(obj, name)
+    setattr(obj, names[-1], value)
+
+
+def _classify_row(value, path):
+    """Helper function to sort a value into array, scalar or None for the
+    stacked layout. Raises ValueError for values that can not be stacked.
+
+    returns:
+        kind: int, one of _ROW_ARRAY, _ROW_SCALAR, _ROW_NONE
+        value: array of the value, None if value is None
+    """
+    if value is None:
+        return _ROW_NONE, None
+    arr = np.asarray(value)
+    if arr.dtype.kind not in 'biufc':
+        raise ValueError(
+            f"{path} of type {type(value).__name__} can not be stacked, "
+            "save with layout='groups'"
+        )
+    if arr.ndim == 0:
+        return _ROW_SCALAR, arr
+    return _ROW_ARRAY, arr
+
+
+def _arch_row(arch):
+    """Helper function to build the poni table row and the yaml metadata
+    of an arch in the stacked layout.
+    """
+    poni_dict = arch.poni.to_dict()
+    meta = yaml.dump({
+        'scan_info': arch.scan_info,
+        'ai_args': arch.ai_args,
+        'Detector': poni_dict['Detector'],
+        'Detector_config': poni_dict['Detector_config'],
+    })
+    return tuple(getattr(arch.poni, key) for key in _poni_dtype.names), meta
+
+
+def _write_rows(dset, rows, data):
+    """Helper function to write data[i] into row rows[i] of a dataset,
+    with one write per run of consecutive rows.
+    """
+    order = np.argsort(rows, kind='stable')
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and rows[order[end]] == rows[order[end - 1]] + 1:
+            end += 1
+        dset[rows[order[start]]:rows[order[end - 1]] + 1] = \
+            data[order[start:end]]
+        start = end
+
+
+def _stack_row_kinds(stk, path):
+    """Helper function to read the row kinds of a stacked dataset.
+    Stacks written before row kinds were recorded hold arrays only.
+    """
+    n_rows = len(stk['index'])
+    if path not in stk:
+        return np.full(n_rows, _ROW_NONE, dtype='int8')
+    kind = stk[path].attrs.get('kind', 'array')
+    if kind == 'mixed':
+        return stk['row_kind'][path][()]
+    return np.full(n_rows, _row_kind_names.index(kind), dtype='int8')
+
+
+def _stack_row(data, kind, row):
+    """Helper function to restore the value of one row of a stacked
+    dataset, data may be an h5py dataset or an array.
+    """
+    if kind == _ROW_NONE:
+        return None
+    if kind == _ROW_SCALAR:
+        return np.asarray(data[row]).flat[0].item()
+    return data[row]
 
 
 class EwaldSphere(PawsPlugin):
@@ -40,7 +160,9 @@ class EwaldSphere(PawsPlugin):
         multigeometry_integrate_1d: wrapper for MultiGeometry integrate1d
             method
         save_to_h5: saves data to hdf5 file
+        save_stack_to_h5: saves arches in the stacked hdf5 layout
         load_from_h5: loads data from hdf5 file
+        load_stack_from_h5: loads arches from the stacked hdf5 layout
     """
     def __init__(self, name='scan0', arches=[], data_file='scan0',
                  scan_data=pd.DataFrame(), mg_args={'wavelength': 1e-10},
@@ -114,11 +236,22 @@ class EwaldSphere(PawsPlugin):
                     [a.integrator for a in self.arches], **self.mg_args
                 )
 
-    def by_arch_integrate_1d(self, **args):
+    def by_arch_integrate_1d(self, batched=True, csr_cache=None, **args):
         """Integrates all arches individually, then sums the results for
         the overall integration result.
 
-        args: see EwaldArch.integrate_1d
+        Arches sharing a geometry and image shape are integrated together
+        with one sparse matrix product, see pyfaitools.integrate_stack_1d.
+        Arches that cannot be batched, or all arches if args hold keywords
+        other than those of the batched path, go through
+        EwaldArch.integrate_1d.
+
+        args:
+            batched: bool, if True arches sharing a geometry are
+                integrated together
+            csr_cache: pyfaitools.CSRCache, if given integration matrices
+                are taken from it, else they are built in memory
+            args: see EwaldArch.integrate_1d
         """
         if not args:
             args = self.bai_1d_args
@@ -126,10 +259,73 @@ class EwaldSphere(PawsPlugin):
             self.bai_1d_args = args.copy()
         with self.sphere_lock:
             self.bai_1d = int_1d_data()
+            done = set()
+            # without a radial_range pyFAI fits the range to the unmasked
+            # pixels of each arch, which a shared matrix cannot do
+            if (batched and set(args) <= _batch_1d_args
+                    and args.get('radial_range', [0, 180]) is not None):
+                for group in self._geometry_groups():
+                    self._batch_integrate_1d(group, csr_cache, **args)
+                    done.update(id(arch) for arch in group)
             for arch in self.arches:
-                arch.integrate_1d(**args)
+                if id(arch) not in done:
+                    arch.integrate_1d(**args)
                 self._update_bai_1d(arch)
 
+    def _geometry_groups(self):
+        """Helper function to group arches by geometry and image shape.
+        Only groups of two or more arches are returned.
+        """
+        groups = {}
+        for arch in self.arches:
+            if arch.map_raw is None:
+                continue
+            key = (
+                poni_key(arch.poni, arch.ai_args), np.shape(arch.map_raw)
+            )
+            groups.setdefault(key, []).append(arch)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _batch_integrate_1d(self, arches, csr_cache=None, numpoints=10000,
+                            radial_range=[0, 180], monitor=None,
+                            unit=units.TTH_DEG):
+        """Helper function to integrate arches sharing a geometry with one
+        sparse matrix product. Sets the same attributes as
+        EwaldArch.integrate_1d.
+        """
+        for arch in arches:
+            arch.arch_lock.acquire()
+        try:
+            for arch in arches:
+                if monitor is not None:
+                    arch.map_norm = arch.map_raw/arch.scan_info[monitor]
+                else:
+                    arch.map_norm = arch.map_raw
+                if arch.mask is None:
+                    arch.mask = np.where(arch.map_raw < 0, 1, 0)
+
+            shape = np.shape(arches[0].map_raw)
+            csr, radial = pyfaitools.get_csr(
+                arches[0].integrator, shape, numpoints, unit, radial_range,
+                csr_cache=csr_cache
+            )
+            res = pyfaitools.integrate_stack_1d(
+                csr, [arch.map_norm for arch in arches],
+                masks=[arch.mask for arch in arches]
+            )
+            ttheta, q = convert_radial(
+                np.array(radial), unit, arches[0].poni.wavelength
+            )
+            for i, arch in enumerate(arches):
+                arch.int_1d.ttheta = ttheta
+                arch.int_1d.q = q
+                arch.int_1d.pcount = res['pcount'][i]
+                arch.int_1d.raw = res['raw'][i]
+                arch.int_1d.norm = res['norm'][i]
+        finally:
+            for arch in arches:
+                arch.arch_lock.release()
+
     def _update_bai_1d(self, arch):
         """helper function to update overall bai variables.
         """
@@ -187,34 +383,55 @@ class EwaldSphere(PawsPlugin):
                 result, self.multi_geo.wavelength)
         return result
 
-    def save_to_h5(self, file, arches=None, data_only=False, replace=False):
+    def save_to_h5(self, file, arches=None, data_only=False, replace=False,
+                   layout='groups'):
         """Saves data to hdf5 file.
 
         args:
             file: h5py file or group object
+            arches: list of arch idx to save, all arches if None
+            data_only: bool, if True only saves scan data and results
+            replace: bool, if True replaces any existing sphere data
+            layout: str, 'groups' to save each arch as its own group,
+                'stacked' to save all arches into contiguous stacked
+                datasets, see save_stack_to_h5. Must match the layout
+                of existing sphere data unless replace is True.
         """
         with self.file_lock:
             if self.name in file:
                 if replace:
                     del(file[self.name])
                     grp = file.create_group(self.name)
-                    grp.create_group('arches')
                 else:
                     grp = file[self.name]
-                    if 'arches' not in grp:
-                        grp.create_group('arches')
             else:
                 grp = file.create_group(self.name)
-                grp.create_group('arches')
+
+            saved_layout = grp.attrs.get('layout', 'groups')
+            saved = 'stack' in grp if saved_layout == 'stacked' else (
+                'arches' in grp and len(grp['arches']) > 0
+            )
+            if saved and saved_layout != layout:
+                raise ValueError(
+                    f"sphere {self.name} is saved with layout "
+                    f"'{saved_layout}', pass replace=True to save it with "
+                    f"layout '{layout}'"
+                )
 
             if arches is None:
-                for arch in self.arches:
-                    arch.save_to_h5(grp['arches'])
+                lst_arches = list(self.arches)
+            else:
+                lst_arches = list(self.arches[
+                    sorted(set(self.arches.index).intersection(set(arches)))
+                ])
+            if layout == 'stacked':
+                self.save_stack_to_h5(grp, lst_arches)
             else:
-                for arch in self.arches[
-                        list(set(self.arches.index).intersection(
-                        set(arches)))]:
+                if 'arches' not in grp:
+                    grp.create_group('arches')
+                for arch in lst_arches:
                     arch.save_to_h5(grp['arches'])
+            grp.attrs['layout'] = layout
             if data_only:
                 lst_attr = [
                     "scan_data", "mgi_1d_q", "mgi_1d_I", "mgi_2d_2theta", 
@@ -233,11 +450,300 @@ class EwaldSphere(PawsPlugin):
             pawstools.attributes_to_h5(self.bai_1d, grp['bai_1d'])
             pawstools.attributes_to_h5(self.bai_2d, grp['bai_2d'])
 
-    def load_from_h5(self, file):
+    def save_stack_to_h5(self, grp, arches, chunks=None):
+        """Saves arches into contiguous stacked datasets in the 'stack'
+        subgroup of grp. Images go into chunked 3d datasets of shape
+        (n_arches, ny, nx), int_1d arrays into 2d datasets of shape
+        (n_arches, npt), and per-arch metadata into a compact table, with
+        'index' mapping rows to arch idx. Pixel traces and stack-wide
+        reductions are then single strided reads, e.g.
+        grp['stack/map_raw'][:, y, x].
+
+        Every field saved by the group layout is stacked. Scalars and None
+        (e.g. the default map_norm of 0) are broadcast into the rows of
+        fields that hold arrays for other arches, and the kind of each row
+        is recorded in 'row_kind' so they load back unchanged.
+
+        Saving a subset of arches merges into the stack: the datasets are
+        resizable, rows of arches already in the stack are overwritten in
+        place and new arches are appended, so saving arch by arch during
+        a scan writes only the new rows. Appended rows are in save order,
+        load_stack_from_h5 sorts arches by idx. The stack is rewritten as
+        a whole, sorted by idx, only on the first save, or if the new rows
+        do not fit the existing datasets (e.g. arrays where all earlier
+        arches held scalars, or data of a wider dtype).
+
+        args:
+            grp: h5py group object for the sphere
+            arches: list of EwaldArch objects to save
+            chunks: tuple, chunk shape of image datasets, defaults to
+                blocks of up to 16 frames by 128 by 128 pixels
+
+        returns:
+            None
+
+        raises:
+            ValueError: if a field holds arrays of different shapes or
+                non-numeric data, which only the group layout can save
+        """
+        if 'stack' in grp and self._update_stack(grp['stack'], arches):
+            return
+        old = grp['stack'] if 'stack' in grp else None
+        new_idxs = {arch.idx for arch in arches}
+        # (idx, arch) for new rows, (idx, row) for kept rows of the stack
+        entries = [(arch.idx, arch) for arch in arches]
+        if old is not None:
+            old_table = old['poni'][()]
+            old_meta = old['meta'].asstr()[()]
+            entries += [
+                (int(idx), row) for row, idx in enumerate(old['index'][()])
+                if int(idx) not in new_idxs
+            ]
+        entries.sort(key=lambda entry: entry[0])
+        n_arches = len(entries)
+
+        if 'stack_new' in grp:
+            del(grp['stack_new'])
+        stk = grp.create_group('stack_new')
+        stk.create_dataset(
+            'index', data=np.array([e[0] for e in entries], dtype='int64'),
+            maxshape=(None,)
+        )
+        table = np.zeros(n_arches, dtype=_poni_dtype)
+        meta = []
+        for pos, (idx, item) in enumerate(entries):
+            if isinstance(item, EwaldArch):
+                table[pos], meta_str = _arch_row(item)
+                meta.append(meta_str)
+            else:
+                table[pos] = old_table[item]
+                meta.append(old_meta[item])
+        stk.create_dataset('poni', data=table, maxshape=(None,))
+        stk.create_dataset(
+            'meta', data=meta, dtype=h5py.special_dtype(vlen=str),
+            maxshape=(None,)
+        )
+
+        try:
+            for path in _stack_fields:
+                self._save_stack_field(stk, path, entries, old, chunks)
+        except Exception:
+            del(grp['stack_new'])
+            raise
+        if old is not None:
+            del(grp['stack'])
+        grp.move('stack_new', 'stack')
+
+    def _update_stack(self, stk, arches):
+        """Helper function to save arches into an existing stack in place,
+        see save_stack_to_h5. Returns False, before writing anything, if
+        the new rows do not fit the existing datasets.
+        """
+        fields = {}
+        datasets = [stk['index'], stk['poni'], stk['meta']]
+        for path in _stack_fields:
+            if path not in stk:
+                return False
+            dset = stk[path]
+            rows = [_classify_row(_get_field(a, path), path) for a in arches]
+            if dset.attrs.get('kind', 'array') == 'none':
+                if any(kind != _ROW_NONE for kind, value in rows):
+                    return False
+                continue
+            for kind, value in rows:
+                if kind == _ROW_ARRAY and value.shape != dset.shape[1:]:
+                    return False
+                if kind != _ROW_NONE and \
+                        np.result_type(dset.dtype, value.dtype) != dset.dtype:
+                    return False
+            datasets.append(dset)
+            if dset.attrs.get('kind') == 'mixed':
+                datasets.append(stk['row_kind'][path])
+            fields[path] = rows
+        if any(dset.maxshape[0] is not None for dset in datasets):
+            # stacks written before the datasets were resizable
+            return False
+
+        rows = {int(idx): row for row, idx in enumerate(stk['index'][()])}
+        n_rows = len(rows)
+        positions = []
+        for arch in arches:
+            if arch.idx not in rows:
+                rows[arch.idx] = n_rows
+                n_rows += 1
+            positions.append(rows[arch.idx])
+        positions = np.array(positions, dtype='int64')
+
+        table = np.zeros(len(arches), dtype=_poni_dtype)
+        meta = np.empty(len(arches), dtype=object)
+        for i, arch in enumerate(arches):
+            table[i], meta[i] = _arch_row(arch)
+        for key, data in (('index', [a.idx for a in arches]),
+                          ('poni', table), ('meta', meta)):
+            stk[key].resize((n_rows,))
+            _write_rows(stk[key], positions, np.asarray(data))
+
+        for path, field_rows in fields.items():
+            dset = stk[path]
+            dset.resize(n_rows, axis=0)
+            kinds = np.array([kind for kind, value in field_rows], dtype='int8')
+            data = np.zeros((len(arches),) + dset.shape[1:], dtype=dset.dtype)
+            for i, (kind, value) in enumerate(field_rows):
+                if kind != _ROW_NONE:
+                    data[i] = value
+            _write_rows(dset, positions, data)
+            kind_name = dset.attrs.get('kind', 'array')
+            if kind_name == 'mixed':
+                stk['row_kind'][path].resize((n_rows,))
+                _write_rows(stk['row_kind'][path], positions, kinds)
+            elif any(kinds != _row_kind_names.index(kind_name)):
+                all_kinds = np.full(
+                    n_rows, _row_kind_names.index(kind_name), dtype='int8'
+                )
+                all_kinds[positions] = kinds
+                stk.create_dataset(
+                    'row_kind/' + path, data=all_kinds, maxshape=(None,)
+                )
+                dset.attrs['kind'] = 'mixed'
+        return True
+
+    def _save_stack_field(self, stk, path, entries, old, chunks):
+        """Helper function to write one field of the stacked layout, see
+        save_stack_to_h5.
+        """
+        n_arches = len(entries)
+        old_kinds = None
+        if old is not None:
+            old_kinds = _stack_row_kinds(old, path)
+        kinds = np.zeros(n_arches, dtype='int8')
+        values = {}
+        shapes = set()
+        dtypes = []
+        for pos, (idx, item) in enumerate(entries):
+            if isinstance(item, EwaldArch):
+                kinds[pos], values[pos] = _classify_row(
+                    _get_field(item, path), path
+                )
+                if kinds[pos] != _ROW_NONE:
+                    dtypes.append(values[pos].dtype)
+                if kinds[pos] == _ROW_ARRAY:
+                    shapes.add(values[pos].shape)
+            else:
+                kinds[pos] = old_kinds[item]
+                if kinds[pos] != _ROW_NONE:
+                    dtypes.append(old[path].dtype)
+                if kinds[pos] == _ROW_ARRAY:
+                    shapes.add(old[path].shape[1:])
+        if len(shapes) > 1:
+            raise ValueError(
+                f"{path} has shapes {sorted(shapes)} and can not be stacked, "
+                "save with layout='groups'"
+            )
+        if n_arches and all(kinds == _ROW_NONE):
+            stk.create_dataset(path, shape=(0,), dtype='float64')
+            stk[path].attrs['kind'] = 'none'
+            return
+
+        shape = shapes.pop() if shapes else ()
+        dtype = np.result_type(*dtypes) if dtypes else np.float64
+        if len(shape) == 2 and all(shape):
+            # blocks of 16 frames also when the stack starts with fewer,
+            # since later saves append to it
+            if chunks is None:
+                field_chunks = (16, min(shape[0], 128), min(shape[1], 128))
+            else:
+                field_chunks = chunks
+            block_rows = field_chunks[0]
+        else:
+            field_chunks = True
+            block_rows = max(n_arches, 1)
+        dset = stk.create_dataset(
+            path, shape=(n_arches,) + shape, dtype=dtype, chunks=field_chunks,
+            maxshape=(None,) + shape
+        )
+        # write whole blocks of chunks to avoid rewriting chunks
+        for start in range(0, n_arches, block_rows):
+            block = np.zeros((min(block_rows, n_arches - start),) + shape,
+                             dtype=dtype)
+            for i in range(len(block)):
+                pos = start + i
+                if kinds[pos] == _ROW_NONE:
+                    continue
+                item = entries[pos][1]
+                if isinstance(item, EwaldArch):
+                    block[i] = values[pos]
+                else:
+                    block[i] = _stack_row(old[path], kinds[pos], item)
+            dset[start:start + len(block)] = block
+        if np.all(kinds == kinds[0]):
+            dset.attrs['kind'] = _row_kind_names[kinds[0] if n_arches else 0]
+        else:
+            dset.attrs['kind'] = 'mixed'
+            stk.create_dataset(
+                'row_kind/' + path, data=kinds, maxshape=(None,)
+            )
+
+    def load_stack_from_h5(self, grp):
+        """Loads arches saved by save_stack_to_h5.
+
+        args:
+            grp: h5py group object for the sphere
+
+        returns:
+            arches: list of EwaldArch objects, ordered as in the stack
+        """
+        stk = grp['stack']
+        idxs = stk['index'][()]
+        table = stk['poni'][()]
+        meta = [
+            yaml.load(m, Loader=yaml.UnsafeLoader) for m in stk['meta'][()]
+        ]
+        fields = {}
+        for path in _stack_fields:
+            # fields missing from older stacks keep their defaults
+            if path in stk:
+                kinds = _stack_row_kinds(stk, path)
+                data = stk[path][()] if any(kinds != _ROW_NONE) else None
+                fields[path] = (kinds, data)
+
+        integrators = {}
+        arches = []
+        for row, idx in enumerate(idxs):
+            poni_dict = {
+                'Detector': meta[row]['Detector'],
+                'Detector_config': meta[row]['Detector_config'],
+            }
+            for key, name in PONI._poni_keys.items():
+                poni_dict[key] = float(table[row][name])
+            poni = PONI.from_yamdict(poni_dict)
+            ai_args = meta[row]['ai_args']
+            geo_key = poni_key(poni, ai_args)
+            if geo_key not in integrators:
+                integrators[geo_key] = make_integrator(poni, ai_args)
+            arch = EwaldArch(
+                idx=int(idx), poni=poni, scan_info=meta[row]['scan_info'],
+                ai_args=ai_args, file_lock=self.file_lock,
+                integrator=integrators[geo_key]
+            )
+            for path, (kinds, data) in fields.items():
+                _set_field(arch, path, _stack_row(data, kinds[row], row))
+            arches.append(arch)
+        return arches
+
+    def load_from_h5(self, file, n_workers=None, set_mg=True):
         """Loads data from hdf5 file.
 
+        Arch metadata is read for all arches in one pass, integrators are
+        built once per unique geometry and shared between arches, and the
+        arch index is built in one shot rather than by repeated add_arch
+        calls.
+
         args:
             file: h5py file or group object
+            n_workers: int, if given the arch groups are decoded by this
+                many worker threads
+            set_mg: bool, if True sets the MultiGeometry attribute. Takes a
+                long time for large spheres, see add_arch.
         """
         with self.file_lock:
             with self.sphere_lock:
@@ -245,14 +751,13 @@ class EwaldSphere(PawsPlugin):
                     print("No data can be found")
                 grp = file[self.name]
 
-                self.arches = pd.Series()
-                for key in grp['arches'].keys():
-                    arch = EwaldArch(idx=int(key))
-                    arch.load_from_h5(grp['arches'])
-                    self.add_arch(
-                        arch.copy(), calculate=False, update=False,
-                        get_sd=False, set_mg=False
-                    )
+                if grp.attrs.get('layout') == 'stacked':
+                    arches = self.load_stack_from_h5(grp)
+                else:
+                    arches = self._load_arch_groups(grp['arches'], n_workers)
+                self.arches = pd.Series(
+                    arches, index=[a.idx for a in arches]
+                ).sort_index()
 
                 lst_attr = [
                     "data_file", "scan_data", "mg_args", "bai_1d_args",
@@ -262,4 +767,38 @@ class EwaldSphere(PawsPlugin):
                 pawstools.h5_to_attributes(self, grp, lst_attr)
                 pawstools.h5_to_attributes(self.bai_1d, grp['bai_1d'])
                 pawstools.h5_to_attributes(self.bai_2d, grp['bai_2d'])
-                self.set_multi_geo(**self.mg_args)
+                if set_mg:
+                    self.set_multi_geo(**self.mg_args)
+
+    def _load_arch_groups(self, arch_grp, n_workers=None):
+        """Helper function to load arches saved as one group per arch.
+        """
+        keys = sorted(arch_grp.keys(), key=int)
+        integrators = {}
+        arches = []
+        for key in keys:
+            poni = PONI.from_yamdict(
+                pawstools.h5_to_dict(arch_grp[key]['poni'])
+            )
+            ai_args = pawstools.h5_to_data(arch_grp[key]['ai_args'])
+            if ai_args is None:
+                ai_args = {}
+            geo_key = poni_key(poni, ai_args)
+            if geo_key not in integrators:
+                integrators[geo_key] = make_integrator(poni, ai_args)
+            arches.append(EwaldArch(
+                idx=int(key), poni=poni, ai_args=ai_args,
+                file_lock=self.file_lock,
+                integrator=integrators[geo_key]
+            ))
+
+        def _load_arch(arch):
+            arch.load_data_from_h5(arch_grp[str(arch.idx)])
+
+        if n_workers:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                list(pool.map(_load_arch, arches))
+        else:
+            for arch in arches:
+                _load_arch(arch)
+        return arches
@@ -0,0 +1,245 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from ... import pawstools
+from .EwaldSphere import _stack_row_kinds, _ROW_ARRAY
+
+
+class SphereQuery(object):
+    """Read-only queries of integrated 1d results over many EwaldSphere
+    hdf5 files. Only the datasets needed to answer a query are read,
+    images are never touched. Handles both the per-arch group layout and
+    the stacked layout written by EwaldSphere.save_to_h5.
+
+    Attributes:
+        files: list of paths to hdf5 files holding EwaldSphere data
+        spheres: list of sphere names to query, all spheres if None
+        n_workers: int, if given files are queried by a thread pool of
+            this size
+
+    Methods:
+        scan_data: scan metadata for the selected arches
+        int_1d: stacked int_1d arrays, q and two theta for the selected
+            arches
+    """
+
+    def __init__(self, files, spheres=None, n_workers=None):
+        self.files = list(files)
+        self.spheres = spheres
+        self.n_workers = n_workers
+
+    def scan_data(self, arch_range=None, where=None):
+        """Returns scan metadata for the selected arches of all spheres.
+
+        args:
+            arch_range: tuple, (lower, upper) limits on arch idx, lower
+                inclusive and upper exclusive, either can be None
+            where: str or callable, selects arches by scan data. A str is
+                passed to DataFrame.query, a callable takes the scan_data
+                DataFrame of a sphere and returns a boolean mask
+
+        returns:
+            scan_data: DataFrame indexed by (file, sphere, arch)
+        """
+        results = self._map_files(
+            lambda path: self._query_file(path, arch_range, where, None)
+        )
+        return self._concat_scan_data(results)
+
+    def int_1d(self, key='norm', arch_range=None, where=None,
+               as_frame=False):
+        """Returns stacked int_1d results for the selected arches of all
+        spheres, in (file, sphere, arch) order.
+
+        args:
+            key: str, int_1d field to read, one of 'norm', 'raw',
+                'pcount'
+            arch_range: tuple, see scan_data
+            where: str or callable, see scan_data
+            as_frame: bool, if True returns DataFrames indexed by
+                (file, sphere, arch) instead of numpy arrays
+
+        returns:
+            data: dict with key, 'q' and 'ttheta' as (n_arches, npt)
+                arrays, and 'scan_data' as a DataFrame
+
+        raises:
+            KeyError: if a selected arch has no saved int_1d field key
+            ValueError: if a selected arch has not been integrated, or
+                arches were integrated with different numbers of points
+        """
+        results = self._map_files(
+            lambda path: self._query_file(path, arch_range, where, key)
+        )
+        scan_data = self._concat_scan_data(results)
+        rows = [row for res in results for row in res['index']]
+        index = pd.MultiIndex.from_tuples(
+            rows, names=['file', 'sphere', 'arch']
+        )
+        data = {'scan_data': scan_data}
+        for name in (key, 'q', 'ttheta'):
+            arrays = [a for res in results for a in res[name]]
+            for row, a in zip(rows, arrays):
+                if a.shape != arrays[0].shape:
+                    raise ValueError(
+                        f"int_1d {name} of arch {row} has shape {a.shape} "
+                        f"but arch {rows[0]} has shape {arrays[0].shape}, "
+                        "integrate all arches with the same numpoints or "
+                        "map them onto a common grid with "
+                        "paws.gridtools.regrid"
+                    )
+            if arrays:
+                data[name] = np.stack(arrays)
+            else:
+                data[name] = np.zeros((0, 0))
+            if as_frame:
+                data[name] = pd.DataFrame(data[name], index=index)
+        return data
+
+    def _map_files(self, func):
+        """Helper function to apply func to each file, optionally in a
+        thread pool, keeping the order of self.files.
+        """
+        if self.n_workers:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+                return list(pool.map(func, self.files))
+        return [func(path) for path in self.files]
+
+    def _query_file(self, path, arch_range, where, key):
+        """Helper function to query one file. If key is None only the
+        scan data is read.
+        """
+        res = {'index': [], 'scan_data': []}
+        if key is not None:
+            res.update({key: [], 'q': [], 'ttheta': []})
+        with h5py.File(path, 'r') as file:
+            for name in self._sphere_names(file):
+                grp = file[name]
+                stacked = grp.attrs.get('layout') == 'stacked'
+                if stacked:
+                    idxs = [int(i) for i in grp['stack']['index'][()]]
+                else:
+                    idxs = [int(k) for k in grp['arches'].keys()]
+                idxs = self._select(idxs, arch_range)
+
+                scan_data = pd.DataFrame()
+                if 'scan_data' in grp:
+                    scan_data = pawstools.h5_to_data(grp['scan_data'])
+                if where is not None:
+                    if isinstance(where, str):
+                        keep = scan_data.query(where).index
+                    else:
+                        keep = scan_data.index[
+                            np.asarray(where(scan_data), dtype=bool)
+                        ]
+                    keep = set(keep)
+                    idxs = [i for i in idxs if i in keep]
+                if list(scan_data.columns):
+                    scan_data = scan_data.reindex(idxs)
+                else:
+                    scan_data = pd.DataFrame(index=idxs)
+                scan_data.index = pd.MultiIndex.from_tuples(
+                    [(path, name, i) for i in idxs],
+                    names=['file', 'sphere', 'arch']
+                )
+                res['scan_data'].append(scan_data)
+                res['index'].extend((path, name, i) for i in idxs)
+                if key is None or not idxs:
+                    continue
+
+                for field in (key, 'q', 'ttheta'):
+                    if stacked:
+                        res[field].extend(
+                            self._read_stacked(grp, field, idxs)
+                        )
+                    else:
+                        res[field].extend(
+                            self._read_groups(grp, field, idxs)
+                        )
+        return res
+
+    def _sphere_names(self, file):
+        """Helper function to list sphere groups in a file.
+        """
+        names = [
+            name for name in file.keys()
+            if isinstance(file[name], h5py.Group)
+            and ('arches' in file[name] or 'stack' in file[name])
+        ]
+        if self.spheres is not None:
+            names = [name for name in names if name in self.spheres]
+        return names
+
+    @staticmethod
+    def _select(idxs, arch_range):
+        """Helper function to sort arch idx and apply arch_range.
+        """
+        idxs = sorted(idxs)
+        if arch_range is not None:
+            lower, upper = arch_range
+            if lower is not None:
+                idxs = [i for i in idxs if i >= lower]
+            if upper is not None:
+                idxs = [i for i in idxs if i < upper]
+        return idxs
+
+    @staticmethod
+    def _read_groups(grp, field, idxs):
+        """Helper function to read an int_1d field of arches saved as one
+        group per arch.
+        """
+        arrays = []
+        for i in idxs:
+            int_1d = grp['arches'][str(i)]['int_1d']
+            if field not in int_1d:
+                raise KeyError(
+                    f"int_1d field '{field}' is not saved for arch {i} of "
+                    f"sphere {grp.name}"
+                )
+            data = int_1d[field][()]
+            if np.ndim(data) != 1:
+                raise ValueError(
+                    f"arch {i} of sphere {grp.name} has no 1d {field}, "
+                    "it has not been integrated"
+                )
+            arrays.append(data)
+        return arrays
+
+    @staticmethod
+    def _read_stacked(grp, field, idxs):
+        """Helper function to read rows of a stacked int_1d dataset in a
+        single read.
+        """
+        stk = grp['stack']
+        path = 'int_1d/' + field
+        if path not in stk:
+            raise KeyError(
+                f"int_1d field '{field}' is not saved in the stack of "
+                f"sphere {grp.name}"
+            )
+        rows = {int(i): row for row, i in enumerate(stk['index'][()])}
+        sel = np.array([rows[i] for i in idxs])
+        kinds = _stack_row_kinds(stk, path)[sel]
+        if any(kinds != _ROW_ARRAY) or stk[path].ndim != 2:
+            missing = [i for i, k in zip(idxs, kinds) if k != _ROW_ARRAY]
+            raise ValueError(
+                f"arches {missing or idxs} of sphere {grp.name} have no 1d "
+                f"{field}, they have not been integrated"
+            )
+        order = np.argsort(sel)
+        # h5py point selections must be increasing
+        data = np.empty((len(sel),) + stk[path].shape[1:])
+        data[order] = stk[path][sel[order]]
+        return list(data)
+
+    @staticmethod
+    def _concat_scan_data(results):
+        """Helper function to join per-file scan data.
+        """
+        frames = [df for res in results for df in res['scan_data']]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames)
@@ -1,2 +1,3 @@
 from .EwaldSphere import EwaldSphere
-from .EwaldArch import EwaldArch
\ No newline at end of file
+from .EwaldArch import EwaldArch
+from .SphereQuery import SphereQuery
@@ -0,0 +1,264 @@
+"""
+Tools for working with the sparse integration matrices of pyFAI.
+
+pyFAI integrates an image by multiplying it with a sparse
+pixel-to-bin matrix in CSR format, built from the geometry
+the first time an integrator sees a given image shape and binning.
+Building this matrix takes seconds for large detectors,
+and pyFAI keeps it only in memory, on one integrator.
+The CSRCache stores these matrices on disk, as .npy files
+that are memory-mapped on load, so that restarted reductions
+and worker processes reuse them instead of rebuilding them.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy import sparse
+from pyFAI import units
+
+from . import pawstools
+
+csr_cache_dir = os.path.join(pawstools.paws_scratch_dir,'csr_cache')
+csr_arrays = ['data','indices','indptr','radial']
+
+def mask_hash(mask):
+    """Return a hex digest of the masked pixels of `mask` (None if no mask)"""
+    if mask is None:
+        return None
+    m = np.ascontiguousarray(np.asarray(mask) != 0)
+    return hashlib.sha1(np.packbits(m).tobytes()+str(m.shape).encode()).hexdigest()
+
+def detector_mask(integrator,shape,mask=None):
+    """Return the pixel mask pyFAI integrate1d() applies for an image of `shape`.
+
+    When no mask is passed, integrate1d() masks the pixels masked by the detector
+    (e.g. the gaps between modules of a Pilatus).
+    The CSR matrices here are built without a mask,
+    so integrations through them must apply this mask themselves.
+    Returns the detector mask combined with `mask` (nonzero pixels are masked out),
+    or None if no pixel is masked.
+    """
+    det_mask = integrator.detector.mask
+    if det_mask is not None and np.shape(det_mask) != tuple(shape):
+        # binned or cropped images: the detector mask does not apply
+        det_mask = None
+    if mask is not None:
+        mask = np.asarray(mask) != 0
+        if det_mask is not None:
+            mask = mask | (np.asarray(det_mask) != 0)
+    elif det_mask is not None:
+        mask = np.asarray(det_mask) != 0
+    if mask is None or not mask.any():
+        return None
+    return mask
+
+def csr_key(integrator,shape,npt,unit='2th_deg',radial_range=None,mask=None):
+    """Return a hex digest identifying a CSR matrix.
+
+    The key covers the PONI geometry and detector of `integrator`,
+    the image `shape`, the number of bins `npt`, the `unit` and `radial_range`,
+    and a hash of `mask`.
+    """
+    det = integrator.detector
+    key = [integrator.dist,integrator.poni1,integrator.poni2,
+        integrator.rot1,integrator.rot2,integrator.rot3,integrator.wavelength,
+        det.name,det.pixel1,det.pixel2,
+        [int(s) for s in shape],int(npt),str(units.to_unit(unit)),
+        None if radial_range is None else [float(r) for r in radial_range],
+        mask_hash(mask),'bbox']
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+def build_csr(integrator,shape,npt,unit='2th_deg',radial_range=None,mask=None):
+    """Build the CSR matrix of `integrator` with pyFAI.
+
+    Uses bounding-box pixel splitting, like integrate1d() does by default.
+    Returns a dict of the CSR arrays 'data', 'indices' and 'indptr',
+    and the 'radial' bin centers in `unit`.
+    """
+    unit = units.to_unit(unit)
+    if hasattr(integrator,'setup_sparse_integrator'):
+        # newer pyFAI: pos0_range is given in `unit`
+        engine = integrator.setup_sparse_integrator(shape,npt,mask=mask,
+            pos0_range=radial_range,unit=unit,split='bbox',algo='CSR')
+    else:
+        # older pyFAI: pos0_range is given in the internal unit
+        pos0_range = None
+        if radial_range is not None:
+            pos0_range = (radial_range[0]/unit.scale,radial_range[1]/unit.scale)
+        engine = integrator.setup_CSR(shape,npt,mask=mask,
+            pos0_range=pos0_range,unit=unit,split='bbox')
+    return dict(
+        data=np.asarray(engine.data),
+        indices=np.asarray(engine.indices),
+        indptr=np.asarray(engine.indptr),
+        radial=np.asarray(engine.bin_centers)*unit.scale)
+
+class CSRCache(object):
+    """Persistent on-disk cache of pyFAI CSR integration matrices.
+
+    Each entry is a directory named by csr_key(),
+    holding one .npy file for each of the arrays returned by build_csr().
+    Entries are written to a temporary directory and renamed into place,
+    so several processes can share one cache directory.
+    When the cache grows beyond `max_bytes`,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self,cache_dir=None,max_bytes=2*1024**3):
+        if cache_dir is None:
+            cache_dir = csr_cache_dir
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get(self,integrator,shape,npt,unit='2th_deg',radial_range=None,mask=None):
+        """Return the CSR matrix and radial bin centers for an integration.
+
+        The matrix is a scipy.sparse.csr_matrix of shape (npt, n_pixels),
+        built on memory-mapped arrays:
+        multiplying it with a flattened image gives the binned signal.
+        It is loaded from the cache if present, else built and stored.
+        """
+        key = csr_key(integrator,shape,npt,unit,radial_range,mask)
+        entry = os.path.join(self.cache_dir,key)
+        arrays = None
+        if os.path.isdir(entry):
+            arrays = self._load(entry)
+        if arrays is None:
+            self._store(entry,build_csr(integrator,shape,npt,unit,radial_range,mask))
+            self._evict(keep=entry)
+            arrays = self._load(entry)
+        mat = sparse.csr_matrix((arrays['data'],arrays['indices'],arrays['indptr']),
+            shape=(int(npt),int(np.prod(shape))),copy=False)
+        return mat, arrays['radial']
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        for nm in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir,nm),ignore_errors=True)
+
+    def _load(self,entry):
+        try:
+            # touch the entry to mark it as recently used
+            os.utime(entry,None)
+            return dict([(nm,np.load(os.path.join(entry,nm+'.npy'),mmap_mode='r'))
+                for nm in csr_arrays])
+        except (IOError,OSError):
+            # evicted by another process
+            return None
+
+    def _store(self,entry,arrays):
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir,prefix='.tmp_')
+        for nm in csr_arrays:
+            np.save(os.path.join(tmp_dir,nm+'.npy'),arrays[nm])
+        try:
+            os.rename(tmp_dir,entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+
+    def _evict(self,keep=None):
+        entries = []
+        total = 0
+        for nm in os.listdir(self.cache_dir):
+            pth = os.path.join(self.cache_dir,nm)
+            if nm.startswith('.tmp_') or not os.path.isdir(pth):
+                continue
+            nbytes = sum([os.path.getsize(os.path.join(pth,fn)) for fn in os.listdir(pth)])
+            entries.append((os.path.getmtime(pth),pth,nbytes))
+            total += nbytes
+        for mtime,pth,nbytes in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if pth == keep:
+                continue
+            shutil.rmtree(pth,ignore_errors=True)
+            total -= nbytes
+
+def get_csr(integrator,shape,npt,unit='2th_deg',radial_range=None,mask=None,csr_cache=None):
+    """Return the CSR matrix and radial bin centers for an integration.
+
+    Takes them from `csr_cache` (a CSRCache) if provided,
+    else builds them in memory with build_csr().
+    """
+    if csr_cache is not None:
+        return csr_cache.get(integrator,shape,npt,unit,radial_range,mask)
+    arrays = build_csr(integrator,shape,npt,unit,radial_range,mask)
+    mat = sparse.csr_matrix((arrays['data'],arrays['indices'],arrays['indptr']),
+        shape=(int(npt),int(np.prod(shape))),copy=False)
+    return mat, arrays['radial']
+
+def integrate_stack_1d(csr,frames,masks=None,normalization=None,corrections=None,chunk_size=32):
+    """Integrate a stack of frames that share one geometry.
+
+    Each chunk of frames is integrated as a single sparse-dense product
+    of the CSR matrix with the (n_pixels, n_frames) block of flattened frames.
+    Build `csr` without a mask: masks are applied here, as vectors.
+
+    Parameters
+    ----------
+    csr : scipy.sparse.csr_matrix
+        integration matrix of shape (npt, n_pixels), see get_csr()
+    frames : array or list of arrays
+        N frames, each with n_pixels pixels
+    masks : array or list of arrays
+        one mask shared by all frames, or one mask per frame;
+        nonzero pixels are masked out
+    normalization : array
+        N normalization values, each frame is divided by its value
+    corrections : array
+        per-pixel correction factors (e.g. solid angle times polarization),
+        shared by all frames
+
+    Returns
+    -------
+    result : dict
+        'raw': (N, npt) binned signal,
+        'pcount': (N, npt) binned pixel count,
+        'norm': raw / pcount,
+        and if `corrections` is provided,
+        'intensity': raw / binned corrections, as from pyFAI integrate1d()
+    """
+    n_frames = len(frames)
+    npt,npix = csr.shape
+    # one mask of npix pixels is shared, else there is one mask per frame
+    shared_mask = True
+    if masks is None:
+        valid = np.ones(npix)
+    elif np.size(masks) == npix:
+        valid = (np.ravel(masks) == 0).astype(float)
+    else:
+        shared_mask = False
+        valid = None
+    if corrections is not None:
+        corrections = np.ravel(corrections)
+    res = dict(raw=np.zeros((n_frames,npt)),pcount=np.zeros((n_frames,npt)))
+    if corrections is not None:
+        res['intensity'] = np.zeros((n_frames,npt))
+    if shared_mask:
+        res['pcount'][:] = csr.dot(valid)
+        if corrections is not None:
+            binned_corr = csr.dot(corrections*valid)
+    for i0 in range(0,n_frames,chunk_size):
+        i1 = min(i0+chunk_size,n_frames)
+        block = np.array([np.ravel(f) for f in frames[i0:i1]],dtype=float)
+        if normalization is not None:
+            block /= np.asarray(normalization[i0:i1],dtype=float)[:,None]
+        if shared_mask:
+            block *= valid
+        else:
+            block_valid = np.array([np.ravel(m) == 0 for m in masks[i0:i1]],dtype=float)
+            block *= block_valid
+            res['pcount'][i0:i1] = csr.dot(block_valid.T).T
+            if corrections is not None:
+                binned_corr = csr.dot((block_valid*corrections).T).T
+        res['raw'][i0:i1] = csr.dot(block.T).T
+        if corrections is not None:
+            res['intensity'][i0:i1] = pawstools.div0(res['raw'][i0:i1],binned_corr)
+    res['norm'] = pawstools.div0(res['raw'],res['pcount'])
+    return res
@@ -0,0 +1,257 @@
+"""
+Streaming statistics of pattern series.
+
+Time series and batches of 1d patterns are often too long to hold
+in memory at once. A RunningStats object consumes patterns one at a time,
+or in chunks, and keeps the per-point count, sum, mean, variance,
+min and max in memory proportional to the number of points per pattern.
+The mean and variance are updated with Welford's algorithm,
+and chunks are combined with the pairwise update of Chan et al.,
+which also merges RunningStats computed separately,
+e.g. by parallel workers on parts of a series.
+NaN values (e.g. from regridding) are skipped, point by point.
+
+A RollingWindow keeps the same kind of statistics over only the
+last few patterns of a series, e.g. to follow a live measurement,
+with a ring buffer and running sums.
+"""
+import numpy as np
+
+def check_x(x,x_new):
+    """Raise a ValueError if the points of a pattern, `x_new`, differ from `x`.
+
+    Either can be None if the points are not known.
+    """
+    if x is None or x_new is None:
+        return
+    if np.shape(x_new) != np.shape(x) or not np.allclose(x_new,x,equal_nan=True):
+        raise ValueError('statistics over x from {} to {} can not be combined '
+            'with patterns over other x, from {} to {}'.format(
+            np.min(x),np.max(x),np.min(x_new),np.max(x_new)))
+
+class RunningStats(object):
+    """Per-point running count, sum, mean, variance, min and max of a pattern series.
+
+    All attributes are arrays with the shape of one pattern.
+    They are None until the first pattern is added, unless `shape` is given.
+    `x` holds the points of the patterns, if known (e.g. set by ArrayYStats):
+    merge() refuses statistics over other points.
+    """
+
+    def __init__(self,shape=None):
+        self.shape = None
+        self.x = None
+        self.count = None
+        self.sum = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        if shape is not None:
+            self._init(shape)
+
+    def _init(self,shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape,dtype=np.int64)
+        self.sum = np.zeros(self.shape)
+        self.mean = np.zeros(self.shape)
+        # sum of squared deviations from the mean
+        self.m2 = np.zeros(self.shape)
+        # NaN until a point has data: fmin/fmax skip NaN
+        self.min = np.full(self.shape,np.nan)
+        self.max = np.full(self.shape,np.nan)
+
+    @property
+    def n_patterns(self):
+        """Number of patterns with data at the best-covered point"""
+        if self.count is None:
+            return 0
+        return int(np.max(self.count)) if self.count.size else 0
+
+    def update(self,pattern):
+        """Add one pattern. Returns this RunningStats, for chaining."""
+        pattern = np.asarray(pattern,dtype=float)
+        if self.shape is None:
+            self._init(pattern.shape)
+        self._check_shape(pattern.shape)
+        self._add(pattern)
+        return self
+
+    def update_chunk(self,patterns):
+        """Add a chunk of patterns, stacked along the first axis.
+
+        Returns this RunningStats, for chaining.
+        """
+        patterns = np.asarray(patterns,dtype=float)
+        if len(patterns) == 1:
+            return self.update(patterns[0])
+        if len(patterns) > 1:
+            self.merge(RunningStats.from_chunk(patterns))
+        return self
+
+    def _check_shape(self,shape):
+        if tuple(shape) != self.shape:
+            raise ValueError('statistics of shape {} can not be combined with shape {}'
+                .format(tuple(shape),self.shape))
+
+    def _add(self,x):
+        # Welford's update, skipping NaN
+        ok = ~np.isnan(x)
+        self.count += ok
+        delta = np.where(ok,x-self.mean,0.)
+        self.mean += delta/np.maximum(self.count,1)
+        self.m2 += np.where(ok,delta*(x-self.mean),0.)
+        self.sum += np.where(ok,x,0.)
+        self.min = np.fmin(self.min,x)
+        self.max = np.fmax(self.max,x)
+
+    @classmethod
+    def from_chunk(cls,data):
+        """Return the RunningStats of a chunk of patterns stacked along the first axis"""
+        data = np.asarray(data,dtype=float)
+        stats = cls(data.shape[1:])
+        ok = ~np.isnan(data)
+        stats.count = ok.sum(axis=0).astype(np.int64)
+        stats.sum = np.where(ok,data,0.).sum(axis=0)
+        stats.mean = stats.sum/np.maximum(stats.count,1)
+        stats.m2 = (np.where(ok,data-stats.mean,0.)**2).sum(axis=0)
+        stats.min = np.fmin.reduce(data,axis=0)
+        stats.max = np.fmax.reduce(data,axis=0)
+        return stats
+
+    def merge(self,other):
+        """Combine the statistics of `other` (another RunningStats) into this one.
+
+        Returns this RunningStats, for chaining.
+        """
+        if other.shape is None:
+            return self
+        if self.shape is None:
+            self._init(other.shape)
+        self._check_shape(other.shape)
+        other_x = getattr(other,'x',None)
+        check_x(self.x,other_x)
+        if self.x is None:
+            self.x = other_x
+        n_a = self.count.astype(float)
+        n_b = other.count.astype(float)
+        n = np.maximum(n_a+n_b,1.)
+        delta = other.mean-self.mean
+        self.mean = self.mean+delta*n_b/n
+        self.m2 = self.m2+other.m2+delta**2*n_a*n_b/n
+        self.count = self.count+other.count
+        self.sum = self.sum+other.sum
+        self.min = np.fmin(self.min,other.min)
+        self.max = np.fmax(self.max,other.max)
+        return self
+
+    def variance(self,ddof=0):
+        """Return the per-point variance, NaN where count <= `ddof`"""
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.where(self.count > ddof,self.m2/(self.count-ddof),np.nan)
+
+    def std(self,ddof=0):
+        """Return the per-point standard deviation, NaN where count <= `ddof`"""
+        return np.sqrt(self.variance(ddof))
+
+    def mean_or_nan(self):
+        """Return the per-point mean, NaN where there is no data"""
+        return np.where(self.count > 0,self.mean,np.nan)
+
+class RollingWindow(object):
+    """Per-point sum, mean and variance over the last `size` patterns of a series.
+
+    The last `size` patterns are kept in a ring buffer.
+    Each update adds the new pattern to running sums
+    and subtracts the pattern it pushes out of the window,
+    at a cost proportional to the number of points.
+    To keep rounding errors from accumulating,
+    the sums are recomputed from the buffer every `recompute_every` updates
+    (default: every `size` updates).
+    `x` holds the points of the patterns, if known (e.g. set by RollingYMean).
+    """
+
+    def __init__(self,size,shape=None,recompute_every=None):
+        if size < 1:
+            raise ValueError('window size must be at least 1, got {}'.format(size))
+        self.size = int(size)
+        self.recompute_every = recompute_every or self.size
+        self.shape = None
+        self.x = None
+        self.buffer = None
+        # index of the next buffer row to write, number of rows filled
+        self.pos = 0
+        self.n_filled = 0
+        self.n_since_recompute = 0
+        self.count = None
+        self.sum = None
+        self.sumsq = None
+        if shape is not None:
+            self._init(shape)
+
+    def _init(self,shape):
+        self.shape = tuple(shape)
+        self.buffer = np.full((self.size,)+self.shape,np.nan)
+        self.count = np.zeros(self.shape,dtype=np.int64)
+        self.sum = np.zeros(self.shape)
+        self.sumsq = np.zeros(self.shape)
+
+    def update(self,pattern):
+        """Push one pattern into the window. Returns this RollingWindow, for chaining."""
+        pattern = np.asarray(pattern,dtype=float)
+        if self.shape is None:
+            self._init(pattern.shape)
+        if pattern.shape != self.shape:
+            raise ValueError('patterns of shape {} can not be added to a window of shape {}'
+                .format(pattern.shape,self.shape))
+        if self.n_filled == self.size:
+            old = self.buffer[self.pos]
+            ok = ~np.isnan(old)
+            self.count -= ok
+            self.sum -= np.where(ok,old,0.)
+            self.sumsq -= np.where(ok,old**2,0.)
+        else:
+            self.n_filled += 1
+        ok = ~np.isnan(pattern)
+        self.count += ok
+        self.sum += np.where(ok,pattern,0.)
+        self.sumsq += np.where(ok,pattern**2,0.)
+        self.buffer[self.pos] = pattern
+        self.pos = (self.pos+1) % self.size
+        self.n_since_recompute += 1
+        if self.n_since_recompute >= self.recompute_every:
+            self.recompute()
+        return self
+
+    def recompute(self):
+        """Recompute the sums from the patterns in the buffer"""
+        if self.shape is None:
+            return
+        ok = ~np.isnan(self.buffer)
+        self.count = ok.sum(axis=0).astype(np.int64)
+        self.sum = np.where(ok,self.buffer,0.).sum(axis=0)
+        self.sumsq = (np.where(ok,self.buffer,0.)**2).sum(axis=0)
+        self.n_since_recompute = 0
+
+    def patterns(self):
+        """Return the patterns in the window, oldest first"""
+        if self.shape is None:
+            return np.zeros((0,))
+        if self.n_filled < self.size:
+            return self.buffer[:self.n_filled].copy()
+        return np.roll(self.buffer,-self.pos,axis=0)
+
+    def mean(self):
+        """Return the per-point mean over the window, NaN where there is no data"""
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.where(self.count > 0,self.sum/self.count,np.nan)
+
+    def variance(self,ddof=0):
+        """Return the per-point variance over the window, NaN where count <= `ddof`"""
+        with np.errstate(divide='ignore',invalid='ignore'):
+            m2 = np.maximum(self.sumsq-self.sum**2/self.count,0.)
+            return np.where(self.count > ddof,m2/(self.count-ddof),np.nan)
+
+    def std(self,ddof=0):
+        """Return the per-point standard deviation over the window, NaN where count <= `ddof`"""
+        return np.sqrt(self.variance(ddof))
@@ -4,10 +4,10 @@ import copy
 import os
 
 import yaml
-import fabio
 
 from ...Workflow import Workflow
 from ....pawstools import primitives
+from .... import iotools
 
 inputs = OrderedDict(
     flow_reactor=None, 
@@ -75,7 +75,7 @@ class RunRecipeTakeImages(Workflow):
                 mar_path = self.inputs['ssh_data_dir']+'/'+img_fn
                 local_path = os.path.join(self.inputs['image_output_dir'],img_fn)
                 self.inputs['ssh_client'].copy_file(mar_path,local_path)
-                img = fabio.open(local_path).data
+                img = iotools.load_image(local_path)
                 self.outputs['images'].append(img)
                 self.outputs['image_paths'].append(local_path)
 
@@ -1,13 +1,14 @@
 from collections import OrderedDict
 import time
 import copy
+import itertools
 import os
 
 import numpy as np
-import fabio
 
 from ..Workflow import Workflow
 from ...pawstools import primitives
+from ... import iotools
 
 inputs = OrderedDict(
     integrator=None, 
@@ -15,7 +16,10 @@ inputs = OrderedDict(
     image_paths=[],
     n_points=1000,
     polz_factor=1.,
-    output_dir=None
+    output_dir=None,
+    write_npy=True,
+    output_file=None,
+    chunk_size=64
     )
 
 outputs = OrderedDict(
@@ -29,20 +33,51 @@ class IntegrateBatch(Workflow):
         super(IntegrateBatch,self).__init__(inputs,outputs)
 
     def run(self):
-        if self.inputs['images']:
-            imgs = self.inputs['images']
+        if self.inputs['output_file']:
+            # patterns are appended to one hdf5 file by a background thread,
+            # which is closed even if integration or saving fails part way
+            with iotools.PatternWriter(self.inputs['output_file']) as writer:
+                self.integrate_chunks(writer)
         else:
-            imgs = [fabio.open(imgp).data for imgp in self.inputs['image_paths']]
-        for img,imgp in zip(imgs,self.inputs['image_paths']):
-            q,I = self.inputs['integrator'].integrate_to_1d(img,
+            self.integrate_chunks(None)
+        return self.outputs
+
+    def integrate_chunks(self,writer):
+        # images are loaded, integrated and saved chunk_size at a time,
+        # so only one chunk of images (and their open memory maps) is held at once
+        image_paths = self.inputs['image_paths']
+        chunk_size = max(int(self.inputs['chunk_size']),1)
+        imgs = iter(self.inputs['images']) if self.inputs['images'] else None
+        for start in range(0,len(image_paths),chunk_size):
+            chunk_paths = image_paths[start:start+chunk_size]
+            if imgs is not None:
+                chunk_imgs = list(itertools.islice(imgs,len(chunk_paths)))
+            else:
+                chunk_imgs = [iotools.image_cache.get(imgp) for imgp in chunk_paths]
+            self.save_results(self.integrate(chunk_imgs),chunk_paths,writer)
+
+    def integrate(self,imgs):
+        integrator = self.inputs['integrator']
+        if len(set([np.shape(img) for img in imgs])) == 1 \
+        and hasattr(integrator,'integrate_stack_to_1d'):
+            # images of one shape: integrate them all in one matrix product
+            q,I_stack = integrator.integrate_stack_to_1d(imgs,
                 npt=self.inputs['n_points'],
                 polz_factor=self.inputs['polz_factor'])
+            return [(q,I) for I in I_stack]
+        return [integrator.integrate_to_1d(img,
+            npt=self.inputs['n_points'],
+            polz_factor=self.inputs['polz_factor']) for img in imgs]
+
+    def save_results(self,results,image_paths,writer):
+        for (q,I),imgp in zip(results,image_paths):
             q_I = np.array([q,I]).T
             self.outputs['data'].append(q_I)
+            if writer:
+                writer.put(os.path.splitext(os.path.split(imgp)[1])[0],q_I)
             if self.inputs['output_dir']:
                 dat_fn = os.path.splitext(os.path.split(imgp)[1])[0]+'.dat'
                 dat_path = os.path.join(self.inputs['output_dir'],dat_fn)
-                np.savetxt(dat_path,q_I,delimiter=' ',header='q (1/Angstrom), I (arb)')
+                iotools.save_dat(dat_path,q_I,header='q (1/Angstrom), I (arb)',
+                    write_npy=self.inputs['write_npy'])
                 self.outputs['data_paths'].append(dat_path)
-        return self.outputs
-
@@ -7,6 +7,7 @@ import numpy as np
 
 from ..Workflow import Workflow
 from ...pawstools import primitives
+from ... import iotools
 from ...operations.ZINGERS.EasyZingers1d import EasyZingers1d
 
 inputs = OrderedDict(
@@ -14,7 +15,9 @@ inputs = OrderedDict(
     q_I_paths=[],
     sharpness_limit=40.,
     window_width=10,
-    output_dir=None
+    output_dir=None,
+    write_npy=True,
+    output_file=None
     )
 
 outputs = OrderedDict(
@@ -32,17 +35,34 @@ class DezingerBatch(Workflow):
         if self.inputs['q_I_arrays']:
             q_I_arrs = self.inputs['q_I_arrays']
         else:
-            q_I_arrs = [np.loadtxt(datp) for datp in self.inputs['q_I_paths']]
-        for q_I,q_I_path in zip(q_I_arrs,self.inputs['q_I_paths']):
-            dz_out = dz.run_with(q_I=q_I,
+            q_I_arrs = [iotools.load_dat(datp) for datp in self.inputs['q_I_paths']]
+        if len(set([np.shape(q_I) for q_I in q_I_arrs])) == 1:
+            # all patterns share one shape: dezinger them as one stack
+            dz_out = dz.run_with(q_I=np.array(q_I_arrs),
                 sharpness_limit=self.inputs['sharpness_limit'],
                 window_width=self.inputs['window_width'])
-            q_I_dz = dz_out['q_I_dz'] 
+            q_I_dz_arrs = list(dz_out['q_I_dz'])
+        else:
+            q_I_dz_arrs = [dz.run_with(q_I=q_I,
+                sharpness_limit=self.inputs['sharpness_limit'],
+                window_width=self.inputs['window_width'])['q_I_dz'] for q_I in q_I_arrs]
+        if self.inputs['output_file']:
+            # patterns are appended to one hdf5 file by a background thread,
+            # which is closed even if saving fails part way
+            with iotools.PatternWriter(self.inputs['output_file']) as writer:
+                self.save_results(q_I_dz_arrs,writer)
+        else:
+            self.save_results(q_I_dz_arrs,None)
+        return self.outputs
+
+    def save_results(self,q_I_dz_arrs,writer):
+        for q_I_dz,q_I_path in zip(q_I_dz_arrs,self.inputs['q_I_paths']):
             self.outputs['data'].append(q_I_dz)
+            if writer:
+                writer.put(os.path.splitext(os.path.split(q_I_path)[1])[0]+'_dz',q_I_dz)
             if self.inputs['output_dir']:
                 dz_fn = os.path.splitext(os.path.split(q_I_path)[1])[0]+'_dz.dat'
                 dz_path = os.path.join(self.inputs['output_dir'],dz_fn)
-                np.savetxt(dz_path,q_I_dz,delimiter=' ',header='q (1/Angstrom), I (arb)')
+                iotools.save_dat(dz_path,q_I_dz,header='q (1/Angstrom), I (arb)',
+                    write_npy=self.inputs['write_npy'])
                 self.outputs['data_paths'].append(dz_path)
-        return self.outputs
-
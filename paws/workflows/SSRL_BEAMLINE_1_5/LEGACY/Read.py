@@ -11,11 +11,15 @@ from ....operations.SSRL_BEAMLINE_1_5.ReadSpecHeader import ReadSpecHeader
 class Read(Read2.Read):
 
     def __init__(self):
-        super(Read,self).__init__(inputs,outputs)
+        super(Read,self).__init__()
         self.reader = ReadSpecHeader()
 
     # override the header reader
     def read_header(self,filepath):
-        read_outputs = self.reader.run_with(file_path=self.inputs['header_file'])
+        read_outputs = self.reader.run_with(file_path=filepath)
         return read_outputs['data'] 
 
+    # SPEC headers are small: read the whole header for its time stamp
+    def read_time(self,filepath):
+        return self.read_header(filepath)['time']
+
@@ -3,11 +3,11 @@ import copy
 import os
 
 from xrsdkit.tools import ymltools as xrsdyml
-import fabio
 import yaml
 import numpy as np
 
 from ..Workflow import Workflow 
+from ... import iotools
 
 # NOTE: this workflow is for reading samples
 # that were saved with YAML headers
@@ -29,6 +29,15 @@ outputs = OrderedDict(
     )
 
 class Read(Workflow):
+    """Read the header, image, q_I and xrsd system files of one sample.
+
+    image_data is a numpy array of the image pixels, not a fabio image:
+    uncompressed images are memory-mapped read-only (see iotools.load_image),
+    other formats are decoded by fabio.
+    q_I and dI are read through iotools.load_dat.
+    run_with() returns a deep copy of the outputs, which loads memory-mapped arrays
+    into memory: call run() to keep them mapped, as ReadBatch does.
+    """
 
     def __init__(self):
         super(Read,self).__init__(inputs,outputs)
@@ -36,6 +45,25 @@ class Read(Workflow):
     def read_header(self,filepath):
         return yaml.load(open(filepath,'r'))
 
+    def read_time(self,filepath):
+        """Read only the time stamp from a header file.
+
+        Scans the header for its top-level `time` entry,
+        falling back on reading the whole header.
+        Returns None if the header has no time stamp.
+        """
+        with open(filepath,'r') as f:
+            for line in f:
+                if line.startswith('time:'):
+                    t = yaml.safe_load(line)['time']
+                    if isinstance(t,(int,float)):
+                        return t
+                    break
+        hdata = self.read_header(filepath)
+        if isinstance(hdata,dict):
+            return hdata.get('time')
+        return None
+
     def run(self):
         self.outputs = copy.deepcopy(outputs)
 
@@ -47,16 +75,16 @@ class Read(Workflow):
             self.message_callback('header file not found: {}'.format(self.inputs['header_file']))
 
         if (self.inputs['image_file']) and (os.path.exists(self.inputs['image_file'])):
-            self.outputs['image_data'] = fabio.open(self.inputs['image_file'])
+            self.outputs['image_data'] = iotools.load_image(self.inputs['image_file'])
         elif self.inputs['image_file']:
             self.message_callback('image file not found: {}'.format(self.inputs['image_file']))
 
         if (self.inputs['q_I_file']) and (os.path.exists(self.inputs['q_I_file'])):
-            q_I = np.loadtxt(self.inputs['q_I_file'],dtype='float') 
+            q_I = iotools.load_dat(self.inputs['q_I_file'])
             dI = None
             if (q_I is not None) and (q_I.shape[1] > 2):
-                q_I = q_I[:,:2]
                 dI = q_I[:,2]
+                q_I = q_I[:,:2]
             self.outputs['q_I'] = q_I
             self.outputs['dI'] = dI
         elif self.inputs['q_I_file']:
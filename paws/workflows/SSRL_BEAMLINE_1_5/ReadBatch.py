@@ -3,6 +3,8 @@ import os
 import copy
 
 from ..Workflow import Workflow 
+from ... import pawstools
+from ... import fileindex
 from . import Read
 from ...operations.FILESYSTEM.BuildFileList import BuildFileList
 
@@ -19,7 +21,14 @@ inputs = OrderedDict(
     q_I_ext = '.dat',
     system_dir = '',
     system_suffix = '',
-    system_ext = '.yml'
+    system_ext = '.yml',
+    n_workers = 1,
+    prefetch_depth = None,
+    use_index = False,
+    header_cursor = None,
+    columnar = False,
+    use_catalogue = False,
+    header_query = None
     )
 
 outputs = copy.deepcopy(Read.outputs)
@@ -29,10 +38,17 @@ outputs.update(
     header_files = [],
     image_files = [],
     q_I_files = [],
-    system_files = []
+    system_files = [],
+    header_cursor = None
     )
 
 class ReadBatch(Workflow):
+    """Read the samples of a directory of headers, one Read per sample.
+
+    Each output is a list with one entry per sample (see Read).
+    Images stay memory-mapped through run(),
+    but run_with() returns a deep copy, which loads them into memory.
+    """
 
     def __init__(self):
         super(ReadBatch,self).__init__(inputs,outputs)
@@ -42,17 +58,43 @@ class ReadBatch(Workflow):
     def run(self):
         # initialize outputs in case of Workflow re-use!
         self.outputs = copy.deepcopy(outputs)
+        file_lists = self.build_file_lists()
+        self.outputs.update(file_lists)
+        self.read_samples(file_lists)
+        return self.outputs
+
+    def build_file_lists(self):
+        """List the header files and derive the other file paths from them.
+
+        Returns the header_cursor and the lists of filenames,
+        header_files, image_files, q_I_files and system_files,
+        without reading any of the files.
+        """
+        file_lists = OrderedDict()
         self.list_header_files.run_with(
             dir_path = self.inputs['header_dir'],
-            regex = self.inputs['header_regex']
+            regex = self.inputs['header_regex'],
+            use_index = self.inputs['use_index'],
+            cursor = self.inputs['header_cursor']
             )
+        # with a header_cursor, only headers added or changed since
+        # the run that returned it are read
+        file_lists['header_cursor'] = self.list_header_files.outputs['cursor']
         header_file_list = self.list_header_files.outputs['file_list']
-        self.outputs['header_files'] = header_file_list
+        if self.inputs['use_catalogue']:
+            # record new or changed headers in the header catalogue,
+            # and select headers by their catalogued contents
+            catalogue = fileindex.get_catalogue()
+            catalogue.ingest(header_file_list,self.reader.read_header,self.inputs['n_workers'])
+            if self.inputs['header_query']:
+                selected = set(catalogue.query(**self.inputs['header_query']))
+                header_file_list = [hf for hf in header_file_list if os.path.abspath(hf) in selected]
+        file_lists['header_files'] = header_file_list
         filename_list = [os.path.splitext(os.path.split(hf)[1])[0] for hf in header_file_list]
         hdr_fn_sfx = self.inputs['header_suffix']
         if hdr_fn_sfx: filename_list = [fn[:fn.rfind(hdr_fn_sfx)] for fn in filename_list]
 
-        self.outputs['filenames'] = filename_list 
+        file_lists['filenames'] = filename_list 
         q_I_dir = self.inputs['q_I_dir']
         q_I_suffix = self.inputs['q_I_suffix']
         q_I_ext = self.inputs['q_I_ext']
@@ -68,28 +110,55 @@ class ReadBatch(Workflow):
         image_file_list = [None for fn in filename_list]
         if img_dir and img_ext:
             image_file_list = [os.path.join(img_dir,fn+img_sfx+img_ext) for fn in filename_list]
-        self.outputs['image_files'] = image_file_list
+        file_lists['image_files'] = image_file_list
         q_I_file_list = [None for fn in filename_list]
         if q_I_dir and q_I_ext:
             q_I_file_list = [os.path.join(q_I_dir,fn+q_I_suffix+q_I_ext) for fn in filename_list]
-        self.outputs['q_I_files'] = q_I_file_list
+        file_lists['q_I_files'] = q_I_file_list
         system_file_list = [None for fn in filename_list]
         if sys_dir and sys_ext:
             system_file_list = [os.path.join(sys_dir,fn+sys_suffix+sys_ext) for fn in filename_list]
-        self.outputs['system_files'] = system_file_list
+        file_lists['system_files'] = system_file_list
+        return file_lists
 
-        n_hdrs = len(filename_list)
+    def read_samples(self,file_lists):
+        """Read the samples in `file_lists` (see build_file_lists) into the outputs."""
+        header_file_list = file_lists['header_files']
+        image_file_list = file_lists['image_files']
+        q_I_file_list = file_lists['q_I_files']
+        system_file_list = file_lists['system_files']
+        n_hdrs = len(header_file_list)
         self.message_callback('STARTING BATCH ({})'.format(n_hdrs))
-        for ihdr, hdr_fn, img_fn, q_I_fn, sys_fn in zip(range(n_hdrs),
-        header_file_list,image_file_list,q_I_file_list,system_file_list):
+        file_sets = zip(header_file_list,image_file_list,q_I_file_list,system_file_list)
+        if self.inputs['n_workers'] > 1:
+            # read upcoming samples in a thread pool, one reader clone per sample
+            all_outs = pawstools.prefetch(
+                lambda files: self.read_files(self.reader.build_clone(),*files),
+                file_sets,self.inputs['n_workers'],self.inputs['prefetch_depth'])
+        else:
+            all_outs = (self.read_files(self.reader,*files) for files in file_sets)
+        for ihdr, outs in enumerate(all_outs):
             self.message_callback('RUNNING {} / {}'.format(ihdr+1,n_hdrs))
-            outs = self.reader.run_with(
-                header_file = hdr_fn,
-                image_file = img_fn,
-                q_I_file = q_I_fn,
-                system_file = sys_fn
-                )        
             for out_key, out_data in outs.items():
                 self.outputs[out_key].append(out_data)
-        return self.outputs
+        if self.inputs['columnar']:
+            # q_I and dI stacked into arrays, time as an array,
+            # header_data as a table with one column per header field
+            for out_key in ['q_I','dI','time']:
+                self.outputs[out_key] = pawstools.stack_column(self.outputs[out_key])
+            self.outputs['header_data'] = pawstools.table_column(self.outputs['header_data'])
 
+    @staticmethod
+    def read_files(reader,hdr_fn,img_fn,q_I_fn,sys_fn):
+        # not reader.run_with(): it returns a deep copy of the outputs,
+        # which would copy memory-mapped images and q_I arrays into memory.
+        # Read.run() builds new outputs on every call,
+        # so the outputs of one sample are not changed by reading the next.
+        reader.inputs = copy.deepcopy(reader.default_inputs)
+        reader.inputs.update(
+            header_file = hdr_fn,
+            image_file = img_fn,
+            q_I_file = q_I_fn,
+            system_file = sys_fn
+            )
+        return reader.run()
@@ -1,8 +1,11 @@
 import copy
+import os
 from collections import OrderedDict
 
 from . import ReadBatch
 from ..Workflow import Workflow 
+from ... import pawstools
+from ... import fileindex
 from ...operations.SORTING.SortBatch import SortBatch
 
 inputs = copy.deepcopy(ReadBatch.inputs)
@@ -15,24 +18,80 @@ inputs.update(
 outputs = copy.deepcopy(ReadBatch.outputs)
 
 class ReadTimeSeries(Workflow):
+    """Read a time series of samples, sorted by time and sliced.
+
+    Reading happens in two phases.
+    First only the time stamps are read from the headers,
+    and the samples are sorted by time and sliced
+    by lower_index, upper_index and index_step.
+    Then headers, images, q_I and systems are read
+    only for the samples that survive the slice.
+    Time stamps are cached by header path, size and mtime,
+    so repeated runs only read the time stamps of new or changed headers.
+    With use_catalogue, time stamps are taken from the header catalogue,
+    which keeps them across runs and processes;
+    headers without a catalogued time stamp are read directly.
+    A ValueError naming the header file is raised
+    if any header has no time stamp to sort by.
+    """
 
     def __init__(self):
         super(ReadTimeSeries,self).__init__(inputs,outputs)
         self.batch_reader = ReadBatch.ReadBatch()
         self.sorter = SortBatch()
+        self.header_times = {}
 
     def run(self):
         read_inputs = OrderedDict([(k,self.inputs[k]) for k in ReadBatch.inputs.keys()])
-        batch_outputs = self.batch_reader.run_with(**read_inputs) 
+        self.batch_reader.inputs.update(read_inputs)
+        file_lists = self.batch_reader.build_file_lists()
         self.sorter.run_with(
-            batch_outputs=batch_outputs,
-            x_values=batch_outputs['time'],
+            batch_outputs=file_lists,
+            x_values=self.read_times(file_lists['header_files']),
             x_sort_flag=True,
             x_shift_flag=True,
             lower_index=self.inputs['lower_index'],
             upper_index=self.inputs['upper_index'],
             index_step=self.inputs['index_step']
             )
-        self.outputs.update(self.sorter.outputs['sorted_outputs'])
+        sorted_lists = self.sorter.outputs['sorted_outputs']
+        self.batch_reader.outputs = copy.deepcopy(ReadBatch.outputs)
+        self.batch_reader.outputs.update(sorted_lists)
+        self.batch_reader.read_samples(sorted_lists)
+        self.outputs.update(self.batch_reader.outputs)
         return self.outputs
 
+    def read_times(self,header_files):
+        if self.inputs['use_catalogue']:
+            # build_file_lists() has already ingested the headers
+            times = fileindex.get_catalogue().values(header_files,'time')
+            missing = [hf for hf,t in zip(header_files,times) if t is None]
+            missing_times = dict(zip(missing,self._read_new_times(missing)))
+            times = [missing_times[hf] if t is None else t for hf,t in zip(header_files,times)]
+        else:
+            times = self._read_cached_times(header_files)
+        # the times are sort keys: fail here, naming the file, rather than in the sort
+        for hf,t in zip(header_files,times):
+            if t is None:
+                raise ValueError('no time stamp in header file {}'.format(hf))
+        return times
+
+    def _read_new_times(self,header_files):
+        reader = self.batch_reader.reader
+        if self.inputs['n_workers'] > 1:
+            return pawstools.prefetch(
+                lambda hf: reader.build_clone().read_time(hf),
+                header_files,self.inputs['n_workers'],self.inputs['prefetch_depth'])
+        return (reader.read_time(hf) for hf in header_files)
+
+    def _read_cached_times(self,header_files):
+        keys = []
+        for hf in header_files:
+            st = os.stat(hf)
+            keys.append((hf,st.st_size,st.st_mtime_ns))
+        new_files = [k[0] for k in keys if not k in self.header_times]
+        times = dict(zip(new_files,self._read_new_times(new_files)))
+        for k in keys:
+            if k[0] in times:
+                self.header_times[k] = times[k[0]]
+        return [self.header_times[k] for k in keys]
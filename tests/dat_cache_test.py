@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+from paws import iotools
+
+
+def _data_files(data_dir):
+    return sorted(os.listdir(data_dir))
+
+
+def test_load_dat_sidecar_in_cache_dir(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(iotools, 'dat_cache_dir', cache_dir)
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    dat_path = str(data_dir / 'test.dat')
+    data = np.random.rand(20, 3)
+    np.savetxt(dat_path, data)
+    first = iotools.load_dat(dat_path)
+    second = iotools.load_dat(dat_path)
+    assert np.allclose(first, data) and np.array_equal(first, second)
+    assert isinstance(second, np.memmap)
+    # reading writes nothing next to the data
+    assert _data_files(str(data_dir)) == ['test.dat']
+    assert len(os.listdir(cache_dir)) == 1
+
+    # the loaded array is writable, and changing it leaves the sidecar alone
+    second[0, 0] = -1.
+    assert iotools.load_dat(dat_path)[0, 0] == first[0, 0]
+
+    # a rewritten file is parsed again
+    np.savetxt(dat_path, data[:5])
+    assert np.allclose(iotools.load_dat(dat_path), data[:5])
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_local_sidecar(tmp_path):
+    dat_path = str(tmp_path / 'test.dat')
+    data = np.random.rand(10, 2)
+    iotools.save_dat(dat_path, data, local_sidecar=True)
+    hidden = [fn for fn in _data_files(str(tmp_path)) if fn.startswith('.')]
+    assert len(hidden) == 1
+    loaded = iotools.load_dat(dat_path, local_sidecar=True)
+    assert isinstance(loaded, np.memmap)
+    assert np.allclose(loaded, data)
@@ -0,0 +1,146 @@
+import h5py
+import numpy as np
+import pytest
+from pyFAI.detectors import Detector
+
+from paws.containers import PONI
+from paws.plugins.ewald import EwaldSphere, EwaldArch, SphereQuery
+from paws.plugins.ewald.EwaldSphere import _stack_fields, _get_field
+
+# no MultiGeometry thread pool for spheres without arches
+MG_ARGS = {'wavelength': 1e-10, 'threadpoolsize': 0}
+
+
+def _make_arches(idxs, integrate=True):
+    det = Detector(100e-6, 100e-6, max_shape=(20, 30))
+    arches = []
+    for i in idxs:
+        poni = PONI(dist=0.2, poni1=0.001, poni2=0.0015, rot1=0.01*(i % 2),
+                    detector=det)
+        arch = EwaldArch(idx=i, map_raw=np.random.rand(20, 30), poni=poni,
+                         scan_info={'i0': float(i + 1)})
+        if integrate:
+            arch.integrate_1d(numpoints=50)
+        arches.append(arch)
+    return arches
+
+
+def _make_sphere(arches):
+    return EwaldSphere(name='s', arches=arches, mg_args=MG_ARGS)
+
+
+def _load(h5_path):
+    sphere = EwaldSphere(name='s', mg_args=MG_ARGS)
+    with h5py.File(h5_path, 'r') as f:
+        sphere.load_from_h5(f, set_mg=False)
+    return sphere
+
+
+def _assert_same_arches(arches_a, arches_b):
+    assert [a.idx for a in arches_a] == [b.idx for b in arches_b]
+    for a, b in zip(arches_a, arches_b):
+        assert a.scan_info == b.scan_info
+        assert a.poni.rot1 == b.poni.rot1
+        for path in _stack_fields:
+            val_a, val_b = _get_field(a, path), _get_field(b, path)
+            if val_a is None:
+                assert val_b is None, path
+            else:
+                assert np.shape(val_a) == np.shape(val_b), path
+                assert np.array_equal(val_a, val_b), path
+
+
+def test_stacked_round_trip(tmp_path):
+    arches = _make_arches(range(4))
+    # an arch that was never integrated keeps the scalar int_1d defaults,
+    # others have fields set to arrays or left None
+    arches += _make_arches([4], integrate=False)
+    arches[0].map_norm = np.ones((20, 30))
+    arches[1].tcr = np.arange(3.)
+    sphere = _make_sphere(arches)
+    for layout in ('groups', 'stacked'):
+        h5_path = str(tmp_path / (layout + '.h5'))
+        with h5py.File(h5_path, 'w') as f:
+            sphere.save_to_h5(f, layout=layout)
+        _assert_same_arches(arches, list(_load(h5_path).arches))
+    with h5py.File(str(tmp_path / 'stacked.h5'), 'r') as f:
+        assert f['s/stack/map_raw'].shape == (5, 20, 30)
+        assert f['s/stack/map_norm'].attrs['kind'] == 'mixed'
+        assert f['s/stack/xyz'].attrs['kind'] == 'none'
+
+
+def test_stacked_subset_merges(tmp_path):
+    arches = _make_arches(range(3))
+    sphere = _make_sphere(arches)
+    h5_path = str(tmp_path / 'stacked.h5')
+    with h5py.File(h5_path, 'w') as f:
+        sphere.save_to_h5(f, layout='stacked')
+    # replace one arch and add another, the rest of the stack is kept
+    new_arches = _make_arches([1, 5])
+    with h5py.File(h5_path, 'a') as f:
+        _make_sphere(new_arches).save_to_h5(f, arches=[1, 5],
+                                            layout='stacked')
+    expected = [arches[0], new_arches[0], arches[2], new_arches[1]]
+    _assert_same_arches(expected, list(_load(h5_path).arches))
+
+
+def test_stacked_saves_in_place(tmp_path, monkeypatch):
+    arches = _make_arches(range(3)) + _make_arches([3], integrate=False)
+    sphere = _make_sphere(arches)
+    h5_path = str(tmp_path / 'stacked.h5')
+    with h5py.File(h5_path, 'w') as f:
+        sphere.save_to_h5(f, arches=[2], layout='stacked')
+    # later saves, arch by arch and out of order, resize the stack in place
+    def no_rewrite(*args):
+        raise AssertionError('stack was rewritten')
+    monkeypatch.setattr(EwaldSphere, '_save_stack_field', no_rewrite)
+    for idx in (0, 3, 1, 2):
+        with h5py.File(h5_path, 'a') as f:
+            sphere.save_to_h5(f, arches=[idx], layout='stacked')
+    with h5py.File(h5_path, 'r') as f:
+        assert list(f['s/stack/index'][()]) == [2, 0, 3, 1]
+        assert f['s/stack/int_1d/norm'].attrs['kind'] == 'mixed'
+    _assert_same_arches(arches, list(_load(h5_path).arches))
+
+
+def test_stacked_errors(tmp_path):
+    arches = _make_arches(range(2))
+    arches[1].map_raw = np.zeros((10, 10))
+    sphere = _make_sphere(arches)
+    with h5py.File(str(tmp_path / 'bad.h5'), 'w') as f:
+        with pytest.raises(ValueError):
+            sphere.save_to_h5(f, layout='stacked')
+        assert 'stack' not in f['s']
+
+    sphere = _make_sphere(_make_arches(range(2)))
+    with h5py.File(str(tmp_path / 'groups.h5'), 'w') as f:
+        sphere.save_to_h5(f, layout='groups')
+        with pytest.raises(ValueError):
+            sphere.save_to_h5(f, layout='stacked')
+        sphere.save_to_h5(f, layout='stacked', replace=True)
+
+
+def test_sphere_query_errors(tmp_path):
+    paths = []
+    for name, numpoints in (('a', 50), ('b', 60)):
+        arches = _make_arches(range(2))
+        for arch in arches:
+            arch.integrate_1d(numpoints=numpoints)
+        paths.append(str(tmp_path / (name + '.h5')))
+        with h5py.File(paths[-1], 'w') as f:
+            _make_sphere(arches).save_to_h5(f, layout='stacked')
+    assert SphereQuery(paths[:1]).int_1d()['norm'].shape == (2, 50)
+    with pytest.raises(ValueError, match='regrid'):
+        SphereQuery(paths).int_1d()
+    with pytest.raises(KeyError):
+        SphereQuery(paths[:1]).int_1d(key='nope')
+
+    arches = _make_arches(range(2)) + _make_arches([2], integrate=False)
+    for layout in ('groups', 'stacked'):
+        h5_path = str(tmp_path / ('raw_' + layout + '.h5'))
+        with h5py.File(h5_path, 'w') as f:
+            _make_sphere(arches).save_to_h5(f, layout=layout)
+        query = SphereQuery([h5_path])
+        assert query.int_1d(arch_range=(0, 2))['norm'].shape == (2, 50)
+        with pytest.raises(ValueError, match='integrated'):
+            query.int_1d()
@@ -0,0 +1,54 @@
+import pytest
+
+from paws import fileindex
+from paws.workflows.SSRL_BEAMLINE_1_5.Read import Read
+from paws.workflows.SSRL_BEAMLINE_1_5.ReadTimeSeries import ReadTimeSeries
+
+
+def _write_headers(tmp_path, texts):
+    paths = []
+    for i, text in enumerate(texts):
+        paths.append(str(tmp_path / 'h{}.yml'.format(i)))
+        with open(paths[-1], 'w') as f:
+            f.write(text)
+    return paths
+
+
+@pytest.fixture
+def catalogue_path(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'catalogue.db')
+    monkeypatch.setattr(fileindex, 'catalogue_path', db_path)
+    monkeypatch.setattr(fileindex, '_catalogues', {})
+    return db_path
+
+
+def test_ingest_bad_headers(tmp_path, catalogue_path):
+    paths = _write_headers(tmp_path, ['time: 2.0\n', '', 'time: [1\n'])
+    catalogue = fileindex.get_catalogue()
+    assert catalogue.ingest(paths, Read().read_header) == paths
+    assert catalogue.values(paths, 'time') == [2.0, None, None]
+    assert catalogue.headers(paths) == [{'time': 2.0}, None, None]
+    # unreadable headers are not parsed again until they change
+    assert catalogue.ingest(paths, Read().read_header) == []
+
+
+def test_time_series_catalogue_times(tmp_path, catalogue_path):
+    # the last header does not parse, its time stamp is read directly
+    paths = _write_headers(tmp_path, ['time: 2.0\n', 'time: 1.0\n',
+                                      'time: 3\nsample_id: [a\n'])
+    wf = ReadTimeSeries()
+    wf.inputs.update(use_catalogue=True)
+    fileindex.get_catalogue().ingest(paths, Read().read_header)
+    assert wf.read_times(paths) == [2.0, 1.0, 3]
+    paths = _write_headers(tmp_path, ['time: 2.0\n', 'sample_id: a\n'])
+    fileindex.get_catalogue().ingest(paths, Read().read_header)
+    with pytest.raises(ValueError, match='h1.yml'):
+        wf.read_times(paths)
+
+
+def test_time_series_missing_time(tmp_path):
+    _write_headers(tmp_path, ['time: 2.0\n', 'sample_id: a\n'])
+    wf = ReadTimeSeries()
+    wf.inputs.update(header_dir=str(tmp_path))
+    with pytest.raises(ValueError, match='h1.yml'):
+        wf.run()
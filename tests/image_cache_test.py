@@ -0,0 +1,69 @@
+import gc
+import os
+import shutil
+
+import numpy as np
+
+from paws import iotools
+from paws.workflows.IMAGE_INTEGRATION.IntegrateBatch import IntegrateBatch
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__),
+    'test_data', 'images', 'test1.tif')
+
+
+def _copy_images(tmp_path, n_images):
+    paths = []
+    for i in range(n_images):
+        paths.append(str(tmp_path / 'img{}.tif'.format(i)))
+        shutil.copy(TEST_IMAGE, paths[-1])
+    return paths
+
+
+def _n_open_fds():
+    gc.collect()
+    return len(os.listdir('/proc/self/fd'))
+
+
+def test_image_cache_caps_memory_maps(tmp_path):
+    paths = _copy_images(tmp_path, 40)
+    n_fds = _n_open_fds()
+    cache = iotools.ImageCache(max_mmaps=8)
+    for p in paths:
+        img = cache.get(p)
+        assert isinstance(img, np.memmap)
+    del img
+    assert cache.n_mmaps == 8
+    assert len(cache.images) == 8
+    assert _n_open_fds() - n_fds <= 8
+    # the most recently used images are kept
+    assert cache.get(paths[-1]) is cache.get(paths[-1])
+    cache.clear()
+    assert _n_open_fds() <= n_fds
+
+
+class _SumIntegrator(object):
+    """Stands in for a PyFAIIntegrator: 'integrates' rows by summing"""
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def integrate_to_1d(self, img, npt=1000, polz_factor=0.):
+        self.n_calls += 1
+        return np.arange(img.shape[0]), np.asarray(img).sum(axis=1)
+
+
+def test_integrate_batch_chunks(tmp_path):
+    paths = _copy_images(tmp_path, 10)
+    integrator = _SumIntegrator()
+    wf = IntegrateBatch()
+    wf.inputs['integrator'] = integrator
+    wf.inputs['image_paths'] = paths
+    wf.inputs['chunk_size'] = 3
+    wf.inputs['output_file'] = str(tmp_path / 'patterns.h5')
+    wf.run()
+    expected = np.array(iotools.load_image(TEST_IMAGE)).sum(axis=1)
+    assert integrator.n_calls == 10
+    assert len(wf.outputs['data']) == 10
+    assert np.array_equal(wf.outputs['data'][9][:, 1], expected)
+    names, data = iotools.load_patterns(str(tmp_path / 'patterns.h5'))
+    assert names == ['img{}'.format(i) for i in range(10)]
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from paws import iotools
+
+
+def test_pattern_writer_round_trip(tmp_path):
+    h5_path = str(tmp_path / 'patterns.h5')
+    patterns = [np.random.rand(50, 2) for i in range(10)]
+    with iotools.PatternWriter(h5_path, batch_size=3) as writer:
+        for i, p in enumerate(patterns):
+            writer.put('p{}'.format(i), p)
+    # a second writer appends to the same group
+    with iotools.PatternWriter(h5_path) as writer:
+        writer.put('extra', patterns[0])
+    names, data = iotools.load_patterns(h5_path)
+    assert names == ['p{}'.format(i) for i in range(10)] + ['extra']
+    assert np.array_equal(data[:10], np.array(patterns))
+    assert np.array_equal(data[10], patterns[0])
+
+    dat_paths = iotools.export_dat(h5_path, str(tmp_path), suffix='_x')
+    assert os.path.basename(dat_paths[0]) == 'p0_x.dat'
+    assert np.allclose(np.loadtxt(dat_paths[3]), patterns[3])
+
+
+def test_pattern_writer_shape_mismatch(tmp_path):
+    writer = iotools.PatternWriter(str(tmp_path / 'patterns.h5'))
+    writer.put('a', np.zeros((10, 2)))
+    writer.put('b', np.zeros((11, 2)))
+    with pytest.raises(ValueError):
+        writer.flush()
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def _call_with_timeout(func, timeout=10.):
+    """Call func in a thread, return the exception it raised"""
+    result = {}
+    def target():
+        try:
+            func()
+        except Exception as ex:
+            result['error'] = ex
+    th = threading.Thread(target=target, daemon=True)
+    th.start()
+    th.join(timeout)
+    assert not th.is_alive(), 'call did not return'
+    return result.get('error')
+
+
+def test_pattern_writer_open_failure(tmp_path):
+    bad_path = str(tmp_path / 'missing_dir' / 'patterns.h5')
+    writer = iotools.PatternWriter(bad_path, max_queued=4)
+    # more patterns than the queue holds: put() must not block either
+    err = _call_with_timeout(
+        lambda: [writer.put('p{}'.format(i), np.zeros(5)) for i in range(20)])
+    if err is None:
+        err = _call_with_timeout(writer.flush)
+    assert isinstance(err, OSError)
+    assert isinstance(_call_with_timeout(writer.close), OSError)
+
+
+def test_pattern_writer_closed_on_error(tmp_path):
+    h5_path = str(tmp_path / 'patterns.h5')
+    with pytest.raises(RuntimeError):
+        with iotools.PatternWriter(h5_path) as writer:
+            writer.put('a', np.zeros((10, 2)))
+            raise RuntimeError('failure mid-batch')
+    assert not writer.thread.is_alive()
+    names, data = iotools.load_patterns(h5_path)
+    assert names == ['a']
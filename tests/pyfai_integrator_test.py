@@ -0,0 +1,142 @@
+import os
+import threading
+
+import numpy as np
+import pyFAI.azimuthalIntegrator as pfaz
+
+from paws import pyfaitools
+from paws.plugins.PyFAIIntegrator import PyFAIIntegrator
+
+NIKA_FILE = os.path.join(os.path.dirname(__file__),
+    'test_data', 'calib', 'test.nika')
+
+PONI_TEXT = '''poni_version: 2
+Detector: Detector
+Detector_config: {"pixel1": 0.001, "pixel2": 0.001, "max_shape": [10, 10]}
+Distance: 0.2
+Poni1: 0.005
+Poni2: 0.005
+Rot1: 0
+Rot2: 0
+Rot3: 0
+Wavelength: 8e-11
+'''
+
+# a detector with gaps between modules, masked by the detector itself
+PILATUS_PONI_TEXT = '''poni_version: 2
+Detector: Pilatus300k
+Detector_config: {}
+Distance: 0.3
+Poni1: 0.03
+Poni2: 0.04
+Rot1: 0
+Rot2: 0
+Rot3: 0
+Wavelength: 1e-10
+'''
+
+
+def _write_poni(tmp_path, text=PONI_TEXT):
+    poni_file = str(tmp_path / 'test.poni')
+    with open(poni_file, 'w') as f:
+        f.write(text)
+    return poni_file
+
+
+def _drain(pool):
+    items = []
+    while not pool.empty():
+        items.append(pool.get())
+    return items
+
+
+def test_set_calib_rebuilds_pool(tmp_path):
+    integrator = PyFAIIntegrator(NIKA_FILE, n_integrators=2)
+    integrator.start()
+    old_pool = integrator.pool
+    # an integrator checked out by a running integration
+    busy = old_pool.get()
+    dist = busy.dist
+    integrator.calib_file = _write_poni(tmp_path)
+    integrator.set_calib()
+    assert busy.dist == dist
+    assert integrator.pool is not old_pool
+    new_ais = _drain(integrator.pool)
+    assert len(new_ais) == 2
+    assert all(ai.dist == 0.2 for ai in new_ais)
+    assert not any(ai is busy for ai in new_ais)
+    # the calibrated integrator is only cloned into the pool
+    assert not any(ai is integrator.integrator for ai in new_ais)
+
+
+def test_warm_up_does_not_wait_for_pool(tmp_path):
+    integrator = PyFAIIntegrator(_write_poni(tmp_path), n_integrators=2)
+    integrator.start()
+    # an integrator checked out by a running integration
+    busy = integrator.pool.get()
+    thread = threading.Thread(target=integrator.warm_up, args=((10, 10), 20),
+                              daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    warm_ais = _drain(integrator.pool)
+    assert len(warm_ais) == 2
+    assert not any(ai is busy or ai is integrator.integrator for ai in warm_ais)
+
+
+def test_csr_cache_round_trip(tmp_path, monkeypatch):
+    ai = pfaz.AzimuthalIntegrator()
+    ai.read(_write_poni(tmp_path))
+    cache_dir = str(tmp_path / 'csr_cache')
+    mat, q = pyfaitools.CSRCache(cache_dir).get(ai, (10, 10), 20, 'q_A^-1')
+    assert len(os.listdir(cache_dir)) == 1
+    # a new cache on the same directory loads the stored matrix
+    def no_build(*args):
+        raise AssertionError('matrix was built again')
+    with monkeypatch.context() as m:
+        m.setattr(pyfaitools, 'build_csr', no_build)
+        cache = pyfaitools.CSRCache(cache_dir)
+        mat_2, q_2 = cache.get(ai, (10, 10), 20, 'q_A^-1')
+    assert (mat != mat_2).nnz == 0
+    assert np.array_equal(q, q_2)
+    assert mat.shape == (20, 100)
+    # another binning is another entry, older entries are evicted past max_bytes
+    cache.get(ai, (10, 10), 30, 'q_A^-1')
+    assert len(os.listdir(cache_dir)) == 2
+    cache.max_bytes = 1
+    cache.get(ai, (10, 10), 40, 'q_A^-1')
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_integrate_with_csr_cache(tmp_path):
+    # a small unmasked detector, and a Pilatus with masked module gaps
+    for poni_text in (PONI_TEXT, PILATUS_PONI_TEXT):
+        poni_file = _write_poni(tmp_path, poni_text)
+        results = []
+        for csr_cache in (None, pyfaitools.CSRCache(str(tmp_path / 'csr'))):
+            integrator = PyFAIIntegrator(poni_file, q_min=0., q_max=4.,
+                                         csr_cache=csr_cache)
+            integrator.start()
+            shape = integrator.integrator.detector.shape
+            img = np.random.RandomState(0).rand(*shape)*100
+            results.append(integrator.integrate_to_1d(img, npt=20,
+                                                      unit='q_A^-1'))
+        (q, I), (q_csr, I_csr) = results
+        assert np.allclose(q, q_csr)
+        assert np.allclose(I, I_csr, atol=1e-4)
+
+
+def test_integrate_stack_masked_detector(tmp_path):
+    integrator = PyFAIIntegrator(_write_poni(tmp_path, PILATUS_PONI_TEXT),
+                                 q_min=0., q_max=4.)
+    integrator.start()
+    shape = integrator.integrator.detector.shape
+    assert integrator.integrator.detector.mask.any()
+    rng = np.random.RandomState(0)
+    imgs = [rng.rand(*shape)*100 for i in range(3)]
+    q_stack, I_stack = integrator.integrate_stack_to_1d(imgs, npt=200,
+                                                        unit='q_A^-1')
+    for img, I in zip(imgs, I_stack):
+        q, I_1d = integrator.integrate_to_1d(img, npt=200, unit='q_A^-1')
+        assert np.allclose(q, q_stack)
+        assert np.allclose(I, I_1d, atol=1e-4)
@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+
+from paws.workflows.SSRL_BEAMLINE_1_5.ReadBatch import ReadBatch
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def _read_batch(**kwargs):
+    wf = ReadBatch()
+    wf.inputs.update(header_dir=os.path.join(TEST_DATA, 'headers'),
+                     image_dir=os.path.join(TEST_DATA, 'images'), **kwargs)
+    return wf.run()
+
+
+def test_read_batch_keeps_images_mapped():
+    for n_workers in (1, 2):
+        outputs = _read_batch(n_workers=n_workers)
+        assert [os.path.basename(f) for f in outputs['image_files']] \
+            == ['test1.tif', 'test2.tif']
+        for img in outputs['image_data']:
+            assert isinstance(img, np.memmap)
+        assert outputs['image_data'][0] is not outputs['image_data'][1]
@@ -2,11 +2,16 @@ import paws
 from paws import operations
 from paws import workflows
 from paws import plugins
+from paws import pyfaitools
+from paws import fileindex
+from paws import iotools
+from paws import gridtools
+from paws import stattools
 
 from paws.operations import Operation, \
     ARRAYS, BACKGROUND, CALIBRATION, FILESYSTEM, SMOOTHING, \
     SORTING, SSRL_BEAMLINE_1_5, TESTS, ZINGERS
-from paws.operations.ARRAYS import ArrayYMean, NoiseArray
+from paws.operations.ARRAYS import ArrayYMean, ArrayYStats, NoiseArray, Regrid, RollingYMean
 from paws.operations.BACKGROUND import BgSubtract
 from paws.operations.CALIBRATION import ReadPONI, Fit2DToPONI, NikaToPONI, WXDToPONI 
 from paws.operations.FILESYSTEM import BuildFileList 
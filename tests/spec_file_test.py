@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+from paws.operations.SPEC.LoadSpecFile import LoadSpecFile
+
+HEADER = ['#F test.spec', '#E 1566000000', '#D Wed Aug 28 16:39:57 2019',
+          '#C test  User = me', '#O0 tth  th  chi  phi', '#J0 I0  I1  mon', '']
+
+
+def _scan_lines(num, n_points, seed):
+    rng = np.random.RandomState(seed)
+    lines = ['#S {}  ascan  th 0 10 {} 1'.format(num, n_points),
+             '#D Wed Aug 28 17:00:00 2019', '#T 1  (Seconds)',
+             '#P0 1.0 2.0 3.0 4.0', '#L th  I0  I1']
+    # fixed width rows: files written with other seeds have the same layout
+    for i in range(n_points):
+        lines.append('{:.4f} {} {:.4f}'.format(
+            i*0.1, rng.randint(100, 1000), rng.rand()))
+    return lines + ['']
+
+
+def _write_spec(path, n_scans, seed=0, n_points=20):
+    lines = list(HEADER)
+    for num in range(1, n_scans + 1):
+        lines += _scan_lines(num, n_points, seed + num)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _load(spec_dir, **kwargs):
+    op = LoadSpecFile()
+    return op.run_with(spec_file_path=str(spec_dir),
+                       spec_file_name='test.spec', **kwargs)
+
+
+def _assert_same_scans(out_a, out_b, scans):
+    assert out_a['header'] == out_b['header']
+    for num in scans:
+        assert out_a['scans'][num].equals(out_b['scans'][num])
+        assert out_a['scans_meta'][num] == out_b['scans_meta'][num]
+
+
+def test_indexed_and_cached_scans(tmp_path):
+    _write_spec(str(tmp_path / 'test.spec'), 5)
+    full = _load(tmp_path)
+    assert sorted(full['scans']) == [1, 2, 3, 4, 5]
+    for cache_scans in (False, True, True):
+        out = _load(tmp_path, scans=[4, 2], cache_scans=cache_scans)
+        assert sorted(out['scans']) == [2, 4]
+        _assert_same_scans(out, full, [2, 4])
+    assert os.path.exists(str(tmp_path / '.test.spec.scans.h5'))
+    with pytest.raises(KeyError):
+        _load(tmp_path, scans=99)
+
+
+def test_cached_scans_of_rewritten_file(tmp_path):
+    spec_path = str(tmp_path / 'test.spec')
+    _write_spec(spec_path, 3, seed=0)
+    _load(tmp_path, scans=[2], cache_scans=True)
+    # same layout and byte ranges, different data
+    _write_spec(spec_path, 3, seed=10)
+    full = _load(tmp_path)
+    out = _load(tmp_path, scans=[2], cache_scans=True)
+    _assert_same_scans(out, full, [2])
+
+
+@pytest.mark.parametrize('use_run_with', [False, True])
+def test_incremental_read(tmp_path, use_run_with):
+    spec_path = str(tmp_path / 'test.spec')
+    _write_spec(spec_path, 2)
+    with open(spec_path) as f:
+        text = f.read()
+    op = LoadSpecFile()
+    inputs = dict(spec_file_path=str(tmp_path), spec_file_name='test.spec',
+                  incremental=True)
+    # count the lines parsed, to check that each line is parsed once
+    n_parsed = []
+    read_spec = op._read_spec
+    def counting_read_spec(lines, start=0):
+        lines = list(lines)
+        n_parsed.append(len(lines))
+        return read_spec(lines, start)
+    op._read_spec = counting_read_spec
+
+    def run():
+        if use_run_with:
+            return op.run_with(**inputs)
+        op.inputs.update(inputs)
+        return op.run()
+    # the file is written in pieces, cutting lines and scans in two
+    for end in list(range(0, len(text), 97)) + [len(text)]:
+        with open(spec_path, 'w') as f:
+            f.write(text[:end])
+        outputs = run()
+    assert sum(n_parsed) == text.count('\n')
+    assert outputs['last_line_read']['offset'] == len(text)
+    full = _load(tmp_path)
+    _assert_same_scans(outputs, full, [1, 2])
@@ -0,0 +1,111 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from paws.operations.ARRAYS.ArrayYStats import ArrayYStats
+from paws.operations.ARRAYS.RollingYMean import RollingYMean
+from paws.stattools import RunningStats, RollingWindow
+
+
+def _patterns(n_patterns, n_points, seed=0):
+    rng = np.random.RandomState(seed)
+    data = rng.normal(5., 2., (n_patterns, n_points))
+    data[rng.rand(n_patterns, n_points) < 0.3] = np.nan
+    # a point without data, and a point with a single value
+    data[:, 0] = np.nan
+    data[1:, 1] = np.nan
+    return data
+
+
+def _assert_matches(stats, data, ddof=0):
+    with warnings.catch_warnings():
+        # numpy warns about the point without data
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(data, axis=0)
+        var = np.nanvar(data, axis=0, ddof=ddof)
+        y_min = np.nanmin(data, axis=0)
+        y_max = np.nanmax(data, axis=0)
+    count = (~np.isnan(data)).sum(axis=0)
+    assert np.array_equal(stats.count, count)
+    assert np.allclose(stats.mean_or_nan(), mean, equal_nan=True)
+    assert np.allclose(stats.variance(ddof), np.where(count > ddof, var, np.nan),
+                       equal_nan=True)
+    assert np.allclose(stats.sum, np.nansum(data, axis=0))
+    assert np.array_equal(stats.min, y_min, equal_nan=True)
+    assert np.array_equal(stats.max, y_max, equal_nan=True)
+
+
+def test_running_stats_with_nans():
+    data = _patterns(40, 12)
+    # chunks of several sizes, including single patterns
+    stats = RunningStats()
+    for i0, i1 in [(0, 1), (1, 8), (8, 9), (9, 25)]:
+        stats.update_chunk(data[i0:i1])
+    _assert_matches(stats, data[:25])
+    # merged with statistics computed separately
+    other = RunningStats().update_chunk(data[25:])
+    stats.merge(other)
+    for ddof in (0, 1):
+        _assert_matches(stats, data, ddof)
+    _assert_matches(RunningStats().merge(other), data[25:])
+
+
+def test_array_y_stats_checks_x():
+    x = np.linspace(0., 1., 12)
+    data = _patterns(10, 12)
+    arrays = [np.column_stack([x, y]) for y in data]
+    op = ArrayYStats()
+    stats = op.run_with(x_y_arrays=arrays[:6], chunk_size=4)['stats']
+    out = op.run_with(x_y_arrays=arrays[6:], stats=stats)
+    assert np.array_equal(out['x_ymean'][:, 0], x)
+    _assert_matches(out['stats'], data)
+    other_x = [np.column_stack([x+0.5, y]) for y in data]
+    with pytest.raises(ValueError):
+        op.run_with(x_y_arrays=other_x, stats=stats)
+    with pytest.raises(ValueError):
+        op.run_with(x_y_arrays=arrays[:2]+other_x[2:])
+    other = op.run_with(x_y_arrays=other_x)['stats']
+    with pytest.raises(ValueError):
+        RunningStats().merge(stats).merge(other)
+
+
+def test_rolling_window_with_nans():
+    data = _patterns(23, 12)
+    size = 5
+    # recomputing at another period than the window size,
+    # so that recomputes fall before, on and after evictions
+    for recompute_every in (None, 3, 1000):
+        window = RollingWindow(size, recompute_every=recompute_every)
+        for i, y in enumerate(data):
+            window.update(y)
+            last = data[max(i+1-size, 0):i+1]
+            assert np.array_equal(window.patterns(), last, equal_nan=True)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                mean = np.nanmean(last, axis=0)
+                variances = [np.nanvar(last, axis=0, ddof=ddof) for ddof in (0, 1)]
+            count = (~np.isnan(last)).sum(axis=0)
+            assert np.array_equal(window.count, count)
+            assert np.allclose(window.mean(), mean, equal_nan=True)
+            for ddof, var in enumerate(variances):
+                assert np.allclose(window.variance(ddof),
+                                   np.where(count > ddof, var, np.nan),
+                                   equal_nan=True)
+
+
+def test_rolling_y_mean_checks_x():
+    x = np.linspace(0., 1., 12)
+    data = _patterns(10, 12)
+    arrays = [np.column_stack([x, y]) for y in data]
+    op = RollingYMean()
+    state = op.run_with(x_y_arrays=arrays[:6], window=4)['window_state']
+    out = op.run_with(x_y_arrays=arrays[6:], window_state=state)
+    assert np.array_equal(out['x_ymean'][:, 0], x)
+    assert np.array_equal(out['window_state'].patterns(), data[6:],
+                          equal_nan=True)
+    other_x = [np.column_stack([x+0.5, y]) for y in data]
+    with pytest.raises(ValueError):
+        op.run_with(x_y_arrays=other_x, window_state=state)
+    with pytest.raises(ValueError):
+        op.run_with(x_y_arrays=arrays[:2]+other_x[2:], window=4)